@@ -0,0 +1,130 @@
+"""
+ベンチマーク: Bedrock の流量制御（limiter.py）あり/なしの比較
+
+使い方（backend/ から）
+    python bench/bench_bedrock_limiter.py --capacity 4 --clients 32 --requests 400
+    python bench/bench_bedrock_limiter.py --outage 3      # 最初の3秒は全件 503 を返す
+
+- ローカルの偽 Bedrock（同時 --capacity 件を超えると ThrottlingException）に対して
+  generater._invoke_claude を --clients スレッドから叩く
+- naive : 同時実行制御なし + 固定3回の指数バックオフ（従来の SDK リトライ相当）
+- guarded: limiter.ModelGuard 経由（AIMD + リトライ予算 + サーキットブレーカー）
+- upstream calls / throttled が少なく、p95 が短いほど上流に優しい
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import pathlib
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import generater  # noqa: E402
+import limiter  # noqa: E402
+
+
+class FakeBedrock:
+    """同時実行数 capacity を超えた分はスロットリングする偽 Bedrock"""
+
+    def __init__(self, capacity: int, latency: float, outage: float) -> None:
+        self.capacity = capacity
+        self.latency = latency
+        self.outage_until = time.monotonic() + outage
+        self.active = 0
+        self.calls = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId: str, body: str, **_: object) -> dict:
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            over = self.active > self.capacity
+            down = time.monotonic() < self.outage_until
+            if over or down:
+                self.throttled += 1
+        try:
+            if down:
+                time.sleep(0.005)
+                raise ClientError({"Error": {"Code": "ServiceUnavailableException", "Message": "down"}}, "InvokeModel")
+            if over:
+                time.sleep(0.01)
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+            time.sleep(self.latency)
+            text = json.dumps({"answer": "ok", "score_percent": 70, "improvement": "-"})
+            return {"body": io.BytesIO(json.dumps({"content": [{"text": text}]}).encode())}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def _naive(payload: dict) -> dict:
+    for attempt in range(3):
+        try:
+            resp = generater._bedrock.invoke_model(modelId=generater.CLAUDE_MODEL_ID, body=json.dumps(payload))
+            return generater._parse_claude_text(json.loads(resp["body"].read())["content"][0]["text"])
+        except ClientError:
+            if attempt == 2:
+                return generater._parse_claude_text("")
+            time.sleep(0.1 * 2 ** attempt)
+    raise AssertionError
+
+
+def _guarded(payload: dict) -> dict:
+    try:
+        return generater._invoke_claude(payload)
+    except limiter.BedrockUnavailable:
+        return generater._parse_claude_text("")
+
+
+def run(mode: str, args: argparse.Namespace) -> None:
+    fake = FakeBedrock(args.capacity, args.latency, args.outage)
+    generater._bedrock = fake
+    limiter._guards.clear()
+    call = _naive if mode == "naive" else _guarded
+
+    def one(_: int) -> tuple[float, bool]:
+        t0 = time.perf_counter()
+        result = call({})
+        return time.perf_counter() - t0, result.get("improvement") == "fallback"
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - t0
+
+    lat = sorted(r[0] * 1000 for r in results)
+    fallbacks = sum(r[1] for r in results)
+    print(
+        f"{mode:<8}{args.requests / wall:10.1f}{statistics.median(lat):10.0f}{lat[int(len(lat) * 0.95) - 1]:10.0f}"
+        f"{fallbacks:11d}{fake.calls:16d}{fake.throttled:11d}"
+    )
+    if mode == "guarded":
+        print(f"  guard: {limiter.snapshot()}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--capacity", type=int, default=4)
+    ap.add_argument("--latency", type=float, default=0.1)
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--outage", type=float, default=0.0)
+    args = ap.parse_args()
+
+    print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'fallbacks':>11}{'upstream calls':>16}{'throttled':>11}")
+    for mode in ("naive", "guarded"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
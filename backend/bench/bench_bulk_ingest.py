@@ -0,0 +1,159 @@
+"""
+ベンチマーク: meal_log のバックフィル（1行ずつ INSERT vs 一括投入）rows/sec
+
+使い方（backend/ から）
+    python bench/bench_bulk_ingest.py --rows 100000 --rtt-ms 1          # sqlite で代用
+    python bench/bench_bulk_ingest.py --backend mysql --rows 100000     # DB_* 環境変数の MySQL（ローカル推奨）
+
+- per-row: 従来の add_meal_log 相当（1行ごとに autocommit の INSERT 1文）。--per-row-rows 行だけ流して外挿
+- bulk   : ingest.ingest_lines（NDJSON を検証 → chunk_size 行ずつ executemany + トランザクション）
+- sqlite: SQL 1往復ごとに --rtt-ms を待って DB までのネットワーク往復を模擬する。
+          pymysql は executemany を複数行 INSERT 1文で送るので、executemany も1往復として数える。
+          日次ロールアップの作り直し（MySQL 構文）は sqlite では行わない
+- mysql: per-row は実際の add_meal_log（ロールアップ更新込み）。投入した行は bench_ingest_* ユーザで残る
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import database  # noqa: E402
+import ingest  # noqa: E402
+
+
+class _SqliteCursor:
+    def __init__(self, conn: "_SqliteConn") -> None:
+        self.conn = conn
+
+    def __enter__(self) -> "_SqliteCursor":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        pass
+
+    def execute(self, sql: str, args=None) -> None:
+        self.conn.roundtrip()
+        self.conn.db.execute(sql.replace("%s", "?"), args or ())
+
+    def executemany(self, sql: str, seq_args) -> None:
+        self.conn.roundtrip()
+        self.conn.db.executemany(sql.replace("%s", "?"), seq_args)
+
+
+class _SqliteConn:
+    """database.py から見て pymysql の接続っぽく振る舞う最小限のラッパ"""
+
+    def __init__(self, path: str, rtt: float) -> None:
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.rtt = rtt
+
+    def roundtrip(self) -> None:
+        time.sleep(self.rtt)
+
+    def cursor(self) -> _SqliteCursor:
+        return _SqliteCursor(self)
+
+    def begin(self) -> None:
+        self.roundtrip()
+        self.db.execute("BEGIN")
+
+    def commit(self) -> None:
+        self.roundtrip()
+        self.db.execute("COMMIT")
+
+    def rollback(self) -> None:
+        self.db.execute("ROLLBACK")
+
+    def ping(self, reconnect: bool = False) -> None:
+        pass
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _records(n: int, users: int) -> list[dict]:
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            "user_id": f"bench_ingest_{i % users}",
+            "created_at": (start + timedelta(hours=i)).isoformat(),
+            "weight_kg": 60 + i % 20,
+            "habits": i % 90,
+            "sleep_hour": 5 + i % 4,
+        }
+        for i in range(n)
+    ]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--per-row-rows", type=int, default=2000)
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--chunk-size", type=int, default=database.BULK_CHUNK_SIZE)
+    ap.add_argument("--rtt-ms", type=float, default=1.0)
+    args = ap.parse_args()
+
+    tmp = None
+    if args.backend == "sqlite":
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        tmp.close()
+        setup = sqlite3.connect(tmp.name)
+        setup.execute("PRAGMA journal_mode=WAL")
+        setup.execute(
+            "CREATE TABLE meal_log (id INTEGER PRIMARY KEY, user_id TEXT, created_at TEXT, "
+            "meal_image_url TEXT, weight_kg INT, habits INT, sleep_hour INT)"
+        )
+        setup.commit()
+        setup.close()
+        database._get_conn = lambda: _SqliteConn(tmp.name, args.rtt_ms / 1000)
+        database.refresh_daily_summaries = lambda user_ids: 0
+
+        def per_row(row: dict) -> None:
+            # 変更前の add_meal_log と同じく autocommit の単発 INSERT
+            with database._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(database._MEAL_LOG_INSERT, tuple(row.get(c) for c in database._MEAL_LOG_COLUMNS))
+    else:
+        database.bootstrap()
+
+        def per_row(row: dict) -> None:
+            database.add_meal_log(row["user_id"], row["weight_kg"], row["habits"], row["sleep_hour"])
+
+    records = _records(args.rows, args.users)
+
+    sample = records[: args.per_row_rows]
+    t0 = time.perf_counter()
+    for rec in sample:
+        per_row(ingest.MealLogRow.model_validate(rec).model_dump())
+    per_row_rate = len(sample) / (time.perf_counter() - t0)
+
+    lines = (json.dumps(r) for r in records)
+    report = ingest.ingest_lines(
+        lines, "ndjson", chunk_size=args.chunk_size,
+        on_progress=lambda p: p["chunk"] % 20 == 0 and print(f"  chunk {p['chunk']}: {p['total']} rows, {p['rows_per_sec']} rows/s"),
+    )
+
+    print(f"{'mode':<10}{'rows/s':>12}{'time for ' + str(args.rows) + ' rows':>24}")
+    print(f"{'per-row':<10}{per_row_rate:12.0f}{args.rows / per_row_rate:22.1f} s  (extrapolated from {len(sample)} rows)")
+    print(f"{'bulk':<10}{report['rows_per_sec']:12.0f}{report['elapsed_sec']:22.1f} s  ({report['chunks']} chunks, rejected {report['rejected']})")
+    print(f"speedup: {report['rows_per_sec'] / per_row_rate:.0f}x")
+
+    database.close_pool()
+    if tmp is not None:
+        os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+ベンチマーク: Claude に渡すテキスト部分の大きさ（従来の JSON 埋め込み vs 圧縮表現）
+
+使い方（backend/ から）
+    python bench/bench_claude_context.py                    # オフライン（トークン数は推定）
+    python bench/bench_claude_context.py --bedrock          # CountTokens で実測 + 実呼び出しのレイテンシ
+    CLAUDE_PROMPT_CACHE=1 python bench/bench_claude_context.py --bedrock --repeat 3
+
+- フィクスチャ: 新規ユーザ / 数日だけ記録 / 毎日記録 / 体重だけ（ウェアラブル）/ 30日分
+- legacy : 変更前の形（システム + 指示文 + json.dumps(init) + json.dumps(N_day_ago×7)）
+- compact: 現在の _build_claude_payload（システムプロンプト固定 + prompt_context.encode_context）
+- 画像は両者で同じなので、比較はテキストのみ（画像ブロックを除いて数える）
+- static tok: 毎回同じシステムプロンプト部分（プロンプトキャッシュの対象）
+- プロンプトキャッシュは最小長（Sonnet で 1024 トークン）未満の前置きには効かない。
+  実運用では顔画像（約1.5kトークン）までがキャッシュ対象になり、同じユーザの2回目以降で効く
+- 推定トークン = ASCII 4文字で1 + 非ASCII 1文字で1（日本語はおおむね 1文字 ≒ 1トークン）
+- --bedrock: usage の input_tokens / cache_read_input_tokens と所要時間を表示（--repeat 回ずつ）
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import generater  # noqa: E402
+import rollup  # noqa: E402
+
+TODAY = date(2025, 9, 30)
+
+_LEGACY_SYSTEM = (
+    "あなたは誠実なヘルスコーチです。医療的診断は行いません。"
+    "必ず次のJSONだけを返してください："
+    "{"
+    "\"answer\":\"日本語で2〜4文の評価\","
+    "\"score_percent\":整数(0〜100),"
+    "\"improvement\":\"改善案を日本語で1〜2文\""
+    "}"
+)
+
+
+def _logs(user: str, n_days: int, every: int = 1, weight_only: bool = False) -> list[dict]:
+    rows = []
+    for i in range(0, n_days, every):
+        rows.append({
+            "user_id": user,
+            "created_at": datetime.combine(TODAY - timedelta(days=i), datetime.min.time()) + timedelta(hours=8),
+            "meal_image_url": None if weight_only else f"https://example.com/{user}/{i}.jpg",
+            "weight_kg": 72 - i // 5,
+            "habits": None if weight_only else 20 + i % 3 * 10,
+            "sleep_hour": None if weight_only else 6 + i % 2,
+        })
+    return rows
+
+
+def fixtures() -> dict[str, tuple[dict, list[dict]]]:
+    # weight_kg などは今回のリクエストで注入される値（= 履歴の今日の行と同じ）
+    base = {"height": "170", "gender": "female", "years": "29", "weight_kg": 72, "exercise_time": 20, "sleep_hour": 6}
+    return {
+        "new_user": ({"height": "165", "gender": None, "years": None, "weight_kg": 60}, []),
+        "sparse": (base, _logs("sparse", 7, every=3)),
+        "daily": (base, _logs("daily", 7)),
+        "weight_only": ({**base, "exercise_time": None, "sleep_hour": None}, _logs("wearable", 7, weight_only=True)),
+        "month": (base, _logs("month", 30)),
+    }
+
+
+def legacy_past(user: str, logs: list[dict]) -> dict:
+    """変更前の fetch_past_info（直近7件 + None 埋め）"""
+    past = {}
+    for i in range(7):
+        past[f"{i}_day_ago"] = logs[i] if i < len(logs) else {
+            "user_id": user, "created_at": None, "meal_image_url": None,
+            "weight_kg": None, "habits": None, "sleep_hour": None,
+        }
+    for v in past.values():
+        v.pop("meal_image_url", None)
+    return past
+
+
+def legacy_texts(init: dict, past: dict) -> list[str]:
+    user_text = (
+        "以下の情報から食事の健全性と将来リスクを評価してください。"
+        "score_percent は 0〜100 で、低いほどリスクが高いとします。"
+        "\n\n[CONTEXT]\n"
+        f"パーソナル情報: {json.dumps(init, ensure_ascii=False)}\n"
+        f"過去情報: {json.dumps(past, ensure_ascii=False, default=generater.json_safe)}\n"
+        "- 顔画像から敏感属性は推論しない\n"
+        "- 医療診断はしない\n"
+        "- 出力は指定JSONのみ\n"
+    )
+    return [_LEGACY_SYSTEM, user_text, "FACEは本人の同一性文脈のみ。敏感属性は推論しない。"]
+
+
+def compact_payload(init: dict, logs: list[dict]) -> dict:
+    days = rollup.rebuild(reversed(logs), TODAY)
+    past = rollup.compact(days, rollup.summarize(days, TODAY))
+    return generater._build_claude_payload(b"", b"", past=past, init=dict(init))
+
+
+def payload_texts(payload: dict) -> list[str]:
+    system = payload["system"]
+    texts = [system if isinstance(system, str) else system[0]["text"]]
+    texts += [c["text"] for c in payload["messages"][0]["content"] if c.get("type") == "text" and c["text"]]
+    return texts
+
+
+def estimate_tokens(texts: list[str]) -> int:
+    ascii_chars = sum(1 for t in texts for ch in t if ord(ch) < 128)
+    other = sum(1 for t in texts for ch in t if ord(ch) >= 128)
+    return round(ascii_chars / 4 + other)
+
+
+def _text_payload(texts: list[str], system_blocks=None) -> dict:
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 300,
+        "system": system_blocks if system_blocks is not None else texts[0],
+        "messages": [{"role": "user", "content": [{"type": "text", "text": t} for t in texts[1:]]}],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bedrock", action="store_true")
+    ap.add_argument("--repeat", type=int, default=1)
+    args = ap.parse_args()
+    # 画像ブロックは比較対象外なので前処理を通さず空にする
+    generater._image_block = lambda b: {"type": "text", "text": ""}
+
+    print(f"{'user':<13}{'legacy chars':>13}{'compact chars':>14}{'legacy tok':>11}{'compact tok':>12}{'static tok':>11}{'encode us':>10}")
+    totals = [0, 0]
+    cases = []
+    for name, (init, logs) in fixtures().items():
+        legacy = legacy_texts(dict(init), legacy_past(name, [dict(r) for r in logs]))
+        t0 = time.perf_counter()
+        payload = compact_payload(init, logs)
+        encode_us = (time.perf_counter() - t0) * 1e6
+        compact = payload_texts(payload)
+        lt, ct = estimate_tokens(legacy), estimate_tokens(compact)
+        totals[0] += lt
+        totals[1] += ct
+        cases.append((name, legacy, compact, payload))
+        print(f"{name:<13}{sum(map(len, legacy)):13d}{sum(map(len, compact)):14d}{lt:11d}{ct:12d}"
+              f"{estimate_tokens(compact[:1]):11d}{encode_us:10.0f}")
+    print(f"estimated text tokens: {totals[0]} -> {totals[1]} ({totals[1] / totals[0]:.0%})")
+    print("\nexample compact context (daily):")
+    print(cases[2][2][-1])
+
+    if not args.bedrock:
+        return
+
+    client = generater._model()
+    model = generater.CLAUDE_MODEL_ID
+    print(f"\nBedrock ({model}, prompt cache={'on' if generater.CLAUDE_PROMPT_CACHE else 'off'})")
+    print(f"{'user':<13}{'variant':<9}{'input tok':>10}{'cache read':>11}{'p50 ms':>9}")
+    for name, legacy, compact, payload in cases:
+        for variant, body in (("legacy", _text_payload(legacy)),
+                              ("compact", _text_payload(compact, payload["system"]))):
+            counted = client.count_tokens(modelId=model, input={"invokeModel": {"body": json.dumps(body)}})
+            latencies, cache_read = [], 0
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                resp = client.invoke_model(modelId=model, body=json.dumps(body))
+                latencies.append((time.perf_counter() - t0) * 1000)
+                usage = json.loads(resp["body"].read()).get("usage", {})
+                cache_read = usage.get("cache_read_input_tokens", 0)
+            print(f"{name:<13}{variant:<9}{counted['inputTokens']:10d}{cache_read:11d}{statistics.median(latencies):9.0f}")
+
+
+if __name__ == "__main__":
+    main()
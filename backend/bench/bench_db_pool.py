@@ -0,0 +1,118 @@
+"""
+ベンチマーク: 都度接続 vs コネクションプール（requests/sec）
+
+使い方（backend/ から）
+    python bench/bench_db_pool.py --requests 2000 --concurrency 16 --connect-latency-ms 20
+    python bench/bench_db_pool.py --backend mysql   # DB_* 環境変数の MySQL に対して計測
+
+- sqlite: ローカルの sqlite3 ファイルで代用。RDS の TCP+TLS+認証 を --connect-latency-ms で模擬
+- 1リクエスト = /generate-answer 相当の 3 クエリ（INSERT, SELECT x2）
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from db_pool import ConnectionPool  # noqa: E402
+
+
+def _sqlite_factory(path: str, latency: float):
+    def connect():
+        time.sleep(latency)  # ハンドシェイク相当
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        return conn
+    return connect
+
+
+def _sqlite_request(conn) -> None:
+    conn.execute("INSERT INTO meal_log (user_id, weight_kg) VALUES (?, ?)", ("bench", 70))
+    conn.execute("SELECT * FROM user_profile WHERE user_id=?", ("bench",)).fetchone()
+    conn.execute(
+        "SELECT * FROM meal_log WHERE user_id=? ORDER BY id DESC LIMIT 7", ("bench",)
+    ).fetchall()
+
+
+def _mysql_request(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+        cur.execute("SELECT 1")
+        cur.execute("SELECT 1")
+
+
+async def _drive(call, n: int, concurrency: int) -> float:
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await loop.run_in_executor(executor, call)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    elapsed = time.perf_counter() - t0
+    executor.shutdown()
+    return elapsed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    ap.add_argument("--requests", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--pool-max", type=int, default=16)
+    ap.add_argument("--connect-latency-ms", type=float, default=20.0)
+    args = ap.parse_args()
+
+    if args.backend == "sqlite":
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        tmp.close()
+        setup = sqlite3.connect(tmp.name)
+        setup.execute("PRAGMA journal_mode=WAL")
+        setup.execute("CREATE TABLE user_profile (user_id TEXT PRIMARY KEY, height INT)")
+        setup.execute("CREATE TABLE meal_log (id INTEGER PRIMARY KEY, user_id TEXT, weight_kg INT)")
+        setup.commit()
+        setup.close()
+        connect = _sqlite_factory(tmp.name, args.connect_latency_ms / 1000)
+        request = _sqlite_request
+    else:
+        import database
+        connect = database._get_conn
+        request = _mysql_request
+
+    def per_call():
+        conn = connect()
+        try:
+            request(conn)
+        finally:
+            conn.close()
+
+    pool = ConnectionPool(connect, min_size=1, max_size=args.pool_max)
+    pool.fill()
+
+    def pooled():
+        with pool.connection() as conn:
+            request(conn)
+
+    for name, call in (("per-call connect", per_call), ("pooled", pooled)):
+        elapsed = asyncio.run(_drive(call, args.requests, args.concurrency))
+        print(f"{name:>18}: {args.requests / elapsed:8.1f} req/s  ({elapsed:.2f}s)")
+    print(f"pool stats: {pool.stats}")
+    pool.close()
+
+    if args.backend == "sqlite":
+        os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,658 @@
+"""
+ベンチマーク: API 全体の負荷試験（/init → /generate-answer を指定の並列数で流す）
+
+使い方（backend/ から）
+    python bench/bench_e2e_load.py                                         # 既定: 32 並列 × 300 リクエスト
+    python bench/bench_e2e_load.py --concurrency 64 --requests 1000 --out bench/results/$(git rev-parse --short HEAD).json
+    python bench/bench_e2e_load.py --claude-ms 0 --nova-ms 0               # 自前のオーバーヘッドだけを測る
+    python bench/bench_e2e_load.py --workers 4                             # serve.py の複数ワーカーで起動
+    python bench/bench_e2e_load.py --compare bench/results/old.json bench/results/new.json --max-regression 10
+
+構成（ネットワーク・AWS 不要）
+- API: main.main を uvicorn で別プロセスに起動（メモリの最大値をそのプロセスだけで測るため）
+       --workers N なら serve.py で N ワーカー（共有キャッシュつき）。メモリは子孫プロセスの合計
+- MySQL: プロセス内のメモリ上の代用（database._get_conn を差し替え）。SQL 1文ごとに --db-rtt-ms 待つ。
+         行ロックは再現しない。--db mysql なら DB_* 環境変数の MySQL をそのまま使う
+         --workers N のときは代用 DB をこのプロセスに置き、各ワーカーから multiprocessing.managers で使う
+- 画像ホスト: このプロセスで立てる HTTP サーバ（ノイズ画像の JPEG。--image-latency-ms 待ってから返す）
+- Bedrock: MODEL_BACKEND=stub（--claude-ms / --nova-ms / --jitter / --throttle-rate）。
+           --model-backend replay なら MODEL_FIXTURES_DIR の記録を再生
+
+出力
+- /init と /generate-answer それぞれの throughput, p50/p95/p99/max, エラー数, SQL 文数（X-DB-Statements）
+- /generate-answer のステージ別所要時間（Server-Timing）
+- API プロセスのメモリ（起動直後の RSS と最大 RSS）, 終了時の /cache/stats
+- --out に JSON で保存（コミット・引数つき）。--compare で2つの結果を比べ、--max-regression % を超えて
+  悪化していれば終了コード 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import pathlib
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.managers import BaseManager
+from typing import Any, Dict, List, Optional
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC))
+
+
+# =============================
+# MySQL の代用（API プロセス側で使う）
+# =============================
+class _MemoryDB:
+    """database.py が発行する SQL だけを解釈するメモリ上の表"""
+
+    def __init__(self, rtt: float) -> None:
+        self.rtt = rtt
+        self.lock = threading.Lock()
+        self.version = 0
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+        self.meal_log: Dict[str, List[Dict[str, Any]]] = {}
+        self.summaries: Dict[str, Dict[str, Any]] = {}
+        self.answers = 0
+        self.future_images: Dict[Any, Dict[str, Any]] = {}
+
+    def roundtrip(self) -> None:
+        time.sleep(self.rtt)
+
+    def execute(self, sql: str, args: Any, roundtrip: bool = True) -> List[Dict[str, Any]]:
+        if roundtrip:
+            time.sleep(self.rtt)
+        q = " ".join(sql.split())
+        now = datetime.now()
+        with self.lock:
+            if q.startswith(("CREATE ", "ALTER ", "DROP ")) or "RELEASE_LOCK" in q:
+                return []
+            if q == "SELECT 1":
+                return [{"1": 1}]
+            if "GET_LOCK" in q:
+                return [{"got": 1}]
+            if "MAX(version)" in q:
+                return [{"v": self.version}]
+            if q.startswith("INSERT INTO schema_version"):
+                self.version = max(self.version, args[0])
+                return []
+            if q.startswith("INSERT INTO user_profile"):
+                self.profiles[args[0]] = dict(zip(("height", "gender", "years", "individual_photo_url"), args[1:]))
+                return []
+            if q.startswith("SELECT") and "FROM user_profile" in q:
+                row = self.profiles.get(args[0])
+                return [dict(row)] if row else []
+            if q.startswith("INSERT INTO meal_log"):
+                user_id, image, w, h, s = args[:5]
+                created = args[5] if len(args) > 5 else now
+                self.meal_log.setdefault(user_id, []).append(
+                    {"meal_image_url": image, "weight_kg": w, "habits": h, "sleep_hour": s, "created_at": created}
+                )
+                return []
+            if q.startswith("SELECT") and "FROM meal_log" in q:
+                rows = sorted(self.meal_log.get(args[0], []), key=lambda r: r["created_at"])
+                return [{**r, "now": now} for r in rows]
+            if q.startswith("INSERT INTO user_daily_summary"):
+                self.summaries[args[0]] = {"user_id": args[0], "days_json": args[1]}
+                return []
+            if q.startswith("INSERT IGNORE INTO user_daily_summary"):
+                self.summaries.setdefault(args[0], {"user_id": args[0], "days_json": args[1]})
+                return []
+            if q.startswith("SELECT") and "FROM user_daily_summary" in q:
+                # 後回し書き込みのバッチは WHERE user_id IN (...) でまとめて読む
+                rows = [self.summaries.get(user_id) for user_id in (args if " IN (" in q else args[:1])]
+                return [{**row, "now": now} for row in rows if row]
+            if q.startswith("INSERT INTO user_future_image"):
+                self.future_images[(args[0], args[1])] = {"image_key": args[2], "future_image_url": args[3]}
+                return []
+            if q.startswith("SELECT") and "FROM user_future_image" in q:
+                return [{"variant": variant, **rec} for (user_id, variant), rec in self.future_images.items()
+                        if user_id == args[0]]
+            if q.startswith("INSERT INTO generated_answers"):
+                self.answers += 1
+                return []
+        raise NotImplementedError(f"代用 DB が知らない SQL です: {q[:80]}")
+
+
+class _MemoryCursor:
+    def __init__(self, db: _MemoryDB) -> None:
+        self.db = db
+        self.rows: List[Dict[str, Any]] = []
+        self.rowcount = 0
+
+    def __enter__(self) -> "_MemoryCursor":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        pass
+
+    def execute(self, sql: str, args=None) -> int:
+        self.rows = self.db.execute(sql, args)
+        self.rowcount = len(self.rows)
+        return self.rowcount
+
+    def executemany(self, sql: str, seq_args) -> int:
+        # pymysql と同じく複数行 INSERT 1文（1往復）として扱う
+        self.db.roundtrip()
+        n = 0
+        for args in seq_args:
+            self.db.execute(sql, args, roundtrip=False)
+            n += 1
+        self.rowcount = n
+        return n
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        return list(self.rows)
+
+
+class _MemoryConn:
+    def __init__(self, db: _MemoryDB) -> None:
+        self.db = db
+
+    def cursor(self) -> _MemoryCursor:
+        return _MemoryCursor(self.db)
+
+    def begin(self) -> None:
+        self.db.roundtrip()
+
+    def commit(self) -> None:
+        self.db.roundtrip()
+
+    def rollback(self) -> None:
+        pass
+
+    def ping(self, reconnect: bool = False) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def serve(args: argparse.Namespace) -> None:
+    """API プロセス（--serve-port 付きで自分自身を起動したとき）"""
+    import uvicorn
+
+    import database
+
+    if args.db == "memory":
+        db = _MemoryDB(args.db_rtt_ms / 1000)
+        database._get_conn = lambda: _MemoryConn(db)
+
+    import main
+
+    uvicorn.run(main.main, host="127.0.0.1", port=args.serve_port, log_level="warning", access_log=False)
+
+
+# =============================
+# 複数ワーカー（--workers）: 代用 DB をこのプロセスに置いて全ワーカーで共有する
+# =============================
+class _DBManager(BaseManager):
+    pass
+
+
+def _serve_shared_db(rtt: float) -> Any:
+    """代用 DB を multiprocessing.managers のサーバとして公開する（stop_event.set() で止める）"""
+    db = _MemoryDB(rtt)
+
+    class Manager(_DBManager):
+        pass
+
+    Manager.register("db", callable=lambda: db)
+    server = Manager(address=("127.0.0.1", 0), authkey=os.urandom(16)).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_app():
+    """serve.py --factory から各ワーカーで呼ばれる（BENCH_* 環境変数は run() が設定する）"""
+    import database
+
+    if os.getenv("BENCH_DB", "memory") == "memory":
+        host, port = os.environ["BENCH_DB_ADDR"].rsplit(":", 1)
+        _DBManager.register("db")
+        manager = _DBManager(address=(host, int(port)), authkey=bytes.fromhex(os.environ["BENCH_DB_AUTHKEY"]))
+        manager.connect()
+        db = manager.db()  # プロキシはスレッドごとに接続を持つので DB スレッドから直接使える
+        database._get_conn = lambda: _MemoryConn(db)
+
+    import main
+
+    return main.main
+
+
+# =============================
+# 画像ホストの代用（負荷をかける側で使う）
+# =============================
+def _noise_jpeg(px: int, seed: int) -> bytes:
+    from PIL import Image
+
+    img = Image.effect_noise((px, px), 40 + seed % 30).convert("RGB")
+    img = Image.merge("RGB", [c.point(lambda v, k=k: (v + seed * (k + 3)) % 256) for k, c in enumerate(img.split())])
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+class _ImageHost:
+    """/face/<n>.jpg と /meal/<n>.jpg を返す HTTP/1.1 サーバ"""
+
+    def __init__(self, meal_variants: int, meal_px: int, face_px: int, latency: float) -> None:
+        self.meals = [_noise_jpeg(meal_px, 1000 + i) for i in range(meal_variants)]
+        self.face_px = face_px
+        self.faces: Dict[int, bytes] = {}
+        self.lock = threading.Lock()
+        self.latency = latency
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                m = re.fullmatch(r"/(face|meal)/(\d+)\.jpg", self.path)
+                if not m:
+                    self.send_error(404)
+                    return
+                time.sleep(host.latency)
+                body = host.image(m.group(1), int(m.group(2)))
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def image(self, kind: str, n: int) -> bytes:
+        if kind == "meal":
+            return self.meals[n % len(self.meals)]
+        with self.lock:
+            if n not in self.faces:
+                self.faces[n] = _noise_jpeg(self.face_px, n)
+            return self.faces[n]
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+# =============================
+# 集計
+# =============================
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 2)
+
+
+def _latency(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+        "max": round(max(values), 2) if values else None,
+        "mean": round(sum(values) / len(values), 2) if values else None,
+    }
+
+
+def _server_timing(header: str) -> Dict[str, float]:
+    out = {}
+    for part in header.split(","):
+        m = re.match(r"\s*([\w-]+);dur=([\d.]+)", part)
+        if m:
+            out[m.group(1)] = float(m.group(2))
+    return out
+
+
+def summarize(samples: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+    ok = [s for s in samples if s["status"] == 200]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if s["status"] != 200:
+            errors[str(s["status"])] = errors.get(str(s["status"]), 0) + 1
+    stmts = [s["db_statements"] for s in ok if s["db_statements"] is not None]
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else 0.0,
+        "latency_ms": _latency([s["ms"] for s in ok]),
+        "db_statements_mean": round(sum(stmts) / len(stmts), 2) if stmts else None,
+    }
+
+
+def stage_breakdown(samples: List[Dict[str, Any]]) -> Dict[str, Dict[str, Optional[float]]]:
+    by_stage: Dict[str, List[float]] = {}
+    for s in samples:
+        for name, ms in s["stages"].items():
+            by_stage.setdefault(name, []).append(ms)
+    return {name: _latency(values) for name, values in by_stage.items()}
+
+
+# =============================
+# 負荷
+# =============================
+async def _drive(client, make_request, n: int, concurrency: int) -> tuple[List[Dict[str, Any]], float]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(n):
+        queue.put_nowait(i)
+    samples: List[Dict[str, Any]] = []
+
+    async def worker() -> None:
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            method, path, body = make_request(i)
+            t0 = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body)
+                status, headers = resp.status_code, resp.headers
+            except Exception as e:
+                status, headers = type(e).__name__, {}
+            stmts = headers.get("x-db-statements")
+            samples.append({
+                "ms": (time.perf_counter() - t0) * 1000,
+                "status": status,
+                "stages": _server_timing(headers.get("server-timing", "")),
+                "db_statements": int(stmts) if stmts else None,
+            })
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - t0
+
+
+def _proc_memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Linux の /proc から RSS と最大 RSS（VmHWM）を読む。無い環境では None"""
+    out: Dict[str, Optional[float]] = {"rss_mb": None, "rss_peak_mb": None}
+    try:
+        text = pathlib.Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return out
+    for key, name in (("VmRSS", "rss_mb"), ("VmHWM", "rss_peak_mb")):
+        m = re.search(rf"^{key}:\s+(\d+) kB", text, re.M)
+        if m:
+            out[name] = round(int(m.group(1)) / 1024, 1)
+    return out
+
+
+def _tree_memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    """pid と子孫（ワーカー・画像処理プール・共有キャッシュ）の合計。最大 RSS は各プロセスの最大の和（上限の目安）"""
+    pids, i = [pid], 0
+    while i < len(pids):
+        for path in pathlib.Path(f"/proc/{pids[i]}/task").glob("*/children"):
+            try:
+                pids += [int(c) for c in path.read_text().split()]
+            except OSError:
+                pass
+        i += 1
+    total: Dict[str, Optional[float]] = {"rss_mb": None, "rss_peak_mb": None}
+    for p in pids:
+        for key, value in _proc_memory_mb(p).items():
+            if value is not None:
+                total[key] = round((total[key] or 0.0) + value, 1)
+    return total
+
+
+def _children_peak_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_meta() -> Dict[str, Any]:
+    def git(*cmd: str) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *cmd], cwd=SRC, capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_load(args: argparse.Namespace, base: str, images: _ImageHost, pid: int) -> Dict[str, Any]:
+    import httpx
+
+    memory = _tree_memory_mb if args.workers else _proc_memory_mb
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=args.timeout) as client:
+        for _ in range(300):
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("API プロセスが起動しませんでした。")
+        memory_idle = memory(pid)
+
+        def init_request(i: int):
+            return "POST", "/init", {
+                "user_id": f"load_{i}", "name": f"load_{i}", "age": 20 + i % 50, "height": 150 + i % 40,
+                "gender": ("female", "male")[i % 2], "picture": f"{images.base}/face/{i}.jpg",
+            }
+
+        rng = random.Random(args.seed)
+
+        def generate_request(i: int):
+            return "POST", "/generate-answer", {
+                "name": f"load_{i % args.users}",
+                "weight": 55 + rng.randrange(30),
+                "exercise_time": rng.choice([None, 0, 15, 30, 60]),
+                "sleep_time": rng.choice([None, 5, 6, 7, 8]),
+                "picture": f"{images.base}/meal/{rng.randrange(args.meal_variants)}.jpg",
+            }
+
+        init_samples, init_wall = await _drive(client, init_request, args.users, args.concurrency)
+        print(f"init: {args.users} users in {init_wall:.1f}s")
+        if args.warmup:
+            await _drive(client, generate_request, args.warmup, args.concurrency)
+        gen_samples, gen_wall = await _drive(client, generate_request, args.requests, args.concurrency)
+        stats = (await client.get("/cache/stats")).json()
+
+    return {
+        "init": summarize(init_samples, init_wall),
+        "generate": summarize(gen_samples, gen_wall),
+        "stages": stage_breakdown([s for s in gen_samples if s["status"] == 200]),
+        "memory": {"rss_idle_mb": memory_idle["rss_mb"], **memory(pid)},
+        "server_stats": stats,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    images = _ImageHost(args.meal_variants, args.meal_px, args.face_px, args.image_latency_ms / 1000)
+    port = _free_port()
+    blob_dir = tempfile.mkdtemp(prefix="bench_blobs_")
+    env = {
+        **os.environ,
+        "MODEL_BACKEND": args.model_backend,
+        "STUB_CLAUDE_MS": str(args.claude_ms),
+        "STUB_NOVA_MS": str(args.nova_ms),
+        "STUB_JITTER": str(args.jitter),
+        "STUB_THROTTLE_RATE": str(args.throttle_rate),
+        "STUB_SEED": str(args.seed),
+        "BLOB_DIR": blob_dir,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(SRC), os.environ.get("PYTHONPATH")])),
+    }
+    db_server = None
+    if args.workers:
+        env.update({"BENCH_DB": args.db, "WEB_ACCESS_LOG": "0", "WEB_LOG_LEVEL": "warning"})
+        if args.db == "memory":
+            db_server = _serve_shared_db(args.db_rtt_ms / 1000)
+            host, db_port = db_server.address
+            env.update({"BENCH_DB_ADDR": f"{host}:{db_port}", "BENCH_DB_AUTHKEY": bytes(db_server.authkey).hex()})
+        env["PYTHONPATH"] = os.pathsep.join([str(pathlib.Path(__file__).resolve().parent), env["PYTHONPATH"]])
+        cmd = [sys.executable, str(SRC / "serve.py"), "--app", "bench_e2e_load:create_app", "--factory",
+               "--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(port)]
+    else:
+        cmd = [sys.executable, __file__, "--serve-port", str(port), "--db", args.db, "--db-rtt-ms", str(args.db_rtt_ms)]
+    proc = subprocess.Popen(cmd, env=env)
+    try:
+        result = asyncio.run(run_load(args, f"http://127.0.0.1:{port}", images, proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+        images.close()
+        if db_server is not None:
+            db_server.stop_event.set()
+    if result["memory"]["rss_peak_mb"] is None:
+        result["memory"]["rss_peak_mb"] = _children_peak_mb()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "compare", "max_regression", "serve_port")}
+    return {
+        "meta": {
+            **_git_meta(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": config,
+        **result,
+    }
+
+
+# =============================
+# 表示・比較
+# =============================
+def _fmt(v: Any) -> str:
+    return "-" if v is None else f"{v:g}" if isinstance(v, float) else str(v)
+
+
+def report(res: Dict[str, Any]) -> None:
+    meta = res["meta"]
+    print(f"\ncommit {meta['commit']}{' (dirty)' if meta['dirty'] else ''}  {meta['timestamp']}")
+    print(f"{'endpoint':<18}{'ok':>6}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'sql/req':>9}")
+    for name in ("init", "generate"):
+        s, lat = res[name], res[name]["latency_ms"]
+        print(f"{name:<18}{s['ok']:6d}{sum(s['errors'].values()):6d}{s['throughput_rps']:9.1f}"
+              + "".join(f"{_fmt(lat[k]):>9}" for k in ("p50", "p95", "p99", "max"))
+              + f"{_fmt(s['db_statements_mean']):>9}")
+        if s["errors"]:
+            print(f"  errors: {s['errors']}")
+    print(f"\n{'stage (ms)':<18}{'p50':>9}{'p95':>9}{'p99':>9}{'mean':>9}")
+    for name, lat in res["stages"].items():
+        print(f"{name:<18}" + "".join(f"{_fmt(lat[k]):>9}" for k in ("p50", "p95", "p99", "mean")))
+    mem = res["memory"]
+    print(f"\nmemory: idle {_fmt(mem['rss_idle_mb'])} MB, end {_fmt(mem['rss_mb'])} MB, peak {_fmt(mem['rss_peak_mb'])} MB")
+
+
+# (指標, 大きい方が良いか)
+_COMPARED = [
+    ("generate.throughput_rps", True),
+    ("generate.latency_ms.p50", False),
+    ("generate.latency_ms.p95", False),
+    ("generate.latency_ms.p99", False),
+    ("init.latency_ms.p95", False),
+    ("generate.db_statements_mean", False),
+    ("memory.rss_peak_mb", False),
+]
+
+
+def _get(d: Dict[str, Any], path: str) -> Any:
+    for key in path.split("."):
+        d = d.get(key) if isinstance(d, dict) else None
+    return d
+
+
+def compare(base_path: str, new_path: str, max_regression: Optional[float]) -> int:
+    base, new = (json.loads(pathlib.Path(p).read_text(encoding="utf-8")) for p in (base_path, new_path))
+    print(f"{'metric':<30}{base['meta']['commit'] or 'base':>12}{new['meta']['commit'] or 'new':>12}{'change':>10}")
+    metrics = _COMPARED + [(f"stages.{name}.p95", False) for name in new.get("stages", {})]
+    regressed = []
+    for path, higher_is_better in metrics:
+        a, b = _get(base, path), _get(new, path)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a * 100 if a else 0.0
+        worse = -change if higher_is_better else change
+        mark = ""
+        if max_regression is not None and worse > max_regression and path in dict(_COMPARED):
+            regressed.append(path)
+            mark = "  <- regression"
+        print(f"{path:<30}{_fmt(a):>12}{_fmt(b):>12}{change:+9.1f}%{mark}")
+    if base.get("config") != new.get("config"):
+        print("\n注意: 2つの結果の実行条件（config）が異なります")
+    return 1 if regressed else 0
+
+
+def parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=300)
+    ap.add_argument("--warmup", type=int, default=20)
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--db", choices=["memory", "mysql"], default="memory")
+    ap.add_argument("--db-rtt-ms", type=float, default=1.0)
+    ap.add_argument("--model-backend", choices=["stub", "replay", "bedrock"], default="stub")
+    ap.add_argument("--claude-ms", type=float, default=1200)
+    ap.add_argument("--nova-ms", type=float, default=2500)
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--throttle-rate", type=float, default=0.0)
+    ap.add_argument("--meal-variants", type=int, default=16)
+    ap.add_argument("--meal-px", type=int, default=1600)
+    ap.add_argument("--face-px", type=int, default=512)
+    ap.add_argument("--image-latency-ms", type=float, default=20)
+    ap.add_argument("--workers", type=int, default=0, help="serve.py のワーカー数（0 なら uvicorn を直接1プロセス）")
+    ap.add_argument("--out", help="結果の JSON を保存するパス")
+    ap.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    ap.add_argument("--max-regression", type=float, help="--compare で許す悪化（%%）")
+    ap.add_argument("--serve-port", type=int, help=argparse.SUPPRESS)
+    return ap
+
+
+def main() -> None:
+    args = parser().parse_args()
+
+    if args.serve_port:
+        serve(args)
+        return
+    if args.compare:
+        sys.exit(compare(*args.compare, args.max_regression))
+
+    res = run(args)
+    report(res)
+    if args.out:
+        out = pathlib.Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(res, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+ベンチマーク: 画像前処理による Bedrock ペイロードサイズと所要時間の変化
+
+使い方（backend/ から）
+    python bench/bench_image_preprocess.py --corpus path/to/images   # 手元の写真で計測
+    python bench/bench_image_preprocess.py                           # 合成画像（スマホ写真相当）で計測
+
+- payload: base64 化した JSON 上のサイズ（Claude/Nova に実際に送る量）
+- e2e: 前処理時間 + payload を --uplink-mbps で送る時間（Bedrock 側の処理時間は含まない）
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import io
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import images  # noqa: E402
+
+
+def _synthetic_corpus() -> dict[str, bytes]:
+    from PIL import Image
+
+    corpus = {}
+    for name, size, fmt in (
+        ("phone_12mp.jpg", (4032, 3024), "JPEG"),
+        ("phone_portrait.jpg", (3024, 4032), "JPEG"),
+        ("screenshot.png", (1170, 2532), "PNG"),
+        ("small.jpg", (800, 600), "JPEG"),
+    ):
+        im = Image.effect_noise(size, 48).convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, format=fmt, quality=95)
+        corpus[name] = buf.getvalue()
+    return corpus
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus", type=pathlib.Path)
+    ap.add_argument("--uplink-mbps", type=float, default=50.0)
+    args = ap.parse_args()
+
+    if args.corpus:
+        corpus = {p.name: p.read_bytes() for p in sorted(args.corpus.iterdir()) if p.is_file()}
+    else:
+        corpus = _synthetic_corpus()
+
+    bps = args.uplink_mbps * 1e6 / 8
+    print(f"{'image':<22}{'before KiB':>12}{'after KiB':>12}{'prep ms':>10}{'e2e before ms':>15}{'e2e after ms':>14}")
+    totals = [0, 0]
+    for name, data in corpus.items():
+        t0 = time.perf_counter()
+        out, _ = images.preprocess_image(data)
+        prep_ms = (time.perf_counter() - t0) * 1000
+        before = len(base64.b64encode(data))
+        after = len(base64.b64encode(out))
+        totals[0] += before
+        totals[1] += after
+        print(
+            f"{name:<22}{before / 1024:12.1f}{after / 1024:12.1f}{prep_ms:10.1f}"
+            f"{before / bps * 1000:15.1f}{prep_ms + after / bps * 1000:14.1f}"
+        )
+    print(f"total payload: {totals[0] / 1024:.1f} KiB -> {totals[1] / 1024:.1f} KiB "
+          f"({totals[1] / max(totals[0], 1):.1%})")
+    images.shutdown()
+
+
+if __name__ == "__main__":
+    main()
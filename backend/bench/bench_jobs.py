@@ -0,0 +1,189 @@
+"""
+ベンチマーク: 昼のスパイク時の /generate-answer（接続を持ったまま待つ vs ジョブモード）
+
+使い方（backend/ から）
+    python bench/bench_jobs.py                                        # 既定: 300 リクエストが一度に来る, 生成 2000ms
+    python bench/bench_jobs.py --requests 600 --slots 32 --lb-timeout 30 --queue-max 400
+    python bench/bench_jobs.py --json bench/results/jobs.json
+
+- 生成（Claude + Nova Canvas）は --gen-ms 待つだけの代用。サーバが同時に処理できるのは --slots 件
+- sync: 1リクエストが生成の間ずっと枠を持つ。--lb-timeout 秒を超えて待ったものはロードバランサで打ち切り
+- jobs: jobs.JobManager（メモリのキュー, ワーカー --slots 本）に投入して job_id を即返す。結果はポーリング
+  キューが --queue-max で一杯なら 429。同じユーザの実行中ジョブは同じ job_id を返す
+- 表示: 応答（sync は結果、jobs は job_id）までの p50/p95, 打ち切り/429 の数, 全件の結果が揃うまでの秒数
+- 確認: 優先度の順に実行されるか、同じユーザのジョブがまとまるか、キューが一杯で QueueFull になるか、
+  callback_url の検査（check_callback_url）が内部アドレスを拒否するか
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import pathlib
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import jobs  # noqa: E402
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _summary(mode: str, latencies: List[float], rejected: int, total: float, completed: int) -> Dict[str, Any]:
+    return {
+        "mode": mode,
+        "p50_ms": round(statistics.median(latencies), 1) if latencies else None,
+        "p95_ms": round(_pct(latencies, 0.95), 1) if latencies else None,
+        "rejected": rejected,
+        "completed": completed,
+        "total_sec": round(total, 2),
+    }
+
+
+async def _sync(args: argparse.Namespace) -> Dict[str, Any]:
+    slots = asyncio.Semaphore(args.slots)
+    latencies: List[float] = []
+    timed_out = 0
+
+    async def one(i: int) -> None:
+        nonlocal timed_out
+        t0 = time.perf_counter()
+        try:
+            async with asyncio.timeout(args.lb_timeout):
+                async with slots:
+                    await asyncio.sleep(args.gen_ms / 1000)
+        except TimeoutError:
+            timed_out += 1
+            return
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    return _summary("sync", latencies, timed_out, time.perf_counter() - t0, len(latencies))
+
+
+async def _jobs(args: argparse.Namespace) -> Dict[str, Any]:
+    async def handler(job: Dict[str, Any]) -> Dict[str, Any]:
+        await asyncio.sleep(args.gen_ms / 1000)
+        return {"ok": True}
+
+    manager = jobs.JobManager(jobs.MemoryQueueBackend(args.queue_max), handler, workers=args.slots)
+    manager.start()
+    latencies: List[float] = []
+    ids = set()
+    full = 0
+
+    async def one(i: int) -> None:
+        nonlocal full
+        t0 = time.perf_counter()
+        try:
+            job = await manager.submit(f"user_{i % args.users}", {"i": i})
+        except jobs.QueueFull:
+            full += 1
+            return
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ids.add(job["id"])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    while True:
+        states = [(await manager.get(job_id))["status"] for job_id in ids]
+        if all(s in ("done", "failed") for s in states):
+            break
+        await asyncio.sleep(0.05)
+    total = time.perf_counter() - t0
+    await manager.stop()
+    row = _summary("jobs", latencies, full, total, sum(s == "done" for s in states))
+    row["deduped"] = len(latencies) - len(ids)
+    return row
+
+
+async def _checks() -> Dict[str, Any]:
+    order: List[int] = []
+    gate = asyncio.Event()
+
+    async def handler(job: Dict[str, Any]) -> Dict[str, Any]:
+        await gate.wait()
+        order.append(job["priority"])
+        return {}
+
+    # ワーカー1本を先に塞いでから優先度ばらばらに積む → 2件目以降は優先度順に実行される
+    manager = jobs.JobManager(jobs.MemoryQueueBackend(4), handler, workers=1)
+    manager.start()
+    await manager.submit("blocker", {}, priority=9)
+    await asyncio.sleep(0.01)
+    for i, priority in enumerate((5, 1, 3)):
+        await manager.submit(f"user_{i}", {}, priority=priority)
+    dup_a = await manager.submit("dup", {}, priority=7)
+    dup_b = await manager.submit("dup", {}, priority=7)
+    try:
+        await manager.submit("overflow", {})
+        queue_full = False
+    except jobs.QueueFull:
+        queue_full = True
+    gate.set()
+    while len(order) < 5:
+        await asyncio.sleep(0.01)
+    await manager.stop()
+
+    guard = {}
+    for url in ("http://169.254.169.254/latest/meta-data/", "http://127.0.0.1:8000/hook",
+                "http://10.0.0.5/hook", "http://[::ffff:127.0.0.1]/hook", "file:///etc/passwd"):
+        try:
+            await jobs.check_callback_url(url)
+            guard[url] = "allowed"
+        except jobs.CallbackRejected:
+            guard[url] = "rejected"
+    return {
+        "priority_order": order,
+        "priority_ok": order == [9, 1, 3, 5, 7],
+        "dedup_ok": dup_a["id"] == dup_b["id"],
+        "queue_full_ok": queue_full,
+        "callback_guard": guard,
+        "callback_guard_ok": all(v == "rejected" for v in guard.values()),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="ジョブモードの効果")
+    ap.add_argument("--requests", type=int, default=300)
+    ap.add_argument("--users", type=int, default=250, help="ユーザ数（残りは同じユーザの再送）")
+    ap.add_argument("--slots", type=int, default=16, help="同時に生成できる数（uvicorn の処理枠 / ジョブのワーカー数）")
+    ap.add_argument("--gen-ms", type=float, default=2000.0)
+    ap.add_argument("--lb-timeout", type=float, default=20.0, help="ロードバランサの待ち時間の上限（秒）")
+    ap.add_argument("--queue-max", type=int, default=jobs.JOB_QUEUE_MAX)
+    ap.add_argument("--json", help="結果の JSON を保存するパス")
+    args = ap.parse_args()
+
+    rows = [asyncio.run(_sync(args)), asyncio.run(_jobs(args))]
+    check = asyncio.run(_checks())
+
+    print(f"{args.requests} requests at once from {args.users} users, {args.slots} slots, "
+          f"generation {args.gen_ms:g} ms, lb timeout {args.lb_timeout:g} s, queue max {args.queue_max}\n")
+    print(f"{'mode':<8}{'p50 ms':>10}{'p95 ms':>10}{'rejected':>10}{'completed':>11}{'total s':>9}")
+    for r in rows:
+        print(f"{r['mode']:<8}{r['p50_ms'] or 0:>10.1f}{r['p95_ms'] or 0:>10.1f}{r['rejected']:>10d}"
+              f"{r['completed']:>11d}{r['total_sec']:>9.2f}")
+    print("  (rejected: sync = lb timeout, jobs = 429 queue full)")
+    print(f"jobs deduped: {rows[1]['deduped']}")
+    print("checks: " + ", ".join(f"{k}={v}" for k, v in check.items() if k.endswith("_ok")))
+
+    if args.json:
+        out = pathlib.Path(args.json)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"config": vars(args), "rows": rows, "checks": check}, ensure_ascii=False, indent=2),
+                       encoding="utf-8")
+        print(f"saved: {out}")
+    if not all(v for k, v in check.items() if k.endswith("_ok")):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
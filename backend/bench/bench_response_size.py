@@ -0,0 +1,59 @@
+"""
+ベンチマーク: /generate-answer のレスポンスサイズとシリアライズ時間
+（data URL 埋め込み vs /images/{key} の短いURL）
+
+使い方（backend/ から）
+    python bench/bench_response_size.py --image-kb 2048 --repeat 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import os
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from main import AnswerResponse  # noqa: E402
+
+
+def _measure(resp: AnswerResponse, repeat: int) -> tuple[int, float]:
+    body = resp.model_dump_json()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        resp.model_dump_json()
+    return len(body), (time.perf_counter() - t0) / repeat * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--image-kb", type=int, default=2048, help="顔画像・未来像それぞれのサイズ")
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    face = os.urandom(args.image_kb * 1024)
+    future = os.urandom(args.image_kb * 1024)
+    common = dict(ok=True, answer="今日の食事はバランスが良いです。" * 3, score_percent=72, improvement="野菜を一品追加")
+
+    inline = AnswerResponse(
+        **common,
+        current_image_url="data:image/png;base64," + base64.b64encode(face).decode(),
+        future_image_url="data:image/png;base64," + base64.b64encode(future).decode(),
+    )
+    by_ref = AnswerResponse(
+        **common,
+        current_image_url=f"http://127.0.0.1:8000/images/{hashlib.sha256(face).hexdigest()}",
+        future_image_url=f"http://127.0.0.1:8000/images/{hashlib.sha256(future).hexdigest()}",
+    )
+
+    for name, resp in (("data URL (before)", inline), ("/images URL (after)", by_ref)):
+        size, ms = _measure(resp, args.repeat)
+        print(f"{name:>20}: {size / 1024:10.1f} KiB  serialize {ms:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+ベンチマーク: 未来像の S3 保存（リクエスト内で put_object vs s3_upload.S3Uploader）
+
+使い方（backend/ から）
+    python bench/bench_s3_upload.py                                      # moto server を立てて使う（pip install "moto[server]"）
+    python bench/bench_s3_upload.py --endpoint http://127.0.0.1:9000     # MinIO など（AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY）
+    python bench/bench_s3_upload.py --requests 400 --unique 100 --rtt-ms 20 --json bench/results/s3_upload.json
+
+- S3 互換のローカル環境に対して、--concurrency 本のスレッドから --requests 回保存する（画像は --unique 種類）
+  S3 へのリクエストごとに --rtt-ms 待つ（本番の S3 までの往復を模擬）
+- put_object: 従来の _store_future_image（キーは future-fat-<秒>.png、書き終わるまで待つ）
+- uploader  : 内容の sha256 をキーにバックグラウンドで書く（署名付きURLが作れるので待たない）
+- 表示: リクエストから見た保存の待ち時間（p50/p95）, S3 へのリクエスト数, 残ったオブジェクト数, 失敗数,
+  同じ秒の別画像で上書きされた件数（同じキーへの同時 PUT は S3 互換環境によっては失敗になる）
+- 確認: uploader の全オブジェクトが内容どおりか、署名付きURLで取得できるか、
+  --large-mb のオブジェクトがマルチパート（ETag が "-<パート数>"）で保存されるか
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+BUCKET = "bench-future-images"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_moto() -> Tuple[subprocess.Popen, str]:
+    """moto server（任意依存。ベンチのときだけ使う）を別プロセスで起動する（このプロセスの GIL を取り合わない）"""
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('moto server が起動しません（pip install "moto[server]"）')
+            time.sleep(0.1)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def _images(unique: int, size_kb: int) -> List[bytes]:
+    # 中身だけ違う同じ大きさのバイト列（PNG のヘッダつき）
+    return [b"\x89PNG\r\n\x1a\n" + os.urandom(size_kb * 1024) for _ in range(unique)]
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _objects(client: Any, prefix: str) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=prefix):
+        out += page.get("Contents", [])
+    return out
+
+
+def _load(func: Any, images: List[bytes], args: argparse.Namespace) -> Tuple[List[float], int]:
+    """(成功した保存の待ち時間 ms, 失敗数)"""
+    def one(i: int) -> Optional[float]:
+        t0 = time.perf_counter()
+        try:
+            func(images[i % len(images)])
+        except Exception:
+            return None
+        return (time.perf_counter() - t0) * 1000
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    return [r for r in results if r is not None], sum(r is None for r in results)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="未来像の S3 保存")
+    ap.add_argument("--endpoint", help="S3 互換のエンドポイント（省略時は moto server を起動）")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--unique", type=int, default=50, help="画像の種類（残りは同じ画像の再保存）")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--size-kb", type=int, default=1200, help="1枚の大きさ（Nova Canvas の PNG 程度）")
+    ap.add_argument("--large-mb", type=int, default=20, help="マルチパートの確認に使う大きさ")
+    ap.add_argument("--rtt-ms", type=float, default=10.0)
+    ap.add_argument("--json", help="結果の JSON を保存するパス")
+    args = ap.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server, endpoint = _start_moto()
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    # s3_upload は import 時に環境変数を読む
+    os.environ["S3_ENDPOINT_URL"] = endpoint
+    import s3_upload
+
+    try:
+        client = s3_upload.make_client("us-east-1")
+        rtt = args.rtt_ms / 1000
+        requests = {"count": 0}
+
+        def delay(**_: Any) -> None:
+            requests["count"] += 1
+            time.sleep(rtt)
+
+        client.create_bucket(Bucket=BUCKET)
+        client.meta.events.register("before-send.s3", delay)
+        images = _images(args.unique, args.size_kb)
+        rows: List[Dict[str, Any]] = []
+
+        # 従来: リクエストの中で put_object（キーは秒単位の時刻）
+        def put_object(png: bytes) -> str:
+            key = f"legacy/future-fat-{int(time.time())}.png"
+            client.put_object(Bucket=BUCKET, Key=key, Body=png, ContentType="image/png")
+            return f"s3://{BUCKET}/{key}"
+
+        requests["count"] = 0
+        t0 = time.perf_counter()
+        lat, errors = _load(put_object, images, args)
+        total = time.perf_counter() - t0
+        kept = len(_objects(client, "legacy/"))
+        rows.append({"mode": "put_object", "p50_ms": statistics.median(lat), "p95_ms": _pct(lat, 0.95),
+                     "total_sec": total, "s3_requests": requests["count"], "objects": kept, "errors": errors,
+                     "overwritten": args.requests - errors - kept})
+
+        uploader = s3_upload.S3Uploader(client, BUCKET, "generated/")
+        uploader.can_presign()
+        uris: Dict[str, str] = {}
+
+        def upload(png: bytes) -> str:
+            uri = uploader.put(png, suffix=".png", content_type="image/png")
+            uris[uri] = hashlib.sha256(png).hexdigest()
+            return uri
+
+        requests["count"] = 0
+        t0 = time.perf_counter()
+        lat, errors = _load(upload, images, args)
+        if not uploader.close(120):
+            raise RuntimeError("アップロードが 120 秒以内に終わりませんでした")
+        total = time.perf_counter() - t0
+        kept = _objects(client, "generated/")
+        rows.append({"mode": "uploader", "p50_ms": statistics.median(lat), "p95_ms": _pct(lat, 0.95),
+                     "total_sec": total, "s3_requests": requests["count"], "objects": len(kept), "errors": errors,
+                     "overwritten": 0, "stats": uploader.snapshot()})
+
+        # 内容どおりに保存されているか（キー = 内容の sha256）と署名付きURLで取れるか
+        client.meta.events.unregister("before-send.s3", delay)
+        for uri, digest in uris.items():
+            key = uri[len(f"s3://{BUCKET}/"):]
+            body = client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+            if hashlib.sha256(body).hexdigest() != digest or digest not in key:
+                raise RuntimeError(f"内容が一致しません: {uri}")
+        sample = next(iter(uris))
+        url = client.generate_presigned_url("get_object", Params={"Bucket": BUCKET, "Key": sample[len(f"s3://{BUCKET}/"):]})
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            presigned_ok = resp.status == 200
+
+        # マルチパート
+        large = os.urandom(args.large_mb * 1024 * 1024)
+        multi = s3_upload.S3Uploader(client, BUCKET, "generated/", wait=True)
+        uri = multi.put(large, suffix=".bin")
+        etag = client.head_object(Bucket=BUCKET, Key=uri[len(f"s3://{BUCKET}/"):])["ETag"].strip('"')
+        again = multi.snapshot()
+        multi.put(large, suffix=".bin")  # 2回目は書かない（同じキー）
+        multi.close(10)
+        check = {"unique_objects_ok": len(kept) == len(uris) == args.unique and errors == 0, "presigned_get_ok": presigned_ok,
+                 "multipart_etag": etag, "multipart_ok": "-" in etag and again["multipart"] == 1,
+                 "idempotent_ok": multi.snapshot()["uploaded"] == 1}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print(f"{args.requests} saves of {args.unique} unique images ({args.size_kb} KB), "
+          f"concurrency {args.concurrency}, s3 rtt {args.rtt_ms:g} ms\n")
+    print(f"{'mode':<12}{'p50 ms':>9}{'p95 ms':>9}{'total s':>9}{'s3 reqs':>9}{'objects':>9}{'errors':>8}{'overwritten':>13}")
+    for r in rows:
+        print(f"{r['mode']:<12}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['total_sec']:>9.2f}"
+              f"{r['s3_requests']:>9d}{r['objects']:>9d}{r['errors']:>8d}{r['overwritten']:>13d}")
+    print(f"\nuploader stats: {rows[1]['stats']}")
+    print("checks: " + ", ".join(f"{k}={v}" for k, v in check.items()))
+
+    if args.json:
+        out = pathlib.Path(args.json)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"config": vars(args), "rows": rows, "checks": check}, ensure_ascii=False, indent=2),
+                       encoding="utf-8")
+        print(f"saved: {out}")
+    if not all(v for k, v in check.items() if k.endswith("_ok")):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
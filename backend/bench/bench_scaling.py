@@ -0,0 +1,83 @@
+"""
+ベンチマーク: ワーカー数を変えたときのスループット（serve.py の複数ワーカーがコア数に比例して伸びるか）
+
+使い方（backend/ から）
+    python bench/bench_scaling.py                                   # 1, 2, 4, ... CPU 数ワーカー
+    python bench/bench_scaling.py --workers 1 2 4 8 --concurrency 128 --requests 2000
+    python bench/bench_scaling.py --out bench/results/scaling.json
+
+- ワーカー数ごとに bench_e2e_load.py --workers N と同じ負荷を流す（スタブの Bedrock・代用 DB・画像ホスト）。
+  bench_e2e_load.py の引数（--claude-ms, --db-rtt-ms など）はそのまま渡せる
+- 既定ではモデルの待ち時間を短くして（--claude-ms 50 --nova-ms 100）API 自身の CPU で頭打ちになる条件にする。
+  待ち時間が長いとスループットは並列数（--concurrency）で決まり、ワーカー数では伸びない
+- 負荷をかける側（このプロセス。代用 DB と画像ホストも含む）もコアを使うので、ワーカー数は CPU 数 - 1 程度までが目安
+- 表示: ワーカー数ごとの req/s, p50/p95, 1ワーカー比（speedup）と効率（speedup / ワーカー数）, メモリ合計
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+from typing import Any, Dict, List
+
+import bench_e2e_load as load
+
+
+def _default_workers() -> List[int]:
+    cpus = os.cpu_count() or 1
+    counts, n = [], 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    return counts + [cpus]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="ワーカー数ごとのスループット")
+    ap.add_argument("--workers", type=int, nargs="+", default=_default_workers())
+    ap.add_argument("--out", help="結果の JSON を保存するパス")
+    args, rest = ap.parse_known_args()
+
+    load_parser = load.parser()
+    load_parser.set_defaults(concurrency=64, requests=600, claude_ms=50, nova_ms=100)
+    base = load_parser.parse_args(rest)
+
+    rows: List[Dict[str, Any]] = []
+    for workers in args.workers:
+        print(f"\n=== {workers} worker(s) ===")
+        res = load.run(argparse.Namespace(**{**vars(base), "workers": workers, "out": None}))
+        gen = res["generate"]
+        rows.append({
+            "workers": workers,
+            "throughput_rps": gen["throughput_rps"],
+            "p50_ms": gen["latency_ms"]["p50"],
+            "p95_ms": gen["latency_ms"]["p95"],
+            "errors": sum(gen["errors"].values()),
+            "rss_mb": res["memory"]["rss_mb"],
+            "cache": {k: res["server_stats"].get(k) for k in ("future_image", "profile", "generation")},
+            "meta": res["meta"],
+        })
+
+    first = rows[0]
+    print(f"\n{'workers':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'err':>6}{'speedup':>9}{'eff':>7}{'rss MB':>9}")
+    for row in rows:
+        speedup = row["throughput_rps"] / first["throughput_rps"] * first["workers"] if first["throughput_rps"] else 0.0
+        row["speedup"] = round(speedup, 2)
+        row["efficiency"] = round(speedup / row["workers"], 2)
+        print(f"{row['workers']:8d}{row['throughput_rps']:9.1f}{load._fmt(row['p50_ms']):>9}{load._fmt(row['p95_ms']):>9}"
+              f"{row['errors']:6d}{row['speedup']:9.2f}{row['efficiency']:7.2f}{load._fmt(row['rss_mb']):>9}")
+    print(f"\ncpus: {os.cpu_count()}  (speedup は {first['workers']} ワーカーを基準に1ワーカーあたりに換算)")
+
+    if args.out:
+        out = pathlib.Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        config = {k: v for k, v in vars(base).items() if k not in ("out", "compare", "max_regression", "serve_port")}
+        out.write_text(json.dumps({"config": config, "rows": rows}, ensure_ascii=False, indent=2, default=str),
+                       encoding="utf-8")
+        print(f"saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+ベンチマーク: 起動の重さ（python -X importtime で import main を測る）
+
+使い方（backend/ から）
+    python bench/bench_startup.py                      # import main と import fastapi（フレームワークだけ）を比較
+    python bench/bench_startup.py --repeat 10 --top 15
+    python bench/bench_startup.py --serve              # uvicorn を起動して /health, /ready が返るまでの時間
+    python bench/bench_startup.py --json bench/results/startup.json
+
+- 毎回新しいインタプリタで測る（バイトコードはキャッシュ済みの状態。1回目は捨てる）
+- import 時間は -X importtime の累積値（us）の中央値。main の直下で読み込まれるモジュールを重い順に表示
+- --serve: プロセス起動からポートが開いて /health が 200 を返すまで / /ready が 200 になるまで。
+  DB に届かない環境では /ready は --ready-timeout で打ち切る（起動自体が DB を待たないことの確認になる）
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / "src"
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def _env() -> Dict[str, str]:
+    return {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(SRC), os.environ.get("PYTHONPATH")]))}
+
+
+def importtime(module: str) -> Tuple[int, List[Tuple[str, int]]]:
+    """(module の累積 us, 直下で読み込まれたモジュールの [(名前, 累積 us)])"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC, env=_env(), capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} に失敗しました:\n{proc.stderr[-2000:]}")
+    children: List[Tuple[str, int]] = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        cumulative, depth, name = int(m.group(2)), len(m.group(3)) // 2, m.group(4)
+        if depth == 0:
+            # 対象より前のトップレベル（site など起動時の import）はその子ごと捨てる
+            if name == module:
+                return cumulative, children
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative))
+    raise RuntimeError(f"importtime の出力に {module} がありません")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def serve_times(ready_timeout: float) -> Dict[str, Optional[float]]:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:main", "--port", str(port), "--log-level", "warning"],
+        cwd=SRC, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    out: Dict[str, Optional[float]] = {"health_ms": None, "ready_ms": None}
+    try:
+        while time.perf_counter() - t0 < 60 and out["health_ms"] is None:
+            if _get(f"{base}/health") == 200:
+                out["health_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            else:
+                time.sleep(0.01)
+        while time.perf_counter() - t0 < ready_timeout and out["ready_ms"] is None:
+            if _get(f"{base}/ready") == 200:
+                out["ready_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            else:
+                time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--serve", action="store_true")
+    ap.add_argument("--ready-timeout", type=float, default=15.0)
+    ap.add_argument("--json", help="結果の JSON を保存するパス")
+    args = ap.parse_args()
+
+    importtime("main")  # 1回目はバイトコード生成などが混ざるので捨てる
+    result: Dict[str, object] = {}
+    children: Dict[str, List[int]] = {}
+    for module in ("fastapi", "main"):
+        totals = []
+        for _ in range(args.repeat):
+            total, kids = importtime(module)
+            totals.append(total)
+            if module == "main":
+                for name, us in kids:
+                    children.setdefault(name, []).append(us)
+        result[f"import_{module}_ms"] = round(statistics.median(totals) / 1000, 1)
+
+    print(f"import fastapi : {result['import_fastapi_ms']:8.1f} ms  (framework only)")
+    print(f"import main    : {result['import_main_ms']:8.1f} ms")
+    top = sorted(((n, statistics.median(v) / 1000) for n, v in children.items()), key=lambda x: -x[1])[: args.top]
+    print(f"\nheaviest imports under main (cumulative ms, median of {args.repeat})")
+    for name, ms in top:
+        print(f"  {name:<28}{ms:8.1f}")
+    result["top_imports_ms"] = {n: round(ms, 1) for n, ms in top}
+
+    if args.serve:
+        times = [serve_times(args.ready_timeout) for _ in range(max(1, args.repeat // 2))]
+        health = [t["health_ms"] for t in times if t["health_ms"] is not None]
+        ready = [t["ready_ms"] for t in times if t["ready_ms"] is not None]
+        result["serve_health_ms"] = round(statistics.median(health), 1) if health else None
+        result["serve_ready_ms"] = round(statistics.median(ready), 1) if ready else None
+        print(f"\nuvicorn start -> /health 200 : {result['serve_health_ms']} ms")
+        print("uvicorn start -> /ready 200  : "
+              + (f"{result['serve_ready_ms']} ms" if ready else f"not ready within {args.ready_timeout:g}s"))
+
+    if args.json:
+        out = pathlib.Path(args.json)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+ベンチマーク: 画像URL取得（都度 AsyncClient 生成 vs 共通クライアント）
+
+使い方（backend/ から）
+    python bench/bench_url_fetch.py --requests 1000 --concurrency 50 --image-kb 300 --latency-ms 5
+
+- ローカルに画像ホストの代役（ThreadingHTTPServer）を立てて計測
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import main as app  # noqa: E402
+
+
+def _serve(body: bytes, latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive を有効に
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def _per_call(url: str) -> bytes:
+    # 変更前の url_to_bytes 相当（毎回クライアントを作って捨てる）
+    async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
+        async with client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            return b"".join([chunk async for chunk in resp.aiter_bytes()])
+
+
+async def _drive(fetch, url: str, n: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await fetch(url)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    return time.perf_counter() - t0
+
+
+async def _run(args) -> None:
+    server = _serve(os.urandom(args.image_kb * 1024), args.latency_ms / 1000)
+    url = f"http://127.0.0.1:{server.server_address[1]}/meal.jpg"
+    try:
+        elapsed = await _drive(_per_call, url, args.requests, args.concurrency)
+        print(f"{'per-call client':>16}: {args.requests / elapsed:8.1f} req/s")
+
+        app.open_http_client()
+        try:
+            elapsed = await _drive(app.url_to_bytes, url, args.requests, args.concurrency)
+        finally:
+            await app.close_http_client()
+        print(f"{'shared client':>16}: {args.requests / elapsed:8.1f} req/s  (per-host limit {app.HTTP_PER_HOST_LIMIT})")
+    finally:
+        server.shutdown()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--image-kb", type=int, default=300)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
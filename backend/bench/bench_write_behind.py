@@ -0,0 +1,146 @@
+"""
+ベンチマーク: ログ・生成結果の保存（その場で書く vs 後回し書き込み）
+
+使い方（backend/ から）
+    python bench/bench_write_behind.py                                  # 既定: 64 並列 × 2000 リクエスト, RTT 2ms
+    python bench/bench_write_behind.py --requests 5000 --users 500 --db-rtt-ms 5
+    python bench/bench_write_behind.py --batch-size 500 --flush-ms 200 --json bench/results/write_behind.json
+
+- 1リクエスト = save_past_info_async + save_generated_answer_async（/generate-answer の log と save_answer）
+- DB は bench_e2e_load.py のメモリ上の代用（SQL 1文・BEGIN・COMMIT ごとに --db-rtt-ms 待つ）
+- sync        : WRITE_BEHIND=0 と同じ。1件ごとに DB スレッドで書く（meal_log は1件4文 + BEGIN/COMMIT）
+- write-behind: キューに積むだけで返る。書き込みスレッドが複数行 INSERT でまとめて書く
+- 表示: リクエストから見た保存の待ち時間（p50/p95）, 全件が DB に入るまでの rows/s, DB 往復数
+  （write-behind の rows/s は close_write_behind で書き切るまでを含む）
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+import bench_e2e_load as load  # noqa: E402
+
+
+class _CountingDB(load._MemoryDB):
+    def __init__(self, rtt: float) -> None:
+        super().__init__(rtt)
+        self.roundtrips = 0
+
+    def roundtrip(self) -> None:
+        self.roundtrips += 1
+        super().roundtrip()
+
+    def execute(self, sql: str, args: Any, roundtrip: bool = True) -> List[Dict[str, Any]]:
+        if roundtrip:
+            self.roundtrips += 1
+        return super().execute(sql, args, roundtrip)
+
+
+def _pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _run(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    import database
+
+    db = _CountingDB(args.db_rtt_ms / 1000)
+    database._get_conn = lambda: load._MemoryConn(db)
+    database.close_pool()
+    database._writers.clear()
+    database.WRITE_BEHIND = mode == "write-behind"
+    database.start_write_behind()
+
+    latencies: List[float] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker() -> None:
+        while not queue.empty():
+            i = queue.get_nowait()
+            user_id = f"bench_wb_{i % args.users}"
+            t0 = time.perf_counter()
+            await database.save_past_info_async(
+                user_id=user_id, weight_kg=str(60 + i % 20), habits=str(i % 90), sleep_hour=str(5 + i % 4),
+                meal_image_url=f"https://example.com/meal/{i}.jpg",
+            )
+            await database.save_generated_answer_async(
+                {"user_id": user_id, "answer": "ok", "score_percent": i % 100, "improvement": "-"}
+            )
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    request_sec = time.perf_counter() - t0
+    if not await asyncio.to_thread(database.close_write_behind, 60.0):
+        raise RuntimeError("write-behind が 60 秒以内に書き切れませんでした")
+    total_sec = time.perf_counter() - t0
+    stats = database.write_behind_stats()
+
+    rows = sum(len(v) for v in db.meal_log.values()) + db.answers
+    if rows != args.requests * 2:
+        raise RuntimeError(f"{mode}: 書けた行数が合いません（{rows} / {args.requests * 2}）")
+    return {
+        "mode": mode,
+        "save_p50_ms": round(statistics.median(latencies), 3),
+        "save_p95_ms": round(_pct(latencies, 0.95), 3),
+        "requests_per_sec": round(args.requests / request_sec, 1),
+        "rows_per_sec": round(rows / total_sec, 1),
+        "roundtrips": db.roundtrips,
+        "roundtrips_per_row": round(db.roundtrips / rows, 3),
+        "batches": sum(s["batches"] for s in stats.values()) if stats else None,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="後回し書き込みの効果")
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--db-rtt-ms", type=float, default=2.0)
+    ap.add_argument("--batch-size", type=int, default=None, help="WB_BATCH_SIZE（既定: write_behind.py の値）")
+    ap.add_argument("--flush-ms", type=float, default=None, help="WB_FLUSH_SEC をミリ秒で")
+    ap.add_argument("--json", help="結果の JSON を保存するパス")
+    args = ap.parse_args()
+
+    # write_behind.py は import 時に環境変数を読むので先に入れる（追記ログは一時ディレクトリへ）
+    os.environ["WB_SPILL_DIR"] = tempfile.mkdtemp(prefix="bench-wb-")
+    if args.batch_size is not None:
+        os.environ["WB_BATCH_SIZE"] = str(args.batch_size)
+    if args.flush_ms is not None:
+        os.environ["WB_FLUSH_SEC"] = str(args.flush_ms / 1000)
+
+    rows = [asyncio.run(_run(mode, args)) for mode in ("sync", "write-behind")]
+
+    print(f"{args.requests} requests x 2 rows, concurrency {args.concurrency}, {args.users} users, "
+          f"db rtt {args.db_rtt_ms:g} ms\n")
+    print(f"{'mode':<14}{'save p50':>10}{'save p95':>10}{'req/s':>10}{'rows/s':>10}{'db rt':>8}{'rt/row':>8}")
+    for r in rows:
+        print(f"{r['mode']:<14}{r['save_p50_ms']:>10.2f}{r['save_p95_ms']:>10.2f}{r['requests_per_sec']:>10.1f}"
+              f"{r['rows_per_sec']:>10.1f}{r['roundtrips']:>8d}{r['roundtrips_per_row']:>8.2f}")
+    sync, wb = rows
+    print(f"\nsave latency p50: {sync['save_p50_ms']:.2f} -> {wb['save_p50_ms']:.2f} ms, "
+          f"rows/s x{wb['rows_per_sec'] / sync['rows_per_sec']:.1f}, batches {wb['batches']}")
+
+    if args.json:
+        out = pathlib.Path(args.json)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"config": vars(args), "rows": rows}, ensure_ascii=False, indent=2),
+                       encoding="utf-8")
+        print(f"saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
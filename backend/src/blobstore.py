@@ -0,0 +1,183 @@
+"""
+画像などのバイナリ保存（内容アドレス方式）
+
+概要
+- put(data) -> key（sha256 hex）。同じ内容は同じキーなので重複保存しない
+- LocalBlobStore: <BLOB_DIR>/ab/abcdef...  /  S3BlobStore: s3://<bucket>/<prefix>ab/abcdef...
+- Blob: キーだけ持つ遅延参照。read() したときに初めて読み込む（以降はメモリに保持）
+- DB には to_ref(key) の短い参照（b"blob:<sha256>"）だけを保存する
+- 配信は main.py の /images/{key}（ローカルは直接、S3 は署名付きURLへリダイレクト）
+
+注意
+- BLOB_STORE=local|s3（既定 local）, BLOB_DIR, BLOB_S3_BUCKET, BLOB_S3_PREFIX
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Any, Optional, Union
+
+_REF_PREFIX = b"blob:"
+
+
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_media_type(head: bytes) -> str:
+    """先頭バイトから画像形式を判定（不明なら application/octet-stream）"""
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def is_key(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def to_ref(key: str) -> bytes:
+    return _REF_PREFIX + key.encode("ascii")
+
+
+def from_ref(value: Optional[bytes]) -> Optional[str]:
+    """DB の値が参照ならキーを返す（旧データのように画像そのものなら None）"""
+    if value and value[:len(_REF_PREFIX)] == _REF_PREFIX:
+        return bytes(value[len(_REF_PREFIX):]).decode("ascii")
+    return None
+
+
+class LocalBlobStore:
+    def __init__(self, root: str) -> None:
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / key
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return key
+
+    def read(self, key: str) -> bytes:
+        return self.path(key).read_bytes()
+
+    def size(self, key: str) -> int:
+        return self.path(key).stat().st_size
+
+    def delete(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+
+class S3BlobStore:
+    def __init__(self, client: Any, bucket: str, prefix: str = "blobs/") -> None:
+        self._s3 = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/"
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception:
+            self._s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+        return key
+
+    def read(self, key: str) -> bytes:
+        return self._s3.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def presigned_url(self, key: str, expires: int = 3600) -> str:
+        return self._s3.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._key(key)}, ExpiresIn=expires
+        )
+
+    def size(self, key: str) -> int:
+        return int(self._s3.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"])
+
+    def delete(self, key: str) -> None:
+        self._s3.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+BlobStore = Union[LocalBlobStore, S3BlobStore]
+
+
+class Blob:
+    """遅延読み込みの画像参照。key は内容の sha256 なのでキャッシュキーにもそのまま使える"""
+
+    def __init__(self, key: str, store: Optional[BlobStore] = None, data: Optional[bytes] = None) -> None:
+        self.key = key
+        self._store = store
+        self._data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Blob":
+        return cls(hashlib.sha256(data).hexdigest(), data=bytes(data))
+
+    def read(self) -> bytes:
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = self._store.read(self.key)
+        return self._data
+
+    @property
+    def stored(self) -> bool:
+        """blob ストアに実体がある（旧データの画像バイト列由来なら False）"""
+        return self._store is not None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def __repr__(self) -> str:
+        return f"Blob({self.key[:12]}…, loaded={self.loaded})"
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        if os.getenv("BLOB_STORE", "local") == "s3":
+            from s3_upload import make_client
+            _store = S3BlobStore(
+                make_client(os.getenv("AWS_REGION")),
+                os.environ["BLOB_S3_BUCKET"],
+                os.getenv("BLOB_S3_PREFIX", "blobs/"),
+            )
+        else:
+            # 既定は backend/blobs（起動時のカレントディレクトリによらない）
+            _store = LocalBlobStore(os.getenv("BLOB_DIR", str(pathlib.Path(__file__).resolve().parent.parent / "blobs")))
+    return _store
+
+
+def load_blob(value: Optional[bytes]) -> Optional[Blob]:
+    """DB の値（参照 or 旧来の画像バイト列）を Blob にする"""
+    if not value:
+        return None
+    key = from_ref(value)
+    if key is None:
+        return Blob.from_bytes(value)
+    return Blob(key, get_blob_store())
@@ -5,22 +5,54 @@
 更新：2025/09/18（数値はすべて str / 既存テーブルの修正は行わない）
 
 概要
-- save_init_list: 固定情報の保存（プロフィール画像はURL）
-- fetch_info: プロフィール + 直近7回分ログ
+- save_init_list: 固定情報の保存（プロフィール画像は blob ストア、DB には参照のみ）
+- fetch_info: プロフィール + 直近7日分ログ（1日1件）
+- fetch_init_info: プロフィールはキャッシュ経由（profile_cache.py, save_init_list で無効化）
+- fetch_past_summary: 日次ロールアップ（直近7日 + 7/30日平均 + 体重の傾き）。主キー1回の参照
 - save_generated_answer: 生成結果の保存（result dict仕様）
+- fetch_future_images / save_future_image: ユーザごとの前回の未来像（段階ごと。同じなら Nova Canvas を呼ばない）
+- save_past_info_async / save_generated_answer_async: 既定では後回し書き込み（write_behind.py。WRITE_BEHIND=0 で無効）。
+  リクエストは DB を待たず、書き込みスレッドが複数行 INSERT でまとめて書く
 - add_meal_log: 食事/体重/睡眠ログの追加（画像はURL）
+- bulk_add_meal_logs: ログの一括投入（チャンク単位の executemany + トランザクション。ingest.py から使う）
+- bootstrap: スキーマ作成/移行（起動時に一度だけ。schema.py）
+- count_statements: リクエスト単位の SQL 文数計測
+- *_async: 上記の非同期版（FastAPI ハンドラから await で呼ぶ。イベントループを止めない）
 
 注意
 - RDS接続情報は環境変数で設定（DB_HOST, DB_USER, DB_PASSWORD, DB_NAME）
+- 接続はプール経由で再利用（DB_POOL_MIN, DB_POOL_MAX, DB_POOL_IDLE_SEC, DB_POOL_ACQUIRE_SEC）
 """
 
+import asyncio
+import contextvars
+import functools
+import json
+import logging
 import os
-import pymysql
+import threading
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+import rollup
+from blobstore import Blob, get_blob_store, load_blob, to_ref
+from db_pool import ConnectionPool, PoolTimeout
+from profile_cache import ProfileCache, make_profile_cache
+from schema import bootstrap_schema
+from write_behind import WriteBehind
+
+logger = logging.getLogger("uvicorn.error")
 
 # =============================
 # 接続
 # =============================
 def _get_conn():
+    import pymysql  # 初回接続時に読み込む（import main を軽くする）
+
     return pymysql.connect(
         host=os.getenv("DB_HOST", "db-python.cnphhi3k6w2n.ap-northeast-1.rds.amazonaws.com"),
         user=os.getenv("DB_USER", "admin"),
@@ -30,60 +62,104 @@ def _get_conn():
         cursorclass=pymysql.cursors.DictCursor,
     )
 
-def _ensure_tables():
-    """
-    既存テーブルの修正は一切行わず、存在しなければ作成のみ。
-    """
-    ddl_user = """
-    CREATE TABLE IF NOT EXISTS user_profile (
-        user_id VARCHAR(64) PRIMARY KEY,
-        height INT NULL,
-        gender VARCHAR(16) NULL,
-        years INT NULL,
-        individual_photo_url MEDIUMBLOB NULL,
-        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-    """
-    ddl_meal = """
-    CREATE TABLE IF NOT EXISTS meal_log (
-        id BIGINT AUTO_INCREMENT PRIMARY KEY,
-        user_id VARCHAR(64) NOT NULL,
-        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        meal_image_url VARCHAR(1024) NULL,
-        weight_kg INT NULL,
-        habits INT NULL,
-        sleep_hour INT NULL,
-        KEY idx_user_date (user_id, created_at)
-    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_IDLE_SEC = float(os.getenv("DB_POOL_IDLE_SEC", "300"))
+DB_POOL_ACQUIRE_SEC = float(os.getenv("DB_POOL_ACQUIRE_SEC", "10"))
+
+_pool: ConnectionPool | None = None
+_executor: ThreadPoolExecutor | None = None
+
+def get_pool() -> ConnectionPool:
+    """プロセス共通のコネクションプール（初回呼び出し時に生成）"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            _get_conn,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            idle_timeout=DB_POOL_IDLE_SEC,
+            acquire_timeout=DB_POOL_ACQUIRE_SEC,
+        )
+    return _pool
+
+def close_pool() -> None:
+    global _pool, _executor
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+@contextmanager
+def _connection():
+    with get_pool().connection() as conn:
+        yield conn
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+    return _executor
+
+async def _run(func, *args, **kwargs):
+    """同期 DB 関数を専用スレッドで実行（スレッド数 = プール上限なので接続待ちで溢れない）"""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()  # count_statements をスレッド側にも引き継ぐ
+    return await loop.run_in_executor(_get_executor(), functools.partial(ctx.run, func, *args, **kwargs))
+
+_profile_cache: ProfileCache | None = None
+
+def get_profile_cache() -> ProfileCache:
+    global _profile_cache
+    if _profile_cache is None:
+        _profile_cache = make_profile_cache()
+    return _profile_cache
+
+def bootstrap() -> int:
     """
-    ddl_gen = """
-    CREATE TABLE IF NOT EXISTS generated_answers (
-        id BIGINT AUTO_INCREMENT PRIMARY KEY,
-        user_id VARCHAR(64) NOT NULL,
-        answer TEXT NULL,
-        score_percent INT NULL,
-        improvement TEXT NULL,
-        future_image_url VARCHAR(1024) NULL,
-        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        KEY idx_user_created (user_id, created_at)
-    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    起動時に一度だけ呼ぶ（main.py の lifespan）。スキーマを最新版にして版数を返す。
+    各ヘルパは DDL を一切発行しない。
     """
+    with _connection() as conn:
+        return bootstrap_schema(conn)
 
-    conn = _get_conn()
-    try:
+def ping() -> None:
+    """/ready 用。プールから1本借りて往復できるか確かめる（SQL 文数には数えない）"""
+    with _connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(ddl_user)
-            cur.execute(ddl_meal)
-            cur.execute(ddl_gen)
+            cur.execute("SELECT 1")
+
+# =============================
+# 計測（リクエスト単位の SQL 文数）
+# =============================
+_stmt_counter: ContextVar[list[int] | None] = ContextVar("db_stmt_counter", default=None)
+
+@contextmanager
+def count_statements():
+    """with count_statements() as c: ... → c[0] がブロック内で発行した SQL 文数"""
+    counter = [0]
+    token = _stmt_counter.set(counter)
+    try:
+        yield counter
     finally:
-        conn.close()
+        _stmt_counter.reset(token)
 
+def _execute(cur, sql: str, args=None):
+    counter = _stmt_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    metrics.DB_STATEMENTS.inc()
+    return cur.execute(sql, args)
 
-# import 時に一度だけ作成（失敗しても黙殺）
-try:
-    _ensure_tables()
-except Exception:
-    pass
+def _executemany(cur, sql: str, seq_args):
+    # pymysql は INSERT ... VALUES を複数行 INSERT 1文にまとめて送る
+    counter = _stmt_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    metrics.DB_STATEMENTS.inc()
+    return cur.executemany(sql, seq_args)
 
 # =============================
 # 既存インタフェース
@@ -93,13 +169,18 @@ def save_init_list(
     height: str | None,
     gender: str | None,
     years: str | None,
-    individual_photo_url: bytes | None = None
+    individual_photo_url: bytes | Blob | None = None
 ) -> int:
     """
-    固定情報の保存（UPSERT、画像はURL）
+    固定情報の保存（UPSERT）
     すべて文字列で保存
+    画像本体は blob ストアへ置き、DB には参照（b"blob:<sha256>"）だけを保存（保存済みの Blob なら参照だけ）
     """
-    _ensure_tables()
+    photo_ref = None
+    if isinstance(individual_photo_url, Blob) and individual_photo_url.stored:
+        photo_ref = to_ref(individual_photo_url.key)
+    elif individual_photo_url:
+        photo_ref = to_ref(get_blob_store().put(individual_photo_url))
     sql = """
     INSERT INTO user_profile (user_id, height, gender, years, individual_photo_url)
     VALUES (%s, %s, %s, %s, %s)
@@ -109,16 +190,14 @@ def save_init_list(
         years=VALUES(years),
         individual_photo_url=VALUES(individual_photo_url)
     """
-    conn = _get_conn()
-    try:
+    with _connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, (user_id, height, gender, years, individual_photo_url))
-        return 0
-    finally:
-        conn.close()
+            _execute(cur, sql, (user_id, height, gender, years, photo_ref))
+    get_profile_cache().invalidate(user_id)
+    return 0
 
 def fetch_info(user_id: str):
-    """初期プロフィール + 直近7回分のログ（1日1件・最新）を返す"""
+    """初期プロフィール + 直近7日分のログ（1日1件・最新）を返す"""
     init = fetch_init_info(user_id)
     past = fetch_past_info(user_id)
     return init, past
@@ -130,113 +209,233 @@ def save_past_info(
     sleep_hour: int | None = None,
     meal_image_url: str | None = None
 ) -> int:
-    """食事/体重/睡眠ログを1件追加（画像はURL）"""
-    _ensure_tables()
-    sql = """
-    INSERT INTO meal_log (user_id, meal_image_url, weight_kg, habits, sleep_hour, created_at)
-    VALUES (%s, %s, %s, %s, %s, NOW())
-    """
-    conn = _get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, (user_id, meal_image_url, weight_kg, habits, sleep_hour))
-        return 0
-    finally:
-        conn.close()
+    """食事/体重/睡眠ログを1件追加（画像はURL）。日次ロールアップも同じトランザクションで更新"""
+    return _insert_meal_log(user_id, weight_kg, habits, sleep_hour, meal_image_url)
 
-def fetch_init_info(user_id: str):
-    _ensure_tables()
-    conn = _get_conn()
-    try:
+def _select_profile(user_id: str):
+    with _connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
+            _execute(
+                cur,
                 "SELECT height, gender, years, individual_photo_url FROM user_profile WHERE user_id=%s",
                 (user_id,)
             )
-            row = cur.fetchone()
-            if row:
-                return {
-                    "height": row.get("height"),                 # str | None
-                    "gender": row.get("gender"),
-                    "years": row.get("years"),                   # str | None
-                    "individual_photo_url": row.get("individual_photo_url"),
-                }
-            return {"height": None, "gender": None, "years": None, "individual_photo_url": None}
-    finally:
-        conn.close()
+            return cur.fetchone()
+
+def fetch_init_info(user_id: str):
+    """
+    individual_photo_url は Blob（遅延参照）で返す。画像本体は read() するまで読まない
+    行は profile_cache 経由で読む（save_init_list で無効化）
+    """
+    row = get_profile_cache().get_or_load(user_id, lambda: _select_profile(user_id))
+    if row:
+        return {
+            "height": row.get("height"),                 # str | None
+            "gender": row.get("gender"),
+            "years": row.get("years"),                   # str | None
+            "individual_photo_url": load_blob(row.get("individual_photo_url")),
+        }
+    return {"height": None, "gender": None, "years": None, "individual_photo_url": None}
 
 def fetch_past_info(user_id: str):
     """
-    直近の7回分（最新→最大7件）。数値はすべて文字列で返る。
-    返却キー: "0_day_ago", "1_day_ago", ...
+    直近7日分（1日1件・その日の最新, 新しい順）。日次ロールアップから作る。
+    返却キー: "0_day_ago", "1_day_ago", ...（記録の無い分は None で埋める）
     """
-    _ensure_tables()
+    days = fetch_past_summary(user_id)["days"]
     past: dict[str, dict] = {}
-    conn = _get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT user_id, created_at, meal_image_url, weight_kg, habits, sleep_hour
-                FROM meal_log
-                WHERE user_id=%s
-                ORDER BY created_at DESC
-                LIMIT 7
-                """,
-                (user_id,)
-            )
-            rows = cur.fetchall()
-
-            for i in range(7):
-                if i < len(rows):
-                    past[f"{i}_day_ago"] = rows[i]
-                else:
-                    past[f"{i}_day_ago"] = {
-                        "user_id": user_id,
-                        "created_at": None,
-                        "meal_image_url": None,
-                        "weight_kg": None,  # str|None
-                        "habits": None,
-                        "sleep_hour": None, # str|None
-                    }
-    finally:
-        conn.close()
+    for i in range(7):
+        d = days[i] if i < len(days) else {}
+        past[f"{i}_day_ago"] = {
+            "user_id": user_id,
+            "created_at": d.get("date"),
+            "meal_image_url": None,  # ロールアップには画像を持たない
+            "weight_kg": d.get("weight_kg"),
+            "habits": d.get("habits"),
+            "sleep_hour": d.get("sleep_hour"),
+        }
     return past
 
 # =============================
-# 生成結果（result dict 仕様）
+# 日次ロールアップ（user_daily_summary）
 # =============================
-def save_generated_answer(result: dict) -> int:
+_SUMMARY_COLUMNS = (
+    "weight_avg7", "habits_avg7", "sleep_avg7", "weight_slope7",
+    "weight_avg30", "habits_avg30", "sleep_avg30", "weight_slope30",
+)
+
+def _rebuild_days(cur, user_id: str):
+    """meal_log から days を作り直す（ロールアップ行がまだ無いユーザ用）"""
+    _execute(
+        cur,
+        """
+        SELECT created_at, weight_kg, habits, sleep_hour, NOW() AS now
+        FROM meal_log
+        WHERE user_id=%s AND created_at >= CURDATE() - INTERVAL %s DAY
+        ORDER BY created_at
+        """,
+        (user_id, rollup.ROLLUP_DAYS - 1)
+    )
+    rows = cur.fetchall()
+    today = rows[-1]["now"].date() if rows else date.today()
+    return rollup.rebuild(rows, today), today
+
+_SUMMARY_UPSERT = (
+    f"INSERT INTO user_daily_summary (user_id, days_json, {', '.join(_SUMMARY_COLUMNS)}) "
+    f"VALUES (%s, %s, {', '.join(['%s'] * len(_SUMMARY_COLUMNS))}) "
+    f"ON DUPLICATE KEY UPDATE {', '.join(f'{c}=VALUES({c})' for c in ('days_json',) + _SUMMARY_COLUMNS)}"
+)
+
+# 読み出し側の初回作成用。書き込み側（行ロックを取って ON DUPLICATE KEY UPDATE）が先に作った行を上書きしない
+_SUMMARY_INSERT_IGNORE = (
+    f"INSERT IGNORE INTO user_daily_summary (user_id, days_json, {', '.join(_SUMMARY_COLUMNS)}) "
+    f"VALUES (%s, %s, {', '.join(['%s'] * len(_SUMMARY_COLUMNS))})"
+)
+
+def _summary_args(user_id: str, days: list, stats: dict) -> tuple:
+    return (user_id, json.dumps(days), *(stats[c] for c in _SUMMARY_COLUMNS))
+
+def _upsert_summary(cur, user_id: str, days: list, today: date) -> dict:
+    stats = rollup.summarize(days, today)
+    _execute(cur, _SUMMARY_UPSERT, _summary_args(user_id, days, stats))
+    return stats
+
+def _upsert_summaries(cur, summaries: list) -> None:
+    """[(user_id, days, today)] を複数行 INSERT ... ON DUPLICATE KEY UPDATE 1文で"""
+    _executemany(cur, _SUMMARY_UPSERT, [
+        _summary_args(user_id, days, rollup.summarize(days, today)) for user_id, days, today in summaries
+    ])
+
+def _insert_meal_log(user_id, weight_kg, habits, sleep_hour, meal_image_url) -> int:
+    with _connection() as conn:
+        conn.begin()
+        try:
+            with conn.cursor() as cur:
+                _execute(
+                    cur,
+                    """
+                    INSERT INTO meal_log (user_id, meal_image_url, weight_kg, habits, sleep_hour, created_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                    """,
+                    (user_id, meal_image_url, weight_kg, habits, sleep_hour)
+                )
+                # 同じユーザの同時書き込みで days を取りこぼさないよう行ロック
+                _execute(
+                    cur,
+                    "SELECT days_json, NOW() AS now FROM user_daily_summary WHERE user_id=%s FOR UPDATE",
+                    (user_id,)
+                )
+                row = cur.fetchone()
+                if row:
+                    today = row["now"].date()
+                    new = rollup.entry(row["now"], weight_kg, habits, sleep_hour)
+                    days = rollup.merge_entry(json.loads(row["days_json"]), new, today)
+                else:
+                    days, today = _rebuild_days(cur, user_id)
+                _upsert_summary(cur, user_id, days, today)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return 0
+
+def fetch_past_summary(user_id: str, pending: dict | None = None) -> dict:
     """
-    生成結果の保存（数値は文字列で保存）
-    必須: result['user_id']
-    任意: result['answer'], result['score_percent'], result['improvement'] / 'improvement ', result['future_image_url']
+    日次ロールアップを主キー1回で読む（行が無ければ meal_log から作り、まだ無いときだけ INSERT IGNORE で保存）。
+    平均・傾きは読み出し時点の日付で days から計算し直す（最後の記録から日が空いても正しい）。
+    pending: まだ書き込まれていない今回の記録（weight_kg / habits / sleep_hour）。今日の分として重ねる
+    返却: rollup.compact の形 {"days": [...], "avg7": {...}, "avg30": {...}, "weight_slope_kg_per_day": {...}}
     """
-    _ensure_tables()
+    with _connection() as conn:
+        with conn.cursor() as cur:
+            _execute(
+                cur,
+                "SELECT days_json, NOW() AS now FROM user_daily_summary WHERE user_id=%s",
+                (user_id,)
+            )
+            row = cur.fetchone()
+            if row:
+                days, now = json.loads(row["days_json"]), row["now"]
+                today = now.date()
+            else:
+                days, today = _rebuild_days(cur, user_id)
+                # 同時に走る log ステージがロックを取って書いた行（今回の記録を含む）を古い days で上書きしない
+                _execute(cur, _SUMMARY_INSERT_IGNORE, _summary_args(user_id, days, rollup.summarize(days, today)))
+                now = today
+    if pending is not None:
+        days = rollup.merge_entry(
+            days, rollup.entry(now, pending.get("weight_kg"), pending.get("habits"), pending.get("sleep_hour")), today
+        )
+    return rollup.compact(days, rollup.summarize(days, today))
 
+# =============================
+# 生成結果（result dict 仕様）
+# =============================
+def _answer_record(result: dict) -> dict:
+    """result dict を generated_answers の1行（created_at 以外）に整える"""
     user_id = result.get("user_id")
     if not user_id:
         raise ValueError("result['user_id'] は必須です。")
 
-    answer = result.get("answer")
     score_percent = result.get("score_percent")  # そのまま文字列想定（数値でも str() で保存可）
     if score_percent is not None and not isinstance(score_percent, str):
         score_percent = str(score_percent)
 
-    improvement = result.get("improvement") or result.get("improvement ")
-    future_image_url = result.get("future_image_url")
+    return {
+        "user_id": user_id,
+        "answer": result.get("answer"),
+        "score_percent": score_percent,
+        "improvement": result.get("improvement") or result.get("improvement "),
+        "future_image_url": result.get("future_image_url"),
+    }
 
+def save_generated_answer(result: dict) -> int:
+    """
+    生成結果の保存（数値は文字列で保存）
+    必須: result['user_id']
+    任意: result['answer'], result['score_percent'], result['improvement'] / 'improvement ', result['future_image_url']
+    """
+    r = _answer_record(result)
     sql = """
     INSERT INTO generated_answers (user_id, answer, score_percent, improvement, future_image_url, created_at)
     VALUES (%s, %s, %s, %s, %s, NOW())
     """
-    conn = _get_conn()
-    try:
+    with _connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, (user_id, answer, score_percent, improvement, future_image_url))
+            _execute(cur, sql, (r["user_id"], r["answer"], r["score_percent"], r["improvement"], r["future_image_url"]))
         return 0
-    finally:
-        conn.close()
+
+# =============================
+# 前回の未来像（user_future_image）
+# =============================
+def fetch_future_images(user_id: str) -> dict:
+    """{variant: {"image_key", "future_image_url"}}（使い回せるかは generater 側で image_key を見て決める）"""
+    with _connection() as conn:
+        with conn.cursor() as cur:
+            _execute(
+                cur,
+                "SELECT variant, image_key, future_image_url FROM user_future_image WHERE user_id=%s",
+                (user_id,)
+            )
+            return {
+                row["variant"]: {"image_key": row["image_key"], "future_image_url": row["future_image_url"]}
+                for row in cur.fetchall()
+            }
+
+def save_future_image(user_id: str, record: dict) -> int:
+    """record: generate の結果の future_image_record（{"variant", "image_key", "future_image_url"}）"""
+    with _connection() as conn:
+        with conn.cursor() as cur:
+            _execute(
+                cur,
+                """
+                INSERT INTO user_future_image (user_id, variant, image_key, future_image_url)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE image_key=VALUES(image_key), future_image_url=VALUES(future_image_url)
+                """,
+                (user_id, record["variant"], record["image_key"], record["future_image_url"])
+            )
+    return 0
 
 # =============================
 # 入力補助
@@ -248,19 +447,265 @@ def add_meal_log(
     sleep_hour: int | None = None,
     meal_image_url: str | None = None
 ) -> int:
-    """食事/体重/睡眠ログを1件追加（画像はURL）"""
-    _ensure_tables()
-    sql = """
-    INSERT INTO meal_log (user_id, meal_image_url, weight_kg, habits, sleep_hour, created_at)
-    VALUES (%s, %s, %s, %s, %s, NOW())
+    """食事/体重/睡眠ログを1件追加（画像はURL）。日次ロールアップも同じトランザクションで更新"""
+    return _insert_meal_log(user_id, weight_kg, habits, sleep_hour, meal_image_url)
+
+# =============================
+# 一括投入（バックフィル用）
+# =============================
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+_MEAL_LOG_COLUMNS = ("user_id", "meal_image_url", "weight_kg", "habits", "sleep_hour", "created_at")
+_MEAL_LOG_INSERT = (
+    f"INSERT INTO meal_log ({', '.join(_MEAL_LOG_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(_MEAL_LOG_COLUMNS))})"
+)
+
+def insert_meal_log_chunk(rows: list[dict]) -> int:
     """
-    conn = _get_conn()
-    try:
+    1チャンクを1トランザクションで投入（検証済みの行。created_at は必須）
+    失敗したチャンクはロールバックされ、それ以前のチャンクは確定したまま
+    """
+    args = [tuple(r.get(c) for c in _MEAL_LOG_COLUMNS) for r in rows]
+    if not args:
+        return 0
+    with _connection() as conn:
+        conn.begin()
+        try:
+            with conn.cursor() as cur:
+                _executemany(cur, _MEAL_LOG_INSERT, args)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(args)
+
+def refresh_daily_summaries(user_ids) -> int:
+    """投入後に日次ロールアップを meal_log から作り直す（ユーザごとに1トランザクション）"""
+    count = 0
+    with _connection() as conn:
+        for user_id in sorted(set(user_ids)):
+            conn.begin()
+            try:
+                with conn.cursor() as cur:
+                    _execute(cur, "SELECT user_id FROM user_daily_summary WHERE user_id=%s FOR UPDATE", (user_id,))
+                    days, today = _rebuild_days(cur, user_id)
+                    _upsert_summary(cur, user_id, days, today)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            count += 1
+    return count
+
+def bulk_add_meal_logs(rows, chunk_size: int = BULK_CHUNK_SIZE, on_progress=None) -> int:
+    """
+    ログを chunk_size 行ずつまとめて投入し、投入件数を返す。rows は検証済み dict の iterable
+    on_progress: チャンクごとに {"chunk", "rows", "total", "rows_per_sec"} で呼ばれる
+    """
+    total, users, chunk, n = 0, set(), [], 0
+    t0 = time.perf_counter()
+
+    def flush():
+        nonlocal total, chunk, n
+        total += insert_meal_log_chunk(chunk)
+        users.update(r["user_id"] for r in chunk)
+        n += 1
+        if on_progress is not None:
+            elapsed = time.perf_counter() - t0
+            on_progress({"chunk": n, "rows": len(chunk), "total": total,
+                         "rows_per_sec": round(total / elapsed, 1) if elapsed else None})
+        chunk = []
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    refresh_daily_summaries(users)
+    return total
+
+# =============================
+# 後回し書き込み（write_behind.py）
+# =============================
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") == "1"
+
+# created_at は入れない（列の DEFAULT CURRENT_TIMESTAMP = DB の時計。同期で書く NOW() やロールアップの「今日」と揃える）
+_WB_MEAL_LOG_COLUMNS = _MEAL_LOG_COLUMNS[:-1]
+_WB_MEAL_LOG_INSERT = (
+    f"INSERT INTO meal_log ({', '.join(_WB_MEAL_LOG_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(_WB_MEAL_LOG_COLUMNS))})"
+)
+_ANSWER_COLUMNS = ("user_id", "answer", "score_percent", "improvement", "future_image_url")
+_ANSWER_INSERT = (
+    f"INSERT INTO generated_answers ({', '.join(_ANSWER_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(_ANSWER_COLUMNS))})"
+)
+
+def _meal_log_record(
+    user_id: str,
+    weight_kg: int | None = None,
+    habits: int | None = None,
+    sleep_hour: int | None = None,
+    meal_image_url: str | None = None
+) -> dict:
+    return {"user_id": user_id, "meal_image_url": meal_image_url, "weight_kg": weight_kg,
+            "habits": habits, "sleep_hour": sleep_hour}
+
+def insert_meal_logs(records: list[dict]) -> int:
+    """
+    後回し書き込みの1バッチを1トランザクションで書く。meal_log の INSERT、ロールアップ行のロック、
+    ロールアップの更新をそれぞれ1文で（初回のユーザを除き件数によらず3文。1件ずつ書くと1件あたり4文）
+    記録の日時は書き込んだ時点の DB の時刻（同期の _insert_meal_log と同じ）
+    """
+    by_user: dict[str, list[dict]] = {}
+    for r in records:
+        by_user.setdefault(r["user_id"], []).append(r)
+    with _connection() as conn:
+        conn.begin()
+        try:
+            with conn.cursor() as cur:
+                _executemany(cur, _WB_MEAL_LOG_INSERT, [tuple(r.get(c) for c in _WB_MEAL_LOG_COLUMNS) for r in records])
+                # 既存のロールアップ行をまとめて1文でロック（InnoDB は主キー順に取るので他のバッチとデッドロックしない）
+                users = sorted(by_user)
+                _execute(
+                    cur,
+                    f"SELECT user_id, days_json, NOW() AS now FROM user_daily_summary "
+                    f"WHERE user_id IN ({', '.join(['%s'] * len(users))}) FOR UPDATE",
+                    users
+                )
+                found = {row["user_id"]: row for row in cur.fetchall()}
+                summaries = []
+                for user_id in users:
+                    row = found.get(user_id)
+                    if row:
+                        today = row["now"].date()
+                        days = json.loads(row["days_json"])
+                        for r in by_user[user_id]:
+                            new = rollup.entry(row["now"], r["weight_kg"], r["habits"], r["sleep_hour"])
+                            days = rollup.merge_entry(days, new, today)
+                    else:
+                        days, today = _rebuild_days(cur, user_id)  # 初回のユーザだけ1人ずつ
+                    summaries.append((user_id, days, today))
+                _upsert_summaries(cur, summaries)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(records)
+
+def insert_generated_answers(records: list[dict]) -> int:
+    """後回し書き込みの1バッチ（generated_answers を複数行 INSERT 1文で）"""
+    args = [tuple(r.get(c) for c in _ANSWER_COLUMNS) for r in records]
+    with _connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, (user_id, meal_image_url, weight_kg, habits, sleep_hour))
+            _executemany(cur, _ANSWER_INSERT, args)
+    return len(args)
+
+def _transient_db_error(e: BaseException) -> bool:
+    """接続断・ロック待ち・接続の取得待ちなど、時間をおけば書ける失敗（それ以外は行の問題として dead-letter へ）"""
+    import pymysql
+
+    return isinstance(e, (PoolTimeout, OSError, TimeoutError, pymysql.err.OperationalError, pymysql.err.InterfaceError))
+
+_WRITE_BEHIND_FLUSH = {"meal_log": insert_meal_logs, "generated_answers": insert_generated_answers}
+_writers: dict[str, WriteBehind] = {}
+_writers_lock = threading.Lock()
+
+def _writer(name: str) -> WriteBehind:
+    writer = _writers.get(name)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(name)
+            if writer is None:
+                writer = WriteBehind(name, _WRITE_BEHIND_FLUSH[name], transient=_transient_db_error)
+                writer.start()
+                _writers[name] = writer
+    return writer
+
+def start_write_behind() -> int:
+    """起動時に呼ぶ。前回書き切れなかった追記ログを回収して書き始める（回収した件数を返す）"""
+    if not WRITE_BEHIND:
         return 0
-    finally:
-        conn.close()
+    return sum(_writer(name).stats["recovered"] for name in _WRITE_BEHIND_FLUSH)
+
+def close_write_behind(timeout: float) -> bool:
+    """
+    終了時に呼ぶ。溜まっている分を timeout 秒まで書く（書けなかった分は追記ログから次の起動で回収）。
+    閉じた後の save_*_async はその場で書く
+    """
+    deadline = time.monotonic() + timeout
+    with _writers_lock:
+        writers = list(_writers.values())
+    return all([w.close(max(0.0, deadline - time.monotonic())) for w in writers])
+
+def write_behind_stats() -> dict:
+    return {name: w.snapshot() for name, w in list(_writers.items())}
+
+
+# =============================
+# 非同期版（FastAPI 用）
+# =============================
+async def save_init_list_async(*args, **kwargs) -> int:
+    return await _run(save_init_list, *args, **kwargs)
+
+async def fetch_init_info_async(user_id: str):
+    return await _run(fetch_init_info, user_id)
+
+async def fetch_past_info_async(user_id: str):
+    return await _run(fetch_past_info, user_id)
+
+async def fetch_past_summary_async(user_id: str, pending: dict | None = None) -> dict:
+    return await _run(fetch_past_summary, user_id, pending)
+
+async def ping_async() -> None:
+    await _run(ping)
+
+async def fetch_info_async(user_id: str):
+    return await _run(fetch_info, user_id)
+
+async def save_past_info_async(*args, **kwargs) -> int:
+    if WRITE_BEHIND and _writer("meal_log").add(_meal_log_record(*args, **kwargs)):
+        return 0
+    return await _run(save_past_info, *args, **kwargs)
+
+async def save_generated_answer_async(result: dict) -> int:
+    if WRITE_BEHIND and _writer("generated_answers").add(_answer_record(result)):
+        return 0
+    return await _run(save_generated_answer, result)
+
+async def fetch_future_images_async(user_id: str) -> dict:
+    return await _run(fetch_future_images, user_id)
+
+async def save_future_image_async(user_id: str, record: dict) -> int:
+    return await _run(save_future_image, user_id, record)
+
+def save_future_image_when_stored(user_id: str, record: dict, stored) -> None:
+    """
+    stored（generater.future_image_stored の Future）が成功したら DB スレッドで記録する。待たない。
+    アップロードに失敗した未来像は記録しない（次回の使い回しで消えた URL を返さない）
+    """
+    def done(fut) -> None:
+        error = "cancelled" if fut.cancelled() else fut.exception()
+        if error is not None:
+            logger.warning("future image not stored, record skipped: %s: %s", record["future_image_url"], error)
+            return
+        try:
+            _get_executor().submit(save_future_image, user_id, record)
+        except RuntimeError as e:
+            logger.warning("future image record skipped on shutdown: %s", e)
+
+    stored.add_done_callback(done)
+
+async def add_meal_log_async(*args, **kwargs) -> int:
+    return await _run(add_meal_log, *args, **kwargs)
+
+async def insert_meal_log_chunk_async(rows: list[dict]) -> int:
+    return await _run(insert_meal_log_chunk, rows)
+
+async def refresh_daily_summaries_async(user_ids) -> int:
+    return await _run(refresh_daily_summaries, user_ids)
 
 
 # =============================
@@ -268,9 +713,10 @@ def add_meal_log(
 # =============================
 if __name__ == "__main__":
     uid = "test_user_str"
+    print("schema version:", bootstrap())
 
     # プロフィール保存（URLで, 数値はstr）
-    save_init_list(uid, "171.2", "male", "24", "https://example.com/avatar.png")
+    save_init_list(uid, "171.2", "male", "24", b"https://example.com/avatar.png")
 
     # 食事ログ（URLで, 数値はstr）
     save_past_info(
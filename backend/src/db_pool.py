@@ -0,0 +1,182 @@
+"""
+DB コネクションプール（pymysql 想定・スレッドセーフ）
+
+概要
+- ConnectionPool: min/max サイズ付きのプール。取得時にヘルスチェック、返却時にアイドル掃除
+- connect は引数で差し替え可能（ベンチマークでは sqlite3 を使う）
+
+注意
+- プール自体は同期 API。FastAPI からは database.*_async（スレッドプール経由）で呼ぶ
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Iterator, Tuple
+
+
+class PoolTimeout(RuntimeError):
+    """max_size まで使用中で、acquire_timeout 内に空きが出なかった"""
+
+
+def _default_ping(conn: Any) -> None:
+    # pymysql: 切断済みなら例外（reconnect はしない。壊れた接続は作り直す）
+    ping = getattr(conn, "ping", None)
+    if ping is not None:
+        ping(reconnect=False)
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        *,
+        min_size: int = 1,
+        max_size: int = 10,
+        idle_timeout: float = 300.0,
+        acquire_timeout: float = 10.0,
+        ping_interval: float = 30.0,
+        ping: Callable[[Any], None] = _default_ping,
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("0 <= min_size <= max_size, max_size >= 1 を満たしてください。")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+        self._ping = ping
+
+        # (conn, 最終返却時刻)。右端が最も新しい（LIFO で温かい接続を再利用）
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._size = 0  # 使用中 + アイドル
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "broken": 0}
+
+    # -------- 取得 / 返却 --------
+    def acquire(self) -> Any:
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("ConnectionPool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, 0.0
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"DB接続の取得がタイムアウトしました（max_size={self.max_size}）")
+                self._cond.wait(remaining)
+
+        # 接続生成・ping はロック外で行う（ネットワーク待ちで他スレッドを止めない）
+        if conn is not None:
+            if time.monotonic() - last_used < self.ping_interval:
+                self.stats["reused"] += 1
+                return conn
+            try:
+                self._ping(conn)
+                self.stats["reused"] += 1
+                return conn
+            except Exception:
+                self.stats["broken"] += 1
+                self._close_quietly(conn)
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self.stats["created"] += 1
+        return conn
+
+    def release(self, conn: Any, *, discard: bool = False) -> None:
+        now = time.monotonic()
+        to_close = []
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                to_close.append(conn)
+            else:
+                self._idle.append((conn, now))
+            to_close.extend(self._evict_idle_locked(now))
+            self._cond.notify()
+        for c in to_close:
+            self._close_quietly(c)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """with pool.connection() as conn: ...（例外時は接続を破棄）"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    # -------- 保守 --------
+    def fill(self) -> None:
+        """min_size まで事前に接続を張る（起動時のウォームアップ用）"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            self.stats["created"] += 1
+            self.release(conn)
+
+    def _evict_idle_locked(self, now: float) -> list:
+        # 古い順（左端）から、min_size を割らない範囲で idle_timeout 超えを閉じる
+        evicted = []
+        while self._idle and self._size > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            evicted.append(conn)
+        self.stats["evicted"] += len(evicted)
+        return evicted
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [c for c, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for c in idle:
+            self._close_quietly(c)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    @staticmethod
+    def _close_quietly(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -1,18 +1,31 @@
 
 from __future__ import annotations
 
+import asyncio
 import base64
 import json
+import logging
 import os
+import threading
 import time
-from typing import Any, Dict, Optional
-
-import boto3
-from botocore.config import Config
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+import metrics
+import shared_cache
+import startup
+from blobstore import Blob, get_blob_store
+from images import preprocess_image
+from limiter import BedrockUnavailable, guard_for
+from model_backend import ModelBackend, make_model_backend
+from prompt_context import encode_context
+from s3_upload import S3Uploader, make_client
+from singleflight import SingleFlight
+from image_cache import DiskCache, LRUCache, S3Cache, TieredCache, digest, make_key
 
 # ========= 設定（環境変数で上書き可） =========
-from dotenv import load_dotenv
-load_dotenv()
+startup.load_env()
 if not os.getenv("BEDROCK_CLAUDE_MODEL_ID"):
     print("[hint] Set AWS_BEARER_TOKEN_BEDROCK to your Bedrock API key.")
 BEDROCK_REGION = os.getenv("BEDROCK_REGION", "us-east-1")
@@ -30,19 +43,105 @@ NOVA_CANVAS_MODEL_ID = os.getenv(
 OUTPUT_S3_BUCKET = os.getenv("OUTPUT_S3_BUCKET")  # 例: "my-generated-images"
 OUTPUT_S3_PREFIX = os.getenv("OUTPUT_S3_PREFIX", "generated/")
 SCORE_THRESHOLD = int(os.getenv("SCORE_THRESHOLD", "50"))  # 50%未満なら「悪い」
+# 未来像の段階（"スコア上限:variant" をカンマ区切りで低い順に）。未指定なら SCORE_THRESHOLD で fat / muscle の2段階
+# 例: "20:fat,35:fat_moderate,50:fat_mild,100:muscle"（段階ごとに別の画像・別の記録になる）
+FUTURE_IMAGE_BANDS = os.getenv("FUTURE_IMAGE_BANDS") or f"{SCORE_THRESHOLD}:fat,100:muscle"
 
-BR_CONFIG = Config(read_timeout=60, retries={"max_attempts": 3})
+# システムプロンプトと顔画像に cache_control を付ける（対応モデルのみ。短すぎるとキャッシュされない）
+CLAUDE_PROMPT_CACHE = os.getenv("CLAUDE_PROMPT_CACHE", "0") == "1"
 
-# ========= AWS クライアント =========
-_bedrock = boto3.client("bedrock-runtime", region_name=BEDROCK_REGION, config=BR_CONFIG)
+# Bedrock 呼び出し用スレッド数（1ワーカーで同時に捌ける生成数の上限）
+GEN_MAX_WORKERS = int(os.getenv("GEN_MAX_WORKERS", "16"))
+# Claude と並行して未来像を先行生成する（使わない方は破棄）。前回の記録で使い回せる段階は作らない
+# 作る必要のある段階が SPECULATIVE_MAX_VARIANTS を超えるときはスコアが出てから1枚だけ作る
+SPECULATIVE_FUTURE_IMAGE = os.getenv("SPECULATIVE_FUTURE_IMAGE", "1") == "1"
+SPECULATIVE_MAX_VARIANTS = int(os.getenv("SPECULATIVE_MAX_VARIANTS", "2"))
+
+# 未来像キャッシュ（メモリ必須、ディスク/S3 は設定時のみ）
+NOVA_CACHE_MAX_BYTES = int(os.getenv("NOVA_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+NOVA_CACHE_DIR = os.getenv("NOVA_CACHE_DIR")
+NOVA_CACHE_S3_BUCKET = os.getenv("NOVA_CACHE_S3_BUCKET")
+NOVA_CACHE_S3_PREFIX = os.getenv("NOVA_CACHE_S3_PREFIX", "cache/nova/")
+
+# 同じ入力の生成をまとめる（二度押し・再送対策）。GEN_DEDUP_TTL 秒は結果も使い回す
+GEN_DEDUP_TTL = float(os.getenv("GEN_DEDUP_TTL", "30"))
+GEN_DEDUP_MAX = int(os.getenv("GEN_DEDUP_MAX", "1024"))
 
-_s3 = None
-if OUTPUT_S3_BUCKET:
-    _s3 = boto3.client("s3", region_name=os.getenv("AWS_REGION", BEDROCK_REGION))
+logger = logging.getLogger("uvicorn.error")
+
+# ========= AWS クライアント =========
+# モデル呼び出し口は MODEL_BACKEND（bedrock | replay | stub）で選び、初回呼び出し時に作る。
+# ベンチなどは generater._bedrock に同じ形のオブジェクトを代入して差し替えられる
+_bedrock: Optional[ModelBackend] = None
+
+# boto3 の既定セッションはスレッドセーフでないので、クライアント生成は1本ずつ
+_clients_lock = threading.Lock()
+
+def _model() -> ModelBackend:
+    global _bedrock
+    if _bedrock is None:
+        with _clients_lock:
+            if _bedrock is None:
+                _bedrock = make_model_backend()
+    return _bedrock
+
+# S3 クライアントも初回利用時に作る（boto3 の import だけで 100ms 以上かかるため）
+_s3: Any = None
+
+def _get_s3() -> Any:
+    global _s3
+    if _s3 is None:
+        with _clients_lock:
+            if _s3 is None:
+                _s3 = make_client(os.getenv("AWS_REGION", BEDROCK_REGION))
+    return _s3
+
+_uploader: Optional[S3Uploader] = None
+
+def _get_uploader() -> S3Uploader:
+    global _uploader
+    if _uploader is None:
+        with _clients_lock:
+            if _uploader is None:
+                _uploader = S3Uploader(_get_s3(), OUTPUT_S3_BUCKET, OUTPUT_S3_PREFIX)
+    return _uploader
+
+# 混雑・一時障害として扱うエラー（同時実行数を絞って再試行する）
+_OVERLOAD_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+
+def _is_overload(e: BaseException) -> bool:
+    # 例外時だけ呼ばれるので botocore はここで読み込む
+    from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+    if isinstance(e, ClientError):
+        return e.response.get("Error", {}).get("Code") in _OVERLOAD_CODES
+    return isinstance(e, (ReadTimeoutError, ConnectTimeoutError, EndpointConnectionError))
+
+def _guarded(model_id: str, func: Callable[[], Any], then: Optional[Callable[[Any], Any]] = None) -> Any:
+    """モデルIDごとの同時実行数制御・リトライ予算・サーキットブレーカー越しに呼ぶ（then: 応答を読み終えるまでスロットを持つ）"""
+    return guard_for(model_id, _is_overload).call(func, then)
+
+def _count_io(model_id: str, request_body: str, response_bytes: int, usage: Optional[Dict[str, Any]] = None) -> None:
+    """送受信バイト数と usage のトークン数をメトリクスに足す"""
+    metrics.BEDROCK_BYTES.inc(len(request_body.encode("utf-8")), model=model_id, direction="request")
+    metrics.BEDROCK_BYTES.inc(response_bytes, model=model_id, direction="response")
+    for kind, n in (usage or {}).items():
+        if kind.endswith("_tokens") and isinstance(n, int) and n:
+            metrics.BEDROCK_TOKENS.inc(n, model=model_id, kind=kind[:-len("_tokens")])
 
 
 # ========= Claude (LLM) – マルチモーダル =========
-def _image_block(img_bytes: bytes, media_type: str = "image/jpeg") -> Dict[str, Any]:
+def _image_block(img_bytes: bytes) -> Dict[str, Any]:
+    # 縮小・再エンコードしてから送る（media_type も実際の形式に合わせる）
+    with metrics.measure("image_preprocess"):
+        img_bytes, media_type = preprocess_image(img_bytes)
     return {
         "type": "image",
         "source": {"type": "base64", "media_type": media_type, "data": base64.b64encode(img_bytes).decode("utf-8")},
@@ -54,27 +153,36 @@ def json_safe(obj):
         return obj.isoformat()  # ISO 8601 形式の文字列に変換
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
+# 毎回同じ部分（システムプロンプト）。CLAUDE_PROMPT_CACHE=1 ならプロンプトキャッシュの対象にする
+_CLAUDE_SYSTEM = (
+    "あなたは誠実なヘルスコーチです。医療的診断は行いません。"
+    "必ず次のJSONだけを返してください："
+    "{"
+    "\"answer\":\"日本語で2〜4文の評価\","
+    "\"score_percent\":整数(0〜100),"
+    "\"improvement\":\"改善案を日本語で1〜2文\""
+    "}\n"
+    "[MEAL] の食事画像と [CONTEXT] の情報から食事の健全性と将来リスクを評価してください。"
+    "score_percent は 0〜100 で、低いほどリスクが高いとします。\n"
+    "[CONTEXT] の形式:\n"
+    "- profile: 本人のプロフィール（key=value, 記載の無い項目は不明）\n"
+    "- history: 日別の最新記録（新しい順, date は月-日, habits は運動時間(分), - は未記録）\n"
+    "- avg7 / avg30: 直近7日 / 30日の平均\n"
+    "- weight_trend_kg_per_day: 体重の傾き（kg/日, 負なら減少）\n"
+    "ルール:\n"
+    "- FACE画像は本人の同一性文脈のみ。顔画像から敏感属性は推論しない\n"
+    "- 医療診断はしない\n"
+    "- 出力は指定JSONのみ\n"
+)
+
+_CACHE_POINT = {"cache_control": {"type": "ephemeral"}}
+
 def _build_claude_payload(meal_image: bytes, face_image: bytes, past: Dict[str, Any], init: Any) -> Dict[str, Any]:
-    # init は dict / list いずれも許容（そのままJSON文字列にして渡す）
-    system = (
-        "あなたは誠実なヘルスコーチです。医療的診断は行いません。"
-        "必ず次のJSONだけを返してください："
-        "{"
-        "\"answer\":\"日本語で2〜4文の評価\","
-        "\"score_percent\":整数(0〜100),"
-        "\"improvement\":\"改善案を日本語で1〜2文\""
-        "}"
-    )
-    user_text = (
-        "以下の情報から食事の健全性と将来リスクを評価してください。"
-        "score_percent は 0〜100 で、低いほどリスクが高いとします。"
-        "\n\n[CONTEXT]\n"
-        f"パーソナル情報: {json.dumps(init, ensure_ascii=False)}\n"
-        f"過去情報: {json.dumps(past, ensure_ascii=False, default=json_safe)}\n"
-        "- 顔画像から敏感属性は推論しない\n"
-        "- 医療診断はしない\n"
-        "- 出力は指定JSONのみ\n"
-    )
+    # init は dict / list いずれも許容（prompt_context で圧縮表現にする）
+    # 変わらない順に並べる: システム（全員共通）→ 顔画像（ユーザごとに同じ）→ 食事画像・コンテキスト（毎回変わる）
+    # プロンプトキャッシュ有効時は前2つの末尾にキャッシュ位置を置く（短い前置きはモデルの最小長未満だと無視される）
+    cache = _CACHE_POINT if CLAUDE_PROMPT_CACHE else {}
+    system: Any = [{"type": "text", "text": _CLAUDE_SYSTEM, **cache}] if cache else _CLAUDE_SYSTEM
     return {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 800,
@@ -83,23 +191,16 @@ def _build_claude_payload(meal_image: bytes, face_image: bytes, past: Dict[str,
         "messages": [{
             "role": "user",
             "content": [
+                {"type": "text", "text": "[FACE]"},
+                {**_image_block(face_image), **cache},
+                {"type": "text", "text": "[MEAL]"},
                 _image_block(meal_image),
-                {"type": "text", "text": user_text},
-                _image_block(face_image),
-                {"type": "text", "text": "FACEは本人の同一性文脈のみ。敏感属性は推論しない。"}
+                {"type": "text", "text": f"[CONTEXT]\n{encode_context(init, past)}"},
             ]
         }]
     }
 
-def _invoke_claude(payload: Dict[str, Any]) -> Dict[str, Any]:
-    resp = _bedrock.invoke_model(
-        modelId=CLAUDE_MODEL_ID,
-        body=json.dumps(payload, ensure_ascii=False),
-        contentType="application/json",
-        accept="application/json",
-    )
-    data = json.loads(resp["body"].read())
-    text = data.get("content", [{}])[0].get("text", "")
+def _parse_claude_text(text: str) -> Dict[str, Any]:
     try:
         parsed = json.loads(text)
         if isinstance(parsed, dict) and "answer" in parsed and "score_percent" in parsed:
@@ -109,92 +210,106 @@ def _invoke_claude(payload: Dict[str, Any]) -> Dict[str, Any]:
     # フォールバック
     return {"answer": (text or "評価を生成できませんでした。"), "score_percent": 50, "improvement": "fallback"}
 
-
-# ========= Nova Canvas – “太い未来像” 生成 =========
-def _invoke_nova_canvas_fat(face_image: bytes, similarity: float = 0.98) -> bytes:
-    import base64, json
-    b64 = base64.b64encode(face_image).decode("utf-8")
-
-    
-    
-    prompt = (
-     "Same person and exact same face identity.one single person only. Predict the same person in the future with extreme weight gain: very obese appearance, very round and full face, large double chin, thick neck, fuller cheeks, and a big round belly with fat around the stomach and waist. The person should be standing with a slouched posture, hunched shoulders, and a weak, low-energy stance, looking unmotivated and tired. Only one single realistic photographic image"
-)
-
-
-    negative = (
-        "two people, multiple people, duplicate person, before and after, split image, side-by-side, collage, "
-        "face replacement, different person, extra body, extra face, twin, cartoon, deformed, low quality"
-    )
+def _invoke_claude(payload: Dict[str, Any]) -> Dict[str, Any]:
+    body = json.dumps(payload, ensure_ascii=False)
+    with metrics.measure("claude", model=CLAUDE_MODEL_ID):
+        resp = _guarded(CLAUDE_MODEL_ID, lambda: _model().invoke_model(
+            modelId=CLAUDE_MODEL_ID,
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+        ))
+        raw = resp["body"].read()
+    data = json.loads(raw)
+    _count_io(CLAUDE_MODEL_ID, body, len(raw), data.get("usage"))
+    text = data.get("content", [{}])[0].get("text", "")
+    return _parse_claude_text(text)
+
+def _invoke_claude_stream(payload: Dict[str, Any], on_text: Callable[[str], None]) -> Dict[str, Any]:
+    """invoke_model_with_response_stream 版。生成途中のテキストを on_text に逐次渡す"""
+    # 再試行するのはストリーム確立まで（断片を送り始めたら途中からはやり直さない）
+    body = json.dumps(payload, ensure_ascii=False)
+    parts, received, usage = [], 0, {}
+
+    def read(resp: Dict[str, Any]) -> None:
+        # 読み終える（または閉じる）までは流量制御のスロットを持ったまま（_guarded の then）
+        nonlocal received
+        stream = resp["body"]
+        try:
+            for event in stream:
+                chunk = event.get("chunk")
+                if not chunk:
+                    continue
+                received += len(chunk["bytes"])
+                data = json.loads(chunk["bytes"])
+                # usage は message_start（入力）と message_delta（出力）に分かれて届く
+                usage.update(data.get("message", {}).get("usage") or data.get("usage") or {})
+                if data.get("type") == "content_block_delta" and data.get("delta", {}).get("type") == "text_delta":
+                    text = data["delta"].get("text", "")
+                    parts.append(text)
+                    on_text(text)
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    with metrics.measure("claude_stream", model=CLAUDE_MODEL_ID):
+        _guarded(CLAUDE_MODEL_ID, lambda: _model().invoke_model_with_response_stream(
+            modelId=CLAUDE_MODEL_ID,
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+        ), then=read)
+    _count_io(CLAUDE_MODEL_ID, body, received, usage)
+    return _parse_claude_text("".join(parts))
 
 
-    prompt = ("""Generate one realistic photographic image of a single person.
+# ========= Nova Canvas – “太い未来像” 生成 =========
+_FAT_PROMPT = """Generate one realistic photographic image of a single person.
 Keep the same face identity and clothing as the input photo.
 Depict the person with an extremely oversized physique: Really fat body and face. a very round and heavy face, extremely full cheeks, a very thick neck, broad shoulders, very thick arms and legs, and an extraordinarily enlarged round belly that dominates the body and stretches the clothing to its limit. The entire figure should appear gigantic, overwhelmingly huge, and excessively expanded in size and volume.
 The person should be standing with an exaggeratedly slouched and hunched posture, with a weary, exhausted facial expression, no smile, looking lazy, unmotivated, and drained of energy."""
-)
 
+_FAT_NEGATIVE = (
+    "two people, multiple people, duplicate person, before and after, split image, side-by-side, collage, "
+    "face replacement, different person, extra body, extra face, twin, cartoon, deformed, low quality"
+)
 
+_FAT_MODERATE_PROMPT = """Generate one realistic photographic image of a single person.
+Keep the same face identity and clothing as the input photo.
+Depict the person as clearly overweight: a rounder face with full cheeks and a double chin, a thicker neck, heavy arms, and a large belly that pushes out the clothing.
+The person should be standing with a slightly slouched posture and a tired expression, looking sluggish and out of shape."""
 
+_FAT_MILD_PROMPT = """Generate one realistic photographic image of a single person.
+Keep the same face identity and clothing as the input photo.
+Depict the person as slightly overweight: a softer, fuller face, a little extra weight around the waist, and a small belly that makes the clothing fit a bit tight.
+The person should look somewhat tired and less energetic, with a relaxed, slightly slouched posture."""
 
-
-
-
-    payload = {
-        "taskType": "IMAGE_VARIATION",
-        "imageVariationParams": {
-            "images": [b64],
-            "text": prompt,
-            "negativeText": negative,
-            "similarityStrength": max(0.95, min(1.0, similarity)),
-        },
-        "imageGenerationConfig": {
-            "numberOfImages": 1,
-            "cfgScale": 6.5,
-            "seed": 42
-            # width/height は一旦外す（入れる場合は 16 の倍数 & 画素上限内）
-        },
-    }
-    resp = _bedrock.invoke_model(
-        modelId=NOVA_CANVAS_MODEL_ID,
-        body=json.dumps(payload),
-        contentType="application/json",
-        accept="application/json",
-    )
-    print(resp)
-    out = json.loads(resp["body"].read())
-
-    # images は base64 文字列の配列
-    imgs = out.get("images") or []
-    
-    if not imgs:
-        raise RuntimeError("Nova Canvas responseに画像がありません。")
-    img_b64 = imgs[0] if isinstance(imgs[0], str) else imgs[0].get("b64") or imgs[0].get("base64Data")
-    if not img_b64:
-        raise RuntimeError("Nova Canvas responseに画像データが見つかりません。")
-    return base64.b64decode(img_b64)
-
-def _invoke_nova_canvas_muscle(face_image: bytes, similarity: float = 0.98) -> bytes:
-    import base64, json
-    b64 = base64.b64encode(face_image).decode("utf-8")
-
-    prompt = (
-        """Generate one realistic photographic image of a single person.
+_MUSCLE_PROMPT = """Generate one realistic photographic image of a single person.
 Keep the same face identity and clothing as the input photo.
 Depict the person with a very muscular and athletic physique: broad shoulders, defined chest, strong arms, visible six-pack abs, thick legs, and an overall fit, lean, and powerful body.
 The person should appear confident and energetic, with an upright posture, standing tall, chest out, and looking motivated and healthy.
 Make the body appear naturally athletic, not cartoonish, and maintain a realistic photographic style."""
-    )
 
-    negative = (
-        "obese, overweight, skinny, underweight, duplicate person, two people, side-by-side, collage, "
-        "cartoon, anime, deformed, unrealistic, low quality"
-    )
+_MUSCLE_NEGATIVE = (
+    "obese, overweight, skinny, underweight, duplicate person, two people, side-by-side, collage, "
+    "cartoon, anime, deformed, unrealistic, low quality"
+)
+
+_NOVA_PROMPTS = {
+    "fat": (_FAT_PROMPT, _FAT_NEGATIVE),
+    "fat_moderate": (_FAT_MODERATE_PROMPT, _FAT_NEGATIVE),
+    "fat_mild": (_FAT_MILD_PROMPT, _FAT_NEGATIVE),
+    "muscle": (_MUSCLE_PROMPT, _MUSCLE_NEGATIVE),
+}
 
-    payload = {
+def _nova_params(variant: str, similarity: float) -> Dict[str, Any]:
+    """画像以外の生成パラメータ（キャッシュキーにもそのまま使う）"""
+    prompt, negative = _NOVA_PROMPTS[variant]
+    return {
+        "modelId": NOVA_CANVAS_MODEL_ID,
         "taskType": "IMAGE_VARIATION",
         "imageVariationParams": {
-            "images": [b64],
             "text": prompt,
             "negativeText": negative,
             "similarityStrength": max(0.95, min(1.0, similarity)),
@@ -203,19 +318,30 @@ Make the body appear naturally athletic, not cartoonish, and maintain a realisti
             "numberOfImages": 1,
             "cfgScale": 6.5,
             "seed": 42
+            # width/height は一旦外す（入れる場合は 16 の倍数 & 画素上限内）
         },
     }
 
-    resp = _bedrock.invoke_model(
-        modelId=NOVA_CANVAS_MODEL_ID,
-        body=json.dumps(payload),
-        contentType="application/json",
-        accept="application/json",
-    )
+def _invoke_nova_canvas(variant: str, face_image: bytes, similarity: float = 0.98) -> bytes:
+    params = _nova_params(variant, similarity)
+    model_id = params.pop("modelId")
+    with metrics.measure("image_preprocess"):
+        face_image, _ = preprocess_image(face_image, fmt="JPEG")  # Nova Canvas の入力は PNG/JPEG のみ
+    params["imageVariationParams"]["images"] = [base64.b64encode(face_image).decode("utf-8")]
+    body = json.dumps(params)
+    with metrics.measure("nova_canvas", model=model_id, variant=variant):
+        resp = _guarded(model_id, lambda: _model().invoke_model(
+            modelId=model_id,
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+        ))
+        raw = resp["body"].read()
+    _count_io(model_id, body, len(raw))
+    out = json.loads(raw)
 
-    out = json.loads(resp["body"].read())
+    # images は base64 文字列の配列
     imgs = out.get("images") or []
-    
     if not imgs:
         raise RuntimeError("Nova Canvas responseに画像がありません。")
     img_b64 = imgs[0] if isinstance(imgs[0], str) else imgs[0].get("b64") or imgs[0].get("base64Data")
@@ -223,14 +349,105 @@ Make the body appear naturally athletic, not cartoonish, and maintain a realisti
         raise RuntimeError("Nova Canvas responseに画像データが見つかりません。")
     return base64.b64decode(img_b64)
 
+def _invoke_nova_canvas_fat(face_image: bytes, similarity: float = 0.98) -> bytes:
+    return _invoke_nova_canvas("fat", face_image, similarity)
+
+def _invoke_nova_canvas_muscle(face_image: bytes, similarity: float = 0.98) -> bytes:
+    return _invoke_nova_canvas("muscle", face_image, similarity)
+
+
+# ========= 未来像キャッシュ（同じ顔・同じ設定なら再生成しない） =========
+def _build_image_cache() -> TieredCache:
+    tiers, names = [LRUCache(NOVA_CACHE_MAX_BYTES)], ["memory"]
+    shared = shared_cache.client("nova:")
+    if shared is not None:
+        # 複数ワーカー時: 他ワーカーが生成した未来像もディスク/S3 より先にここで拾う
+        tiers.append(shared)
+        names.append("shared")
+    if NOVA_CACHE_DIR:
+        tiers.append(DiskCache(NOVA_CACHE_DIR))
+        names.append("disk")
+    if NOVA_CACHE_S3_BUCKET:
+        tiers.append(S3Cache(_get_s3(), NOVA_CACHE_S3_BUCKET, NOVA_CACHE_S3_PREFIX))
+        names.append("s3")
+    return TieredCache(tiers, names)
+
+_image_cache: Optional[TieredCache] = None
+
+_image_cache_lock = threading.Lock()
+
+def _get_image_cache() -> TieredCache:
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = _build_image_cache()
+    return _image_cache
+
+def warm_up() -> None:
+    """lifespan からバックグラウンドで呼ぶ（最初のリクエストでクライアント生成を待たせない）"""
+    _model()
+    _get_image_cache()
+    if OUTPUT_S3_BUCKET:
+        _get_uploader().can_presign()
+
+def _face_bytes(face_image: bytes | Blob) -> bytes:
+    # Blob（DB からの遅延参照）はここで初めて読み込む
+    return face_image.read() if isinstance(face_image, Blob) else face_image
+
+def _face_digest(face_image: bytes | Blob) -> str:
+    # Blob のキーは内容の sha256 なので、読み込まずにキャッシュキーを作れる
+    return face_image.key if isinstance(face_image, Blob) else digest(face_image)
+
+def future_image_key(variant: str, face_image: bytes | Blob, similarity: float = 0.98) -> str:
+    """顔画像の sha256 + 生成パラメータ（同じなら Nova Canvas の出力も同じ）。未来像キャッシュとユーザごとの記録のキー"""
+    return make_key(_face_digest(face_image), _nova_params(variant, similarity))
+
+def _generate_future_png(variant: str, face_image: bytes | Blob, similarity: float = 0.98) -> bytes:
+    key = future_image_key(variant, face_image, similarity)
+    png = _get_image_cache().get(key)
+    if png is None:
+        png = _invoke_nova_canvas(variant, _face_bytes(face_image), similarity)
+        _get_image_cache().set(key, png)
+    return png
+
+def invalidate_future_images(face_image: bytes | Blob) -> int:
+    """プロフィール画像が差し替わったとき、旧画像の未来像キャッシュを全 variant 分削除"""
+    return _get_image_cache().delete_prefix(_face_digest(face_image) + "/")
+
+def image_cache_stats() -> Dict[str, Any]:
+    with _variant_stats_lock:
+        variants = dict(_variant_stats)
+    return {**_get_image_cache().snapshot(), "variant_reused": variants["reused"],
+            "variant_generated": variants["generated"]}
+
 
 def _put_to_s3_and_get_url(png_bytes: bytes) -> str:
-    if not _s3 or not OUTPUT_S3_BUCKET:
-        # data URL で返す
-        return "data:image/png;base64," + base64.b64encode(png_bytes).decode("utf-8")
-    key = OUTPUT_S3_PREFIX.rstrip("/") + f"/future-fat-{int(time.time())}.png"
-    _s3.put_object(Bucket=OUTPUT_S3_BUCKET, Key=key, Body=png_bytes, ContentType="image/png")
-    return f"s3://{OUTPUT_S3_BUCKET}/{key}"
+    with metrics.measure("image_upload", target="s3" if OUTPUT_S3_BUCKET else "blob"):
+        return _store_future_image(png_bytes)
+
+def _store_future_image(png_bytes: bytes) -> str:
+    if not OUTPUT_S3_BUCKET:
+        # blob ストアに保存して /images/{key} の相対パスで返す（data URL はレスポンスが肥大化する）
+        return f"/images/{get_blob_store().put(png_bytes)}"
+    # キーは内容の sha256（同じ未来像は1回だけ保存）。書き込みはバックグラウンドで、完了は待たない（s3_upload.py）
+    return _get_uploader().put(png_bytes, suffix=".png", content_type="image/png")
+
+def future_image_stored(future_url: str) -> Future:
+    """未来像の保存が終わったら完了する Future（S3 のアップロードが失敗したら例外。blob ストアは保存済み）"""
+    if OUTPUT_S3_BUCKET and future_url.startswith("s3://"):
+        return _get_uploader().stored(future_url)
+    done: Future = Future()
+    done.set_result(future_url)
+    return done
+
+def upload_stats() -> Dict[str, Any]:
+    return _uploader.snapshot() if _uploader is not None else {}
+
+def presign_s3_url(s3_uri: str, expires: int = 3600) -> str:
+    """s3://bucket/key をブラウザから取得できる署名付きURLにする（DB には s3:// のまま保存）"""
+    bucket, key = s3_uri[len("s3://"):].split("/", 1)
+    return _get_s3().generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires)
 import re
 import pathlib
 
@@ -254,44 +471,251 @@ def save_data_url_image(data_url: str, out_dir: str = "backend/out", basename: s
     return str(file_path)
 
 # ========= エクスポート: main.py から呼ぶ =========
-def generate_answer(meal_image_bytes: bytes, face_image_bytes: bytes,
-                    past: Dict[str, Any], init: Any) -> Dict[str, Any]:
+# fat: スコアが低い → “太い未来像” / muscle: スコアが高い → ムキムキ未来像（FUTURE_IMAGE_BANDS で細かく分けられる）
+def _parse_bands(spec: str) -> Tuple[Tuple[int, str], ...]:
+    bands = []
+    for part in spec.split(","):
+        upper, _, variant = part.strip().partition(":")
+        if variant not in _NOVA_PROMPTS:
+            raise ValueError(f"FUTURE_IMAGE_BANDS: unknown variant {variant!r} (choose from {', '.join(_NOVA_PROMPTS)})")
+        bands.append((int(upper), variant))
+    return tuple(sorted(bands))
+
+_BANDS = _parse_bands(FUTURE_IMAGE_BANDS)
+_NOVA_VARIANTS = tuple(dict.fromkeys(variant for _, variant in _BANDS))
+
+def _variant_for_score(score_percent: int) -> str:
+    for upper, variant in _BANDS:
+        if score_percent <= upper:
+            return variant
+    return _BANDS[-1][1]
+
+# ユーザごとの前回の未来像（variant → {"image_key", "future_image_url"}。database.fetch_future_images の形）
+_variant_stats = {"reused": 0, "generated": 0}
+_variant_stats_lock = threading.Lock()
+
+def _bump_variant(name: str) -> None:
+    # generate_answer と先読みの Nova はスレッドプールから呼ばれる
+    with _variant_stats_lock:
+        _variant_stats[name] += 1
+
+def _reusable(previous: Optional[Dict[str, Dict[str, str]]], face_image: bytes | Blob) -> Dict[str, str]:
+    """前回の記録のうち、今の顔画像・生成パラメータで作ったもの（= 作り直しても同じ画像）の URL"""
+    if not previous or not face_image:
+        return {}
+    return {
+        variant: rec["future_image_url"] for variant, rec in previous.items()
+        if variant in _NOVA_PROMPTS and rec.get("future_image_url")
+        and rec.get("image_key") == future_image_key(variant, face_image, 0.98)
+    }
+
+def _evaluate(meal_image_bytes: bytes, face_image_bytes: bytes | Blob,
+              past: Dict[str, Any], init: Any,
+              on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    payload = _build_claude_payload(meal_image_bytes, _face_bytes(face_image_bytes), past=past, init=init)
+    try:
+        if on_text is not None:
+            return _invoke_claude_stream(payload, on_text)
+        return _invoke_claude(payload)
+    except BedrockUnavailable as e:
+        # 混雑・障害中は待たせずに既定の評価で返す
+        logger.warning("claude unavailable, using fallback: %s", e)
+        return _parse_claude_text("")
+
+def _format_result(result: Dict[str, Any], future_url: Optional[str]) -> Dict[str, Any]:
+    score_percent = int(result.get("score_percent", 50))
+    return {
+        "answer": result.get("answer", ""),
+        "score_percent": 100-int(score_percent),
+        "improvement": result.get("improvement", ""),
+        "future_image_url": future_url,
+    }
+
+def generate_answer(meal_image_bytes: bytes, face_image_bytes: bytes | Blob,
+                    past: Dict[str, Any], init: Any,
+                    previous: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Any]:
     """
     main.py から load_func で呼ばれるエントリ。
     1) Claude で評価文＆スコア（0-100%）を生成
-    2) スコア < SCORE_THRESHOLD なら Nova Canvas で “太い未来像” を生成
-    返り値: {"answer": str, "score_percent": int, "future_image_url": Optional[str], "improvement": str}
+    2) スコアの段階（FUTURE_IMAGE_BANDS）の未来像を Nova Canvas で生成（previous に同じ段階の記録があれば使い回す）
+    返り値: {"answer": str, "score_percent": int, "future_image_url": Optional[str], "improvement": str,
+             "future_image_record": 新しく作ったときだけ {"variant", "image_key", "future_image_url"}}
     """
     # 1) 評価生成
-    payload = _build_claude_payload(meal_image_bytes, face_image_bytes, past=past, init=init)
-    result = _invoke_claude(payload)
-    answer = result.get("answer", "")
-    score_percent = int(result.get("score_percent", 50))
-    improvement = result.get("improvement", "")
+    result = _evaluate(meal_image_bytes, face_image_bytes, past, init)
+    variant = _variant_for_score(int(result.get("score_percent", 50)))
 
-    # 2) 将来画像（必要なら）
-    future_url = None
-    if score_percent <= SCORE_THRESHOLD:
+    # 2) 将来画像
+    future_url, record = _reusable(previous, face_image_bytes).get(variant), None
+    if future_url is not None:
+        _bump_variant("reused")
+    else:
         try:
-            png = _invoke_nova_canvas_fat(face_image_bytes, similarity=0.98)
+            png = _generate_future_png(variant, face_image_bytes, similarity=0.98)
             future_url = _put_to_s3_and_get_url(png)
+            record = _future_record(variant, face_image_bytes, future_url)
         except Exception as e:
             # 画像生成失敗時はログのみ（本関数はraiseしない設計）
-            print(f"[warn] future image generation failed: {e}")
-    elif score_percent > SCORE_THRESHOLD:  # 例: スコアが高い場合はムキムキ未来像
-        try:
-            png = _invoke_nova_canvas_muscle(face_image_bytes, similarity=0.98)
-            future_url = _put_to_s3_and_get_url(png)
-        except Exception as e:
-            print(f"[warn] future image generation failed: {e}")
+            logger.warning("future image generation failed: %s", e)
+    return {**_format_result(result, future_url), "future_image_record": record}
 
-    return {
-        "answer": answer,
-        "score_percent": 100-int(score_percent),
-        "improvement": improvement,
-        "future_image_url": future_url,
-    }
+def _future_record(variant: str, face_image: bytes | Blob, future_url: str) -> Dict[str, str]:
+    _bump_variant("generated")
+    return {"variant": variant, "image_key": future_image_key(variant, face_image, 0.98), "future_image_url": future_url}
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=GEN_MAX_WORKERS, thread_name_prefix="bedrock")
+    return _executor
+
+def drain(timeout: float) -> bool:
+    """
+    終了時に lifespan から呼ぶ。実行中の Bedrock 呼び出し（先行生成を含む）が終わるのを timeout 秒まで待つ。
+    まだ始まっていないものは取り消す。続けて受け付け済みの S3 アップロードを書き切る。時間内に終われば True
+    """
+    global _executor
+    deadline = time.monotonic() + timeout
+    executor, _executor = _executor, None
+    ok = True
+    if executor is not None:
+        waiter = threading.Thread(target=executor.shutdown, kwargs={"wait": True, "cancel_futures": True}, daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        ok = not waiter.is_alive()
+    if _uploader is not None:
+        ok = _uploader.close(max(0.0, deadline - time.monotonic())) and ok
+    return ok
+
+async def generate_answer_events(meal_image_bytes: bytes, face_image_bytes: bytes | Blob,
+                                 past: Dict[str, Any], init: Any,
+                                 *, stream_tokens: bool = False,
+                                 previous: Optional[Dict[str, Dict[str, str]]] = None,
+                                 ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    生成の途中経過を (イベント名, データ) で順に返す（ストリーミング配信用）。
+      "token"        : Claude の生成テキスト断片（stream_tokens=True のとき）
+      "answer"       : 評価（answer / score_percent / improvement）。Claude が返った時点
+      "future_image" : 未来像の URL（失敗時は None）。Nova Canvas が返った時点
+      "result"       : generate_answer と同じ形の最終結果
+    Claude の評価と並行して各段階の未来像を先行生成し、
+    スコアが出た時点で該当しない方はキャンセル（実行中なら結果を捨てる）。
+    所要時間は「Claude + Nova」から「max(Claude, Nova)」になる。
+    previous（ユーザの前回の記録）で使い回せる段階は先行生成もしない（毎日使うユーザはほぼ Nova を呼ばない）
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+
+    tokens: asyncio.Queue = asyncio.Queue()
+    on_text = (lambda t: loop.call_soon_threadsafe(tokens.put_nowait, t)) if stream_tokens else None
+    evaluation = loop.run_in_executor(executor, _evaluate, meal_image_bytes, face_image_bytes, past, init, on_text)
+    reusable = _reusable(previous, face_image_bytes)
+    missing = [name for name in _NOVA_VARIANTS if name not in reusable]
+    images: Dict[str, asyncio.Future] = {}
+    if SPECULATIVE_FUTURE_IMAGE and face_image_bytes and len(missing) <= SPECULATIVE_MAX_VARIANTS:
+        for name in missing:
+            images[name] = loop.run_in_executor(executor, _generate_future_png, name, face_image_bytes, 0.98)
+
+    try:
+        # 1) 評価（トークンは届いた順に流す）
+        while stream_tokens and not evaluation.done():
+            getter = asyncio.ensure_future(tokens.get())
+            done, _ = await asyncio.wait({getter, evaluation}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield "token", {"text": getter.result()}
+            else:
+                getter.cancel()
+        while not tokens.empty():
+            yield "token", {"text": tokens.get_nowait()}
+        result = await evaluation
+
+        variant = _variant_for_score(int(result.get("score_percent", 50)))
+        for name, fut in images.items():
+            if name != variant:
+                fut.cancel()
+        answer = _format_result(result, None)
+        answer.pop("future_image_url")
+        yield "answer", answer
+
+        # 2) 将来画像（前回と同じ段階・同じ顔なら記録の URL をそのまま使う）
+        future_url, record = reusable.get(variant), None
+        if future_url is not None:
+            _bump_variant("reused")
+        else:
+            try:
+                image = images.get(variant) or loop.run_in_executor(
+                    executor, _generate_future_png, variant, face_image_bytes, 0.98
+                )
+                png = await image
+                future_url = await loop.run_in_executor(executor, _put_to_s3_and_get_url, png)
+                record = _future_record(variant, face_image_bytes, future_url)
+            except Exception as e:
+                logger.warning("future image generation failed: %s", e)
+        yield "future_image", {"future_image_url": future_url}
+        yield "result", {**_format_result(result, future_url), "future_image_record": record}
+    finally:
+        # 途中で打ち切られた（クライアント切断など）場合も先行生成を止める
+        evaluation.cancel()
+        for fut in images.values():
+            fut.cancel()
+
+# フォールバック評価は使い回さない（次の再送で本来の評価を取りに行く）
+_single_flight = SingleFlight(GEN_DEDUP_TTL, GEN_DEDUP_MAX,
+                              cacheable=lambda r: r.get("improvement") != "fallback",
+                              shared=shared_cache.client("gen:"))
+
+def _normalize_past(past: Dict[str, Any]) -> Any:
+    """
+    キー用に過去情報を正規化する。日時・ID・画像URLは落とし、連続する同じ記録は1件にまとめる
+    （二度押しでログが2行入っても同じキーになるように）
+    日次ロールアップ（"days" を持つ形）は既に1日1件なのでそのまま使う
+    """
+    if "days" in past:
+        return past
+    rows = []
+    for v in past.values():  # "0_day_ago" から新しい順
+        if not isinstance(v, dict):
+            rows.append(v)
+            continue
+        row = {k: v.get(k) for k in ("weight_kg", "habits", "sleep_hour")}
+        if not rows or rows[-1] != row:
+            rows.append(row)
+    return rows
+
+def generation_key(meal_image_bytes: bytes, face_image_bytes: bytes | Blob | None,
+                   past: Dict[str, Any], init: Any) -> str:
+    context = json.dumps(
+        {"model": CLAUDE_MODEL_ID, "init": init, "past": _normalize_past(past)},
+        ensure_ascii=False, sort_keys=True, default=json_safe,
+    )
+    face = _face_digest(face_image_bytes) if face_image_bytes else "-"
+    return digest(f"{digest(meal_image_bytes)}:{face}:{digest(context.encode())}".encode())
 
+def generation_stats() -> Dict[str, Any]:
+    return _single_flight.snapshot()
+
+async def generate_answer_async(meal_image_bytes: bytes, face_image_bytes: bytes | Blob,
+                                past: Dict[str, Any], init: Any,
+                                previous: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Any]:
+    """
+    generate_answer の非同期版（イベントループを止めない）。
+    同じ入力（食事画像・顔画像・正規化した past/init）の同時実行は1回にまとめる。
+    previous はキーに含めない（同じ顔・同じ段階の未来像は誰の記録でも同じ画像）
+    """
+    async def run() -> Dict[str, Any]:
+        async with aclosing(generate_answer_events(meal_image_bytes, face_image_bytes, past, init,
+                                                   previous=previous)) as events:
+            async for name, data in events:
+                if name == "result":
+                    return data
+        raise RuntimeError("generation finished without result")
+
+    key = generation_key(meal_image_bytes, face_image_bytes, past, init)
+    # 呼び出し側が結果を書き換えても共有分に影響しないようコピーを返す
+    return dict(await _single_flight.do(key, run))
 
 
 import pathlib
@@ -309,13 +733,19 @@ if __name__ == "__main__":
     res = generate_answer(meal_bytes, face_bytes, past={"example": "data"}, init=[])
     print(json.dumps(res, ensure_ascii=False, indent=2))
     
-    # 生成画像の保存（data URL or S3 URI or base64）
+    # 生成画像の保存（blob パス or data URL or S3 URI or base64）
     url = res.get("future_image_url")
     if not url:
         print("[info] 将来画像は生成されませんでした（スコアが閾値以上か、生成失敗）。")
     else:
         try:
-            if url.startswith("data:image/"):
+            if url.startswith("/images/"):
+                # blob ストア保存済み → パスを表示
+                store = get_blob_store()
+                key = url.rsplit("/", 1)[1]
+                print(f"[saved] future image -> {getattr(store, 'path', lambda k: k)(key)}")
+
+            elif url.startswith("data:image/"):
                 # Data URLの場合 → 直接保存
                 saved = save_data_url_image(url, out_dir="backend/out", basename="future-fat")
                 print(f"[saved] future image -> {saved}")
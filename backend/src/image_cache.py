@@ -0,0 +1,212 @@
+"""
+生成画像キャッシュ（内容アドレス方式）
+
+概要
+- キー: "<顔画像のsha256>/<生成パラメータのsha256>"
+  → 同じ顔・同じプロンプト/seed/モデルなら同じキー。顔単位でまとめて無効化できる
+- バックエンド: LRUCache（プロセス内・サイズ上限）, DiskCache（ローカル）, S3Cache
+- TieredCache: 上位から順に探し、下位でヒットしたら上位へ昇格
+
+注意
+- すべてスレッドセーフ（Bedrock 呼び出しスレッドから直接使う）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Protocol
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(face_digest: str, params: Dict[str, Any]) -> str:
+    """顔画像の sha256 + 生成パラメータ（プロンプト, similarity, seed, モデルID 等）からキーを作る"""
+    param_digest = digest(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return f"{face_digest}/{param_digest}"
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Optional[bytes]: ...
+    def set(self, key: str, value: bytes) -> None: ...
+    def delete_prefix(self, prefix: str) -> int: ...
+
+
+class LRUCache:
+    """サイズ（既定は len）の合計で追い出す LRU"""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len) -> None:
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= self._sizeof(old)
+            self._data[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= self._sizeof(evicted)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is None:
+                return False
+            self._bytes -= self._sizeof(old)
+            return True
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            for k in keys:
+                self._bytes -= self._sizeof(self._data.pop(k))
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+class DiskCache:
+    """<root>/<face_digest>/<param_digest> にファイルとして保存"""
+
+    def __init__(self, root: str) -> None:
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 途中まで書かれたファイルを読まないよう、一時ファイル → rename
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+    def delete_prefix(self, prefix: str) -> int:
+        target = self.root / prefix
+        if target.is_dir():
+            n = sum(1 for _ in target.iterdir())
+            shutil.rmtree(target, ignore_errors=True)
+            return n
+        return 0
+
+
+class S3Cache:
+    def __init__(self, client: Any, bucket: str, prefix: str = "cache/nova/") -> None:
+        self._s3 = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/"
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            obj = self._s3.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self._s3.exceptions.NoSuchKey:
+            return None
+        return obj["Body"].read()
+
+    def set(self, key: str, value: bytes) -> None:
+        self._s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=value, ContentType="image/png")
+
+    def delete_prefix(self, prefix: str) -> int:
+        n = 0
+        paginator = self._s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            objs = [{"Key": o["Key"]} for o in page.get("Contents", [])]
+            if objs:
+                self._s3.delete_objects(Bucket=self.bucket, Delete={"Objects": objs})
+                n += len(objs)
+        return n
+
+
+class TieredCache:
+    def __init__(self, tiers: List[CacheBackend], names: Optional[List[str]] = None) -> None:
+        self.tiers = tiers
+        self.names = names or [type(t).__name__ for t in tiers]
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"misses": 0, **{f"hits_{n}": 0 for n in self.names}}
+
+    def _bump(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key: str) -> Optional[bytes]:
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                logger.warning("cache get failed (%s): %s", self.names[i], e)
+                continue
+            if value is not None:
+                self._bump(f"hits_{self.names[i]}")
+                for j, upper in enumerate(self.tiers[:i]):
+                    try:
+                        upper.set(key, value)
+                    except Exception as e:
+                        logger.warning("cache promote failed (%s): %s", self.names[j], e)
+                return value
+        self._bump("misses")
+        return None
+
+    def set(self, key: str, value: bytes) -> None:
+        for i, tier in enumerate(self.tiers):
+            try:
+                tier.set(key, value)
+            except Exception as e:
+                logger.warning("cache set failed (%s): %s", self.names[i], e)
+
+    def delete_prefix(self, prefix: str) -> int:
+        n = 0
+        for tier in self.tiers:
+            try:
+                n += tier.delete_prefix(prefix)
+            except Exception as e:
+                logger.warning("cache delete failed: %s", e)
+        return n
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        hits = sum(v for k, v in stats.items() if k.startswith("hits_"))
+        total = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / total, 4) if total else 0.0
+        return stats
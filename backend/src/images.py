@@ -0,0 +1,144 @@
+"""
+Bedrock に渡す前の画像前処理（縮小・再エンコード）
+
+概要
+- preprocess_image(data, fmt=None) -> (bytes, media_type)
+  1) 先頭バイトで形式判定 2) EXIF の向きを補正 3) 長辺 IMAGE_MAX_EDGE まで縮小
+  4) IMAGE_FORMAT（JPEG/WEBP）・IMAGE_QUALITY で再エンコード（元の方が小さく無加工ならそのまま）
+- CPU 処理はプロセスプールで実行（IMAGE_WORKERS=0 なら呼び出しスレッドで実行）
+- 結果は入力の sha256 + 設定でキャッシュ。同じ画像の同時処理は1回にまとめる
+
+注意
+- Pillow が無い環境では形式判定のみ行い、画像はそのまま返す
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from blobstore import sniff_media_type
+from image_cache import LRUCache
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1568"))  # Claude の推奨上限（長辺）
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()    # JPEG | WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+logger = logging.getLogger("uvicorn.error")
+
+_PASSTHROUGH = {"image/jpeg", "image/png"}  # どのモデルにもそのまま渡せる形式
+
+Processed = Tuple[bytes, str]
+
+
+def _media_type(data: bytes) -> str:
+    mime = sniff_media_type(data[:16])
+    # 判定できないものは従来どおり JPEG 扱い
+    return mime if mime.startswith("image/") else "image/jpeg"
+
+
+def _transform(data: bytes, max_edge: int, fmt: str, quality: int) -> Processed:
+    """プロセスプール側で実行される本体（pickle できるようにモジュール直下に置く）"""
+    mime = _media_type(data)
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data, mime
+
+    with Image.open(io.BytesIO(data)) as src:
+        orientation = src.getexif().get(0x0112, 1)  # EXIF Orientation
+        im = ImageOps.exif_transpose(src)
+        resized = max(im.size) > max_edge
+        if resized:
+            im.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, format=fmt, quality=quality, optimize=True)
+
+    out = buf.getvalue()
+    untouched = not resized and orientation == 1
+    passthrough = mime in _PASSTHROUGH or mime == f"image/{fmt.lower()}"
+    if untouched and passthrough and len(data) <= len(out):
+        return data, mime
+    return out, f"image/{fmt.lower()}"
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_cache = LRUCache(IMAGE_CACHE_MAX_BYTES, sizeof=lambda v: len(v[0]))
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if IMAGE_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # fork はスレッドを抱えたプロセスでは危険なので spawn
+            _executor = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            # 終了を待つ。serve.py のワーカー（multiprocessing の子）は atexit を通らずに終わるので、
+            # 待たないとプールのプロセスが親を失って残る
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def _submit(data: bytes, fmt: Optional[str]) -> Tuple[str, Future]:
+    """キャッシュ済み/処理中ならそれを、無ければプロセスプールへ投入した Future を返す"""
+    fmt = (fmt or IMAGE_FORMAT).upper()
+    key = f"{hashlib.sha256(data).hexdigest()}:{IMAGE_MAX_EDGE}:{fmt}:{IMAGE_QUALITY}"
+    done = _cache.get(key)
+    if done is not None:
+        fut: Future = Future()
+        fut.set_result(done)
+        return key, fut
+
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            return key, fut
+        executor = _get_executor()
+        if executor is None:
+            fut = Future()
+            try:
+                fut.set_result(_transform(data, IMAGE_MAX_EDGE, fmt, IMAGE_QUALITY))
+            except Exception as e:
+                fut.set_exception(e)
+        else:
+            fut = executor.submit(_transform, data, IMAGE_MAX_EDGE, fmt, IMAGE_QUALITY)
+        _inflight[key] = fut
+
+    def _done(f: Future) -> None:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        if not f.cancelled() and f.exception() is None:
+            _cache.set(key, f.result())
+
+    fut.add_done_callback(_done)
+    return key, fut
+
+
+def preprocess_image(data: bytes, fmt: Optional[str] = None) -> Processed:
+    """同期版（Bedrock 呼び出しスレッドから使う）。失敗時は元画像をそのまま返す"""
+    try:
+        return _submit(data, fmt)[1].result()
+    except Exception as e:
+        logger.warning("image preprocess failed: %s", e)
+        return data, _media_type(data)
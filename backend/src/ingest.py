@@ -0,0 +1,191 @@
+"""
+meal_log の一括投入（ウェアラブル等の過去ログのバックフィル）
+
+概要
+- 入力: NDJSON（1行1レコード）または CSV（1行目がヘッダ）
+- 1行ずつ MealLogRow で検証。不正な行は飛ばして行番号つきで報告（先頭 MAX_ERRORS 件）
+- 検証済みの行を chunk_size 行ずつ executemany + トランザクションで投入（database.py）
+- 投入後に対象ユーザの日次ロールアップを作り直す
+
+使い方
+- ライブラリ: ingest_lines(open("logs.ndjson"), "ndjson", on_progress=print)
+- API: POST /meal-logs/bulk（Content-Type: application/x-ndjson | text/csv）。進捗を NDJSON で逐次返す
+
+注意
+- CSV の引用符内改行には対応しない（1レコード1行）
+- created_at が無い行は投入時刻になる
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel, Field, ValidationError
+
+from database import (
+    BULK_CHUNK_SIZE,
+    bulk_add_meal_logs,
+    insert_meal_log_chunk_async,
+    refresh_daily_summaries_async,
+)
+
+MAX_ERRORS = 20
+FORMATS = {"application/x-ndjson": "ndjson", "application/jsonl": "ndjson", "text/csv": "csv"}
+
+
+class MealLogRow(BaseModel):
+    """一括投入の1レコード"""
+    user_id: str = Field(..., min_length=1, max_length=64, description="ユーザ識別子（必須）")
+    created_at: Optional[datetime] = Field(None, description="記録日時（ISO 8601, 省略時は投入時刻）")
+    weight_kg: Optional[int] = Field(None, ge=0, le=500, description="体重（任意）")
+    habits: Optional[int] = Field(None, ge=0, le=1440, description="運動時間（分、任意）")
+    sleep_hour: Optional[int] = Field(None, ge=0, le=24, description="睡眠時間（時間、任意）")
+    meal_image_url: Optional[str] = Field(None, max_length=1024, description="食事画像のURL（任意）")
+
+
+def detect_format(content_type: Optional[str]) -> Optional[str]:
+    return FORMATS.get((content_type or "").split(";")[0].strip().lower())
+
+
+class RowParser:
+    """1行ずつ受け取って検証済み dict（または None）を返す。不正行は errors に貯める"""
+
+    def __init__(self, fmt: str) -> None:
+        if fmt not in ("ndjson", "csv"):
+            raise ValueError(f"未対応の形式です: {fmt}")
+        self.fmt = fmt
+        self.header: Optional[List[str]] = None
+        self.lineno = 0
+        self.rejected = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def _record(self, line: str) -> Optional[Dict[str, Any]]:
+        if self.fmt == "ndjson":
+            return json.loads(line)
+        values = next(csv.reader([line]))
+        if self.header is None:
+            self.header = [h.strip() for h in values]
+            return None
+        # 空欄は未入力扱い
+        return {k: (v if v != "" else None) for k, v in zip(self.header, values)}
+
+    def feed(self, line: str) -> Optional[Dict[str, Any]]:
+        self.lineno += 1
+        line = line.lstrip("\ufeff").rstrip("\r\n")
+        if not line.strip():
+            return None
+        try:
+            record = self._record(line)
+            if record is None:
+                return None
+            row = MealLogRow.model_validate(record).model_dump()
+        except ValidationError as e:
+            return self._reject("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+        except ValueError as e:  # JSON / CSV の構文エラー
+            return self._reject(str(e))
+        row["created_at"] = row["created_at"] or datetime.now()
+        return row
+
+    def _reject(self, message: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": self.lineno, "error": message})
+        return None
+
+
+def _report(parser: RowParser, inserted: int, chunks: int, t0: float) -> Dict[str, Any]:
+    elapsed = time.perf_counter() - t0
+    return {
+        "inserted": inserted,
+        "rejected": parser.rejected,
+        "errors": parser.errors,
+        "chunks": chunks,
+        "elapsed_sec": round(elapsed, 3),
+        "rows_per_sec": round(inserted / elapsed, 1) if elapsed else None,
+    }
+
+
+def ingest_lines(lines: Iterable[str], fmt: str, *, chunk_size: int = BULK_CHUNK_SIZE,
+                 on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """同期版（スクリプト・バッチ用）。結果のレポートを返す"""
+    parser = RowParser(fmt)
+    chunks = 0
+
+    def rows():
+        for line in lines:
+            row = parser.feed(line)
+            if row is not None:
+                yield row
+
+    def progress(p: Dict[str, Any]) -> None:
+        nonlocal chunks
+        chunks = p["chunk"]
+        if on_progress is not None:
+            on_progress({**p, "rejected": parser.rejected})
+
+    t0 = time.perf_counter()
+    inserted = bulk_add_meal_logs(rows(), chunk_size, on_progress=progress)
+    return _report(parser, inserted, chunks, t0)
+
+
+async def _aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if buf:
+        yield buf.decode("utf-8")
+
+
+async def ingest_stream(chunks: AsyncIterator[bytes], fmt: str, *,
+                        chunk_size: int = BULK_CHUNK_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """
+    非同期版（API 用）。リクエストボディを読みながら投入し、進捗を順に返す。
+      {"chunk", "rows", "total", "rejected", "rows_per_sec"} … チャンクごと
+      {"done": True, ...レポート}                            … 最後
+      {"error": str, ...レポート}                            … DB エラーで中断（確定済みは total 件）
+    """
+    parser = RowParser(fmt)
+    chunk: List[Dict[str, Any]] = []
+    users: set = set()
+    inserted = n = 0
+    t0 = time.perf_counter()
+
+    async def flush() -> Dict[str, Any]:
+        nonlocal inserted, n, chunk
+        inserted += await insert_meal_log_chunk_async(chunk)
+        users.update(r["user_id"] for r in chunk)
+        n += 1
+        elapsed = time.perf_counter() - t0
+        event = {"chunk": n, "rows": len(chunk), "total": inserted, "rejected": parser.rejected,
+                 "rows_per_sec": round(inserted / elapsed, 1) if elapsed else None}
+        chunk = []
+        return event
+
+    try:
+        async for line in _aiter_lines(chunks):
+            row = parser.feed(line)
+            if row is None:
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield await flush()
+        if chunk:
+            yield await flush()
+        await refresh_daily_summaries_async(users)
+    except Exception as e:
+        if users:
+            # 確定済みのチャンク分はロールアップに反映しておく
+            try:
+                await refresh_daily_summaries_async(users)
+            except Exception:
+                pass
+        yield {"error": str(e), **_report(parser, inserted, n, t0)}
+        return
+    yield {"done": True, **_report(parser, inserted, n, t0)}
@@ -0,0 +1,335 @@
+"""
+ジョブキュー（/generate-answer の非同期実行モード）
+
+概要
+- JobManager.submit: ジョブを積んで job_id を即返す（同一ユーザの実行中ジョブがあればそれを返す）
+- ワーカー（asyncio タスク）がキューから優先度順に取り出して handler を実行
+- 結果は GET /jobs/{id} でポーリング、または callback_url へ POST
+- キューが満杯なら QueueFull（API では 429）
+- stop(drain=秒): 新しいジョブは取らず、実行中のジョブは drain 秒まで終わるのを待ってから止める
+
+バックエンド
+- MemoryQueueBackend: プロセス内（既定）
+- RedisQueueBackend: Redis 互換サーバ（JOB_QUEUE=redis, REDIS_URL）。複数プロセスで共有できる
+
+callback_url（SSRF 対策: check_callback_url）
+- http(s) のみ。JOB_CALLBACK_HOSTS（カンマ区切り, *.example.com 可）を設定したらそのホストだけ
+- 名前解決したアドレスがすべて公開アドレスであること（プライベート・ループバック・リンクローカル
+  = インスタンスメタデータなどは拒否。開発用に JOB_CALLBACK_ALLOW_PRIVATE=1 で許可）
+- 受け付け時と POST の直前の2回検査する（その間に DNS を内部アドレスへ向け直されても送らない）。リダイレクトは追わない
+
+注意
+- priority は小さいほど先に実行。同じ優先度は投入順
+- JOB_QUEUE=redis には redis パッケージ（任意依存）が必要。無ければ起動時に make_backend が失敗する
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import socket
+import time
+import urllib.parse
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol, Set
+
+JOB_QUEUE = os.getenv("JOB_QUEUE", "memory")  # memory | redis
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))  # 完了ジョブを保持する秒数
+JOB_GET_RETRY_SEC = float(os.getenv("JOB_GET_RETRY_SEC", "1.0"))  # キューから取れなかったときに待つ秒数
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+JOB_CALLBACK_HOSTS = [h.strip().lower() for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()]
+JOB_CALLBACK_ALLOW_PRIVATE = os.getenv("JOB_CALLBACK_ALLOW_PRIVATE", "0") == "1"
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class QueueFull(RuntimeError):
+    """キューが上限（JOB_QUEUE_MAX）に達している"""
+
+
+class CallbackRejected(ValueError):
+    """callback_url が許可されていない（API では 400）"""
+
+
+def _host_allowed(host: str) -> bool:
+    return any(host == h or (h.startswith("*.") and host.endswith(h[1:])) for h in JOB_CALLBACK_HOSTS)
+
+
+async def check_callback_url(url: str) -> None:
+    """callback_url に POST してよいか検査する（だめなら CallbackRejected）"""
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError as e:
+        raise CallbackRejected(f"callback_url が不正です: {e}") from e
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackRejected("callback_url は http(s) のみ対応しています。")
+    host = parts.hostname.lower()
+    if JOB_CALLBACK_HOSTS and not _host_allowed(host):
+        raise CallbackRejected(f"callback_url のホストは許可されていません: {host}")
+    if JOB_CALLBACK_ALLOW_PRIVATE:
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except OSError as e:
+        raise CallbackRejected(f"callback_url のホストを解決できません: {host}") from e
+    for *_, sockaddr in infos:
+        addr = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        if not addr.is_global or addr.is_multicast:
+            raise CallbackRejected(f"callback_url は内部アドレスを指しています: {host} ({addr})")
+
+
+class QueueBackend(Protocol):
+    async def put(self, job: Dict[str, Any]) -> None: ...
+    async def get(self) -> Dict[str, Any]: ...
+    async def save(self, job: Dict[str, Any]) -> None: ...
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]: ...
+    async def claim_user(self, user_id: str, job_id: str) -> Optional[str]: ...
+    async def release_user(self, user_id: str, job_id: str) -> None: ...
+    async def size(self) -> int: ...
+    async def close(self) -> None: ...
+
+
+class MemoryQueueBackend:
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._users: Dict[str, str] = {}
+
+    async def put(self, job: Dict[str, Any]) -> None:
+        if self._queue.qsize() >= self.maxsize:
+            raise QueueFull("job queue is full")
+        self._jobs[job["id"]] = job
+        self._queue.put_nowait((job["priority"], next(self._seq), job["id"]))
+
+    async def get(self) -> Dict[str, Any]:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+
+    async def save(self, job: Dict[str, Any]) -> None:
+        self._jobs[job["id"]] = job
+        self._expire()
+
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    async def claim_user(self, user_id: str, job_id: str) -> Optional[str]:
+        existing = self._users.get(user_id)
+        if existing is not None:
+            return existing
+        self._users[user_id] = job_id
+        return None
+
+    async def release_user(self, user_id: str, job_id: str) -> None:
+        if self._users.get(user_id) == job_id:
+            del self._users[user_id]
+
+    async def size(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self) -> None:
+        pass
+
+    def _expire(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            finished = job.get("finished_at")
+            if finished and now - finished > JOB_RESULT_TTL:
+                del self._jobs[job_id]
+
+
+class RedisQueueBackend:
+    """
+    キー構成:
+      <ns>:queue          ZSET（score = priority * 1e13 + 投入時刻ms）
+      <ns>:job:<id>       ジョブ本体（JSON, 完了後は JOB_RESULT_TTL で失効）
+      <ns>:user:<user_id> 実行中ジョブID（SET NX で重複排除）
+    """
+
+    def __init__(self, url: str, maxsize: int, namespace: str = "diet:jobs") -> None:
+        import redis.asyncio as redis  # 任意依存（JOB_QUEUE=redis のときだけ必要）
+
+        self._r = redis.from_url(url, decode_responses=True)
+        self.maxsize = maxsize
+        self.ns = namespace
+
+    async def put(self, job: Dict[str, Any]) -> None:
+        if await self._r.zcard(f"{self.ns}:queue") >= self.maxsize:
+            raise QueueFull("job queue is full")
+        await self.save(job)
+        score = job["priority"] * 1e13 + int(job["created_at"] * 1000)
+        await self._r.zadd(f"{self.ns}:queue", {job["id"]: score})
+
+    async def get(self) -> Dict[str, Any]:
+        while True:
+            popped = await self._r.bzpopmin(f"{self.ns}:queue", timeout=5)
+            if not popped:
+                continue
+            job = await self.load(popped[1])
+            if job is not None:
+                return job
+
+    async def save(self, job: Dict[str, Any]) -> None:
+        ttl = JOB_RESULT_TTL if job.get("finished_at") else None
+        await self._r.set(f"{self.ns}:job:{job['id']}", json.dumps(job, ensure_ascii=False), ex=ttl)
+
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._r.get(f"{self.ns}:job:{job_id}")
+        return json.loads(raw) if raw else None
+
+    async def claim_user(self, user_id: str, job_id: str) -> Optional[str]:
+        key = f"{self.ns}:user:{user_id}"
+        # ワーカーが落ちても永久にロックされないよう TTL を付ける
+        if await self._r.set(key, job_id, nx=True, ex=JOB_RESULT_TTL):
+            return None
+        return await self._r.get(key)
+
+    async def release_user(self, user_id: str, job_id: str) -> None:
+        key = f"{self.ns}:user:{user_id}"
+        if await self._r.get(key) == job_id:
+            await self._r.delete(key)
+
+    async def size(self) -> int:
+        return int(await self._r.zcard(f"{self.ns}:queue"))
+
+    async def close(self) -> None:
+        await self._r.aclose()
+
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+Notifier = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+class JobManager:
+    def __init__(self, backend: QueueBackend, handler: Handler, *,
+                 workers: int = JOB_WORKERS, notify: Optional[Notifier] = None) -> None:
+        self.backend = backend
+        self.handler = handler
+        self.notify = notify
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._busy: Set[asyncio.Task] = set()
+        self._closing = False
+
+    async def submit(self, user_id: str, payload: Dict[str, Any], *,
+                     priority: int = 0, callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """ジョブを登録して返す。同じユーザの実行中ジョブがあればそれを返す（新規登録しない）"""
+        job_id = uuid.uuid4().hex
+        existing = await self.backend.claim_user(user_id, job_id)
+        if existing is not None:
+            job = await self.backend.load(existing)
+            if job is not None and job["status"] in ("queued", "running"):
+                return job
+            # 古いロックが残っていただけなら取り直す
+            await self.backend.release_user(user_id, existing)
+            if await self.backend.claim_user(user_id, job_id) is not None:
+                return await self.backend.load(existing) or {"id": existing, "status": "queued"}
+
+        job = {
+            "id": job_id,
+            "user_id": user_id,
+            "status": "queued",
+            "priority": priority,
+            "payload": payload,
+            "callback_url": callback_url,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        try:
+            await self.backend.put(job)
+        except BaseException:
+            await self.backend.release_user(user_id, job_id)
+            raise
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.backend.load(job_id)
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"job-worker-{i}"))
+
+    async def stop(self, drain: float = 0.0) -> None:
+        self._closing = True
+        # キュー待ちのワーカーはすぐ止め、ジョブ実行中のものは drain 秒まで待つ
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        busy = [t for t in self._tasks if t in self._busy]
+        if busy and drain > 0:
+            logger.info("waiting up to %.0fs for %d running job(s)", drain, len(busy))
+            await asyncio.wait(busy, timeout=drain)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.backend.close()
+
+    async def _worker(self) -> None:
+        me = asyncio.current_task()
+        while not self._closing:
+            try:
+                job = await self.backend.get()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Redis の一時的な切断などでワーカーを終わらせない（少し待って取り直す）
+                logger.exception("job queue get failed: %s", e)
+                await asyncio.sleep(JOB_GET_RETRY_SEC)
+                continue
+            self._busy.add(me)
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            try:
+                await self.backend.save(job)
+                job["result"] = await self.handler(job)
+                job["status"] = "done"
+            except asyncio.CancelledError:
+                job["status"], job["error"] = "failed", "cancelled (server shutdown)"
+                raise
+            except Exception as e:
+                logger.exception("job %s failed: %s", job["id"], e)
+                job["status"] = "failed"
+                job["error"] = getattr(e, "detail", None) or str(e)
+            finally:
+                job["finished_at"] = time.time()
+                try:
+                    await self.backend.save(job)
+                except Exception as e:
+                    logger.exception("job %s save failed: %s", job["id"], e)
+                finally:
+                    await self.backend.release_user(job["user_id"], job["id"])
+            if job.get("callback_url") and self.notify is not None:
+                try:
+                    await self.notify(job["callback_url"], public_view(job))
+                except Exception as e:
+                    logger.warning("job %s callback failed: %s", job["id"], e)
+            self._busy.discard(me)
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """API で返す形（入力ペイロードは返さない）"""
+    return {k: job.get(k) for k in ("id", "status", "priority", "result", "error", "created_at", "finished_at")}
+
+
+def make_backend() -> QueueBackend:
+    if JOB_QUEUE == "redis":
+        try:
+            import redis  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("JOB_QUEUE=redis には redis パッケージが必要です（pip install redis）") from e
+        return RedisQueueBackend(REDIS_URL, JOB_QUEUE_MAX)
+    return MemoryQueueBackend(JOB_QUEUE_MAX)
@@ -0,0 +1,246 @@
+"""
+Bedrock 呼び出しの流量制御（モデルIDごと）
+
+概要
+- AIMDLimiter: 同時実行数の上限を成功で少しずつ増やし（+1/limit）、スロットリングで半減
+- RetryBudget: リトライ用トークンバケット。通常リクエストの ratio 分だけ貯まり、リトライで1消費
+  → 障害時にリトライで負荷を何倍にもしない
+- CircuitBreaker: 連続失敗で open（即失敗）→ reset_timeout 後に1件だけ試す half-open
+  失敗に数えるのは混雑（is_overload）と 5xx だけ。入力の問題（ValidationException など）や
+  こちら側の同時実行数の待ちタイムアウトでは open にしない
+- ModelGuard.call(fn, then): 上記をまとめて適用し、full-jitter の指数バックオフで再試行
+  then があれば fn の結果（ストリーム）を読み終えるまでスロットを持ったままにする（読み出し中の失敗は再試行しない）
+
+注意
+- Bedrock 呼び出しはスレッドで実行されるため、すべて同期 API（threading ベース）
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "3"))
+BEDROCK_CONCURRENCY_INITIAL = int(os.getenv("BEDROCK_CONCURRENCY_INITIAL", "4"))
+BEDROCK_CONCURRENCY_MAX = int(os.getenv("BEDROCK_CONCURRENCY_MAX", "32"))
+BEDROCK_ACQUIRE_TIMEOUT = float(os.getenv("BEDROCK_ACQUIRE_TIMEOUT", "30"))
+BEDROCK_RETRY_RATIO = float(os.getenv("BEDROCK_RETRY_RATIO", "0.2"))
+BEDROCK_BREAKER_FAILURES = int(os.getenv("BEDROCK_BREAKER_FAILURES", "5"))
+BEDROCK_BREAKER_RESET_SEC = float(os.getenv("BEDROCK_BREAKER_RESET_SEC", "30"))
+
+
+class BedrockUnavailable(RuntimeError):
+    """流量制御により呼び出さなかった / 再試行を諦めた（呼び出し側はフォールバックする）"""
+
+
+class CircuitOpen(BedrockUnavailable):
+    pass
+
+
+class Overloaded(BedrockUnavailable):
+    pass
+
+
+def is_server_error(e: BaseException) -> bool:
+    """HTTP 5xx の応答（botocore の ClientError は response に HTTPStatusCode を持つ）"""
+    response = getattr(e, "response", None)
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode") if isinstance(response, dict) else None
+    return isinstance(status, int) and status >= 500
+
+
+class AIMDLimiter:
+    def __init__(self, initial: int, *, min_limit: int = 1, max_limit: int = 32, backoff: float = 0.5) -> None:
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.inflight += 1
+            return True
+
+    def release(self, *, overloaded: bool = False) -> None:
+        with self._cond:
+            self.inflight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                # 上限いっぱいまで使っているときだけ増やす（暇なときに膨らませない）
+                if self.inflight + 1 >= int(self.limit):
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_per_sec: float = 1.0, max_tokens: float = 10.0) -> None:
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._last) * self.min_per_sec)
+        self._last = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe = False
+            if self.state == "half_open" and not self._probe:
+                self._probe = True  # 試しに1件だけ通す
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def cancel(self) -> None:
+        """allow された呼び出しを実行しなかった（half-open の試行枠を戻す）"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probe = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class ModelGuard:
+    def __init__(
+        self,
+        name: str,
+        is_overload: Callable[[BaseException], bool],
+        *,
+        max_attempts: int = BEDROCK_MAX_ATTEMPTS,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        acquire_timeout: float = BEDROCK_ACQUIRE_TIMEOUT,
+    ) -> None:
+        self.name = name
+        self.is_overload = is_overload
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.limiter = AIMDLimiter(BEDROCK_CONCURRENCY_INITIAL, max_limit=BEDROCK_CONCURRENCY_MAX)
+        self.budget = RetryBudget(BEDROCK_RETRY_RATIO)
+        self.breaker = CircuitBreaker(BEDROCK_BREAKER_FAILURES, BEDROCK_BREAKER_RESET_SEC)
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "rejected": 0, "failed": 0}
+
+    def call(self, fn: Callable[[], T], then: Optional[Callable[[T], Any]] = None) -> Any:
+        """fn() を呼ぶ。then があれば then(fn()) を返す（then の間もスロットを持つ。再試行は fn までで、then の失敗はそのまま送出）"""
+        self.stats["calls"] += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                self.stats["rejected"] += 1
+                raise CircuitOpen(f"{self.name}: circuit open")
+            if not self.limiter.acquire(self.acquire_timeout):
+                # こちら側の待ちなので Bedrock の障害には数えない
+                self.stats["rejected"] += 1
+                self.breaker.cancel()
+                raise Overloaded(f"{self.name}: concurrency limit {int(self.limiter.limit)} saturated")
+            overloaded = reading = False
+            try:
+                result = fn()
+                if then is not None:
+                    reading = True
+                    result = then(result)
+            except Exception as e:
+                overloaded = self.is_overload(e)
+                if overloaded or is_server_error(e):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()  # 応答は返っている（入力の問題など）
+                if not overloaded or reading:
+                    self.stats["failed"] += 1
+                    raise
+                self.stats["throttled"] += 1
+                if attempt >= self.max_attempts or not self.budget.withdraw():
+                    self.stats["failed"] += 1
+                    raise Overloaded(f"{self.name}: throttled ({e})") from e
+            else:
+                self.breaker.success()
+                return result
+            finally:
+                self.limiter.release(overloaded=overloaded)
+            # full jitter: 0〜min(max_delay, base * 2^n)
+            self.stats["retries"] += 1
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "limit": round(self.limiter.limit, 2),
+            "inflight": self.limiter.inflight,
+            "breaker": self.breaker.state,
+        }
+
+
+_guards: Dict[str, ModelGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def guard_for(model_id: str, is_overload: Callable[[BaseException], bool]) -> ModelGuard:
+    with _guards_lock:
+        guard = _guards.get(model_id)
+        if guard is None:
+            guard = _guards[model_id] = ModelGuard(model_id, is_overload)
+        return guard
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    with _guards_lock:
+        return {name: g.snapshot() for name, g in _guards.items()}
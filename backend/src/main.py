@@ -1,21 +1,105 @@
 # backend/src/main.py
 from __future__ import annotations
 
+import asyncio
 import importlib
+import json
 import logging
+import os
 import pathlib
 import sys
-from typing import Any, Dict, List, Optional, Union, Callable
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
 import base64
 import urllib.parse
-import httpx
-from database import save_init_list, fetch_info, save_past_info, save_generated_answer
-from generater import generate_answer
-
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager
+import startup
+startup.load_env()  # 各モジュールは import 時に os.getenv するので最初に読む
+from blobstore import Blob, S3BlobStore, get_blob_store, is_key, sniff_media_type
+from database import (
+    bootstrap, close_pool, count_statements, get_profile_cache, ping_async,
+    save_init_list_async, fetch_init_info_async, fetch_past_summary_async, save_past_info_async,
+    save_generated_answer_async, start_write_behind, close_write_behind, write_behind_stats,
+    fetch_future_images_async, save_future_image_when_stored,
+)
+import images
+import ingest
+import limiter
+import metrics
+from jobs import CallbackRejected, JobManager, QueueFull, check_callback_url, make_backend, public_view
+from pipeline import StagePipeline
+from generater import (
+    generate_answer_async, generate_answer_events, generation_stats, image_cache_stats, invalidate_future_images,
+    drain, future_image_stored, presign_s3_url, upload_stats, warm_up,
+)
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
+if TYPE_CHECKING:
+    import httpx
+
+# 終了時に実行中のジョブ・Bedrock 呼び出しを待つ秒数（serve.py の --graceful-timeout の後に効く）
+SHUTDOWN_DRAIN_SEC = float(os.getenv("SHUTDOWN_DRAIN_SEC", "30"))
+
+# -------- 画像取得用 HTTP クライアント（アプリ共通・初回利用時に生成） --------
+# httpx は import だけで 100ms 近くかかるので、起動処理のバックグラウンドか初回利用時に読み込む
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "8"))  # 遅い画像ホストがソケットを食い潰さないように
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+HTTP_HOSTS_MAX = int(os.getenv("HTTP_HOSTS_MAX", "1024"))  # ホストごとの同時接続数を覚えておくホスト数
+
+_http_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: "OrderedDict[str, asyncio.Semaphore]" = OrderedDict()
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (httpx[http2]。requirement.txt に含む)
+        return True
+    except ImportError:
+        logging.getLogger("uvicorn.error").warning(
+            "HTTP2=1 but the h2 package is not installed, falling back to HTTP/1.1 (pip install h2)")
+        return False
+
+def open_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            follow_redirects=True,
+            http2=HTTP2 and _http2_available(),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    _host_semaphores.clear()
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    sem = _host_semaphores.get(host)
+    if sem is None:
+        sem = _host_semaphores[host] = asyncio.Semaphore(HTTP_PER_HOST_LIMIT)
+        if len(_host_semaphores) > HTTP_HOSTS_MAX:
+            # 最も長く使われていないホストを忘れる（取得中の分はその Semaphore のまま解放される）
+            _host_semaphores.popitem(last=False)
+    else:
+        _host_semaphores.move_to_end(host)
+    return sem
+
 async def url_to_bytes(
     url: str,
     *,
@@ -27,6 +111,7 @@ async def url_to_bytes(
     画像URL(https://...) または data URL(data:image/png;base64,...) を bytes に変換。
     - require_image=True のとき Content-Type が image/* でないと 400 を返す
     - max_bytes を超えたら 413 を返す
+    - http(s) は共通クライアント（keep-alive / HTTP/2）で取得し、ホストごとに同時接続数を制限
     """
     if not url:
         raise HTTPException(status_code=400, detail="URL が空です。")
@@ -48,9 +133,12 @@ async def url_to_bytes(
         return content
 
     # 通常の http(s) URL
+    import httpx
+
+    client = open_http_client()
     try:
-        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-            async with client.stream("GET", url) as resp:
+        async with _host_semaphore(url):
+            async with client.stream("GET", url, timeout=timeout) as resp:
                 try:
                     resp.raise_for_status()
                 except httpx.HTTPStatusError as e:
@@ -76,13 +164,40 @@ _THIS_DIR = pathlib.Path(__file__).resolve().parent
 if str(_THIS_DIR) not in sys.path:
     sys.path.append(str(_THIS_DIR))
 
-# -------- ヘルパ：遅延で関数読込（存在しなければ None かエラー） --------
-async def bytes_to_url(data: bytes, filename: str) -> str:
-    """バイト列を一時的に base64 URL 化して返す（本来は外部ストレージに保存する想定）"""
-    # 簡易的に data: URL 化（小さい画像のみ対応）
-    mime_type = "image/png"  # 適宜変更可
-    b64_data = base64.b64encode(data).decode("utf-8")
-    return f"data:{mime_type};base64,{b64_data}"
+# -------- ヘルパ：画像の公開URL --------
+# 画像は data URL で埋め込まず /images/{key}（または S3 署名付きURL）で返す
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")  # 例: https://api.example.com（未設定ならリクエストのホスト）
+IMAGE_URL_TTL = int(os.getenv("IMAGE_URL_TTL", "3600"))  # 署名付きURLの有効秒数
+_IMMUTABLE = "public, max-age=31536000, immutable"  # キーが内容のハッシュなので中身は変わらない
+
+def base_url(request: Request) -> str:
+    return PUBLIC_BASE_URL or str(request.base_url)
+
+def public_image_url(ref: Optional[str], base: str) -> Optional[str]:
+    """保存用の参照（/images/... or s3://...）をブラウザから取得できるURLにする"""
+    if not ref:
+        return ref
+    if ref.startswith("/"):
+        return base.rstrip("/") + ref
+    if ref.startswith("s3://"):
+        return presign_s3_url(ref, IMAGE_URL_TTL)
+    return ref
+
+def store_blob(data: bytes) -> Optional[Blob]:
+    """blob ストアに置いて保存済みの Blob を返す（スレッドで呼ぶ。初回は blob ストアの生成も含む）"""
+    if not data:
+        return None
+    store = get_blob_store()
+    return Blob(store.put(data), store, data)
+
+async def blob_image_url(blob: Optional[Blob], base: str) -> Optional[str]:
+    if blob is None:
+        return None
+    key = blob.key
+    if not blob.stored:
+        # 旧データ（DBに画像本体が入っている行）は配信用に blob ストアへ移す
+        key = await asyncio.to_thread(get_blob_store().put, blob.read())
+    return public_image_url(f"/images/{key}", base)
 
 
 # =========================
@@ -123,14 +238,213 @@ class AnswerResponse(BaseModel):
     current_image_url: Optional[str] = Field(None, description="現在の画像のURL（任意）")
 
 
+class JobResponse(BaseModel):
+    """ジョブモードの受付結果 / 状態"""
+    id: str
+    status: str = Field(..., description="queued | running | done | failed")
+    priority: int = 0
+    result: Optional[AnswerResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+
+# =========================
+#  /generate-answer の処理本体
+# =========================
+def input_stages(req: AnswerRequest) -> StagePipeline:
+    # 依存のない処理は同時に走らせる（critical path = max(履歴, プロフィール, 食事画像) + 生成）
+    #   log（並行して保存。既定は後回し書き込みに積むだけ）
+    #   history ────────┐
+    #   profile ────────┤
+    #   future_images ──┼─▶ generate ─▶ save_answer
+    #   meal_image ─────┘
+    pipeline = StagePipeline()
+    # (a) データ保存 / 過去情報（日次ロールアップ。今回の記録は書き込みを待たずに今日の分として重ねる）
+    pipeline.add("log", lambda: save_past_info_async(
+        user_id=req.name,
+        weight_kg=req.weight,
+        habits=req.exercise_time,
+        sleep_hour=req.sleep_time,
+        meal_image_url=req.picture
+    ))
+    pipeline.add("history", lambda: fetch_past_summary_async(req.name, pending={
+        "weight_kg": req.weight,
+        "habits": req.exercise_time,
+        "sleep_hour": req.sleep_time,
+    }))
+    pipeline.add("profile", lambda: fetch_init_info_async(req.name))
+    # 前回の未来像（同じ顔・同じ段階なら Nova Canvas を呼ばずに使い回す）
+    pipeline.add("future_images", lambda: fetch_future_images_async(req.name))
+    # (b) 画像URL→バイト列（必須の食事画像）
+    pipeline.add("meal_image", lambda: url_to_bytes(req.picture, require_image=True))
+    return pipeline
+
+def prepare_context(req: AnswerRequest, init: Dict[str, Any], past: Dict[str, Any]):
+    # プロフィール画像（Blob: 生成で必要になるまで本体は読まない）
+    face_photo = init.get("individual_photo_url")
+
+    # init から画像URLは削除（generate には渡さない想定。past のロールアップは画像を持たない）
+    init.pop("individual_photo_url", None)
+
+    # init に直近の値を注入（すべて文字列）
+    if req.weight is not None:
+        init["weight_kg"] = req.weight
+    if req.exercise_time is not None:
+        init["exercise_time"] = req.exercise_time
+    if req.sleep_time is not None:
+        init["sleep_hour"] = req.sleep_time
+    return face_photo
+
+def normalize_result(req: AnswerRequest, raw_result: Any) -> Dict[str, Any]:
+    # dict 以外でも壊れないように整形
+    if isinstance(raw_result, dict):
+        result = dict(raw_result)  # コピー
+    else:
+        result = {"answer": raw_result}
+    result['user_id'] = req.name
+    return result
+
+async def save_result(req: AnswerRequest, result: Dict[str, Any]) -> None:
+    """生成結果と、新しく作った未来像の記録（次回の使い回し用。S3 への保存が終わってから書く）を保存"""
+    record = result.get("future_image_record")
+    if record:
+        save_future_image_when_stored(req.name, record, future_image_stored(record["future_image_url"]))
+    await save_generated_answer_async(result)
+
+async def answer_pipeline(req: AnswerRequest, base: str) -> Tuple[AnswerResponse, StagePipeline]:
+    """/generate-answer の本体（ジョブ実行でも同じものを使う）"""
+    async def generate(init: Dict[str, Any], past: Dict[str, Any], meal_bytes: bytes, previous: Dict[str, Any]):
+        face_photo = prepare_context(req, init, past)
+        raw_result = await generate_answer_async(meal_bytes, face_photo, past, init, previous=previous)
+        return normalize_result(req, raw_result), face_photo
+
+    async def save_answer(generated):
+        result, _ = generated
+        await save_result(req, result)
+
+    pipeline = input_stages(req)
+    # (c) 回答生成（必須） → (d) 生成結果を保存
+    pipeline.add("generate", generate, after=("profile", "history", "meal_image", "future_images"))
+    pipeline.add("save_answer", save_answer, after=("generate",))
+
+    stages = await pipeline.run()
+    result, face_photo = stages["generate"]
+
+    # (e) 返却（score_percent は str、answer は必須）
+    answer = AnswerResponse(
+        ok=True,
+        answer=result.get("answer"),
+        score_percent=result.get("score_percent"),   # ← str を想定（数値でもPydanticがstr変換）
+        improvement=result.get("improvement") or result.get("improvement "),
+        future_image_url=public_image_url(result.get("future_image_url"), base),
+        current_image_url=await blob_image_url(face_photo, base),
+    )
+    return answer, pipeline
+
+
+async def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """ジョブワーカーから呼ばれる（/generate-answer と同じ処理）"""
+    payload = job["payload"]
+    answer, _ = await answer_pipeline(AnswerRequest(**payload["request"]), payload["base_url"])
+    return answer.model_dump()
+
+async def notify_job(callback_url: str, body: Dict[str, Any]) -> None:
+    # 受け付け後に DNS が内部アドレスへ向け直されていないか、送る直前にもう一度確かめる（リダイレクトも追わない）
+    await check_callback_url(callback_url)
+    resp = await open_http_client().post(callback_url, json=body, timeout=10.0, follow_redirects=False)
+    resp.raise_for_status()
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    リクエストボディを読みながら返すストリーム用（/meal-logs/bulk）。
+    StreamingResponse は切断監視のために receive() を呼び、ボディの読み出しと取り合いになるので使わない
+    """
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
 # =========================
 #  FastAPI 初期化
 # =========================
+def warm_up_clients() -> None:
+    warm_up()
+    importlib.import_module("httpx")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時の重い処理はバックグラウンドで（ポートはすぐ開き、終わるまで /ready が 503）
+    #   schema : スキーマ作成/移行を一度だけ（各DBヘルパはDDLを発行しない）。DB 不達なら再試行
+    #   clients: Bedrock / S3 クライアントと未来像キャッシュ、画像取得用の httpx
+    #   write_behind: ログ・生成結果の後回し書き込み（前回書き切れなかった追記ログの回収）
+    app.state.startup = boot = startup.Startup()
+    boot.add("schema", bootstrap)
+    boot.add("clients", warm_up_clients)
+    boot.add("write_behind", start_write_behind)
+    boot.add_check("database", ping_async)
+    boot.start()
+    app.state.jobs = JobManager(make_backend(), run_job, notify=notify_job)
+    app.state.jobs.start()
+    yield
+    # 終了時: uvicorn は新規接続を止め、処理中のリクエストを待ってからここに来る
+    #         残っているジョブと Bedrock 呼び出し（先行生成など）、S3 へのアップロードも SHUTDOWN_DRAIN_SEC まで待つ
+    #         後回し書き込みの残りはその後に書く（書けなかった分は追記ログから次の起動で回収）
+    deadline = asyncio.get_running_loop().time() + SHUTDOWN_DRAIN_SEC
+    await boot.stop()
+    await app.state.jobs.stop(drain=SHUTDOWN_DRAIN_SEC)
+    if not await asyncio.to_thread(drain, max(0.0, deadline - asyncio.get_running_loop().time())):
+        logging.getLogger("uvicorn.error").warning("bedrock calls or s3 uploads still running after %.0fs; exiting", SHUTDOWN_DRAIN_SEC)
+    if not await asyncio.to_thread(close_write_behind, max(0.0, deadline - asyncio.get_running_loop().time())):
+        logging.getLogger("uvicorn.error").warning("write-behind queue not flushed; left in spill log for next start")
+    # HTTP クライアントと DB コネクションプールを閉じる
+    await close_http_client()
+    close_pool()
+    images.shutdown()
+    metrics.shutdown()
+
+
+def register_metrics() -> None:
+    """既存の snapshot（キャッシュ・single-flight・Bedrock limiter・後回し書き込み）をスクレイプ時に読む指標"""
+    metrics.collect("diet_cache_hit_ratio", "キャッシュのヒット率（起動からの累計）", "gauge", lambda: [
+        ({"cache": "future_image"}, image_cache_stats().get("hit_ratio")),
+        ({"cache": "generation"}, generation_stats().get("saved_ratio")),
+        ({"cache": "profile"}, get_profile_cache().snapshot().get("hit_ratio")),
+    ])
+    metrics.collect("diet_generation_inflight", "実行中の生成（同じ入力はまとめて1件）", "gauge", lambda: [
+        ({}, generation_stats().get("inflight")),
+    ])
+    metrics.collect("diet_bedrock_concurrency_limit", "Bedrock の同時実行数の上限（AIMD で変動）", "gauge", lambda: [
+        ({"model": model}, s["limit"]) for model, s in limiter.snapshot().items()
+    ])
+    metrics.collect("diet_bedrock_inflight", "実行中の Bedrock 呼び出し", "gauge", lambda: [
+        ({"model": model}, s["inflight"]) for model, s in limiter.snapshot().items()
+    ])
+    metrics.collect("diet_bedrock_circuit_open", "サーキットブレーカーが閉じていなければ 1（open / half_open）", "gauge", lambda: [
+        ({"model": model}, int(s["breaker"] != "closed")) for model, s in limiter.snapshot().items()
+    ])
+    metrics.collect("diet_bedrock_guard_events_total", "Bedrock 呼び出しの件数（calls）と再試行・混雑・拒否・失敗", "counter", lambda: [
+        ({"model": model, "event": k}, s[k])
+        for model, s in limiter.snapshot().items()
+        for k in ("calls", "retries", "throttled", "rejected", "failed")
+    ])
+    metrics.collect("diet_write_behind_pending", "後回し書き込みで未書き込みの件数", "gauge", lambda: [
+        ({"queue": name}, s["pending"]) for name, s in write_behind_stats().items()
+    ])
+    metrics.collect("diet_write_behind_events_total", "後回し書き込みの受付・書き込み件数とバッチ数・失敗数", "counter", lambda: [
+        ({"queue": name, "event": k}, s[k])
+        for name, s in write_behind_stats().items()
+        for k in ("added", "written", "batches", "failures")
+    ])
+
+
 def init_main() -> FastAPI:
     app = FastAPI(
         title="Backend API",
         version="0.1.0",
         description="(1) initリスト保存 (2) 画像→過去参照→回答生成→保存→返却",
+        lifespan=lifespan,
     )
 
     # CORS（必要に応じて絞る）
@@ -143,23 +457,76 @@ def init_main() -> FastAPI:
     )
 
     logger = logging.getLogger("uvicorn.error")
+    register_metrics()
+
+    @app.middleware("http")
+    async def http_metrics(request: Request, call_next):
+        # ルートはテンプレート（/images/{key} など）で集計する（パスそのままだと種類が増え続ける）
+        t0 = asyncio.get_running_loop().time()
+        status = 500
+        try:
+            with metrics.INFLIGHT.track(stage="http"):
+                response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            metrics.HTTP_SECONDS.observe(asyncio.get_running_loop().time() - t0,
+                                         route=route, method=request.method, status=status)
+
+    @app.middleware("http")
+    async def db_statement_counter(request: Request, call_next):
+        # リクエスト中に発行した SQL 文数をヘッダで返す（計測用）
+        with count_statements() as counter:
+            response = await call_next(request)
+        response.headers["X-DB-Statements"] = str(counter[0])
+        return response
 
     @app.get("/health", tags=["meta"])
     def health() -> dict:
+        # 生存確認のみ（依存先は見ない）。振り分けの判断は /ready で
         return {"status": "ok"}
 
+    @app.get("/ready", tags=["meta"])
+    async def ready(request: Request) -> Response:
+        ok, detail = await request.app.state.startup.ready()
+        return JSONResponse(detail, status_code=200 if ok else 503)
+
+    @app.get("/metrics", tags=["meta"])
+    def prometheus_metrics() -> Response:
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.get("/cache/stats", tags=["meta"])
+    def cache_stats() -> dict:
+        return {
+            "future_image": image_cache_stats(),
+            "generation": generation_stats(),
+            "profile": get_profile_cache().snapshot(),
+            "bedrock": limiter.snapshot(),
+            "write_behind": write_behind_stats(),
+            "s3_upload": upload_stats(),
+        }
+
     # ========= 役割 (1) init リスト保存 =========
     # DB関数は他で作る前提：存在すれば呼ぶ／無ければノーオペでOK
     @app.post("/init", response_model=InitResponse, tags=["init"])
     async def store_init_list(req: InitRequest) -> InitResponse:
         try:
             photo_bytes = await url_to_bytes(req.picture)
-            save_init_list(
+            # 先に blob ストアへ置く（キー = 内容の sha256）。旧画像とはキーどうしで比べる
+            photo, init = await asyncio.gather(
+                asyncio.to_thread(store_blob, photo_bytes), fetch_init_info_async(req.name)
+            )
+            # プロフィール画像が差し替わる場合は旧画像の未来像キャッシュを捨てる（S3・ディスク・共有キャッシュを触るのでスレッドで）
+            old_photo = init.get("individual_photo_url")
+            if old_photo and photo and old_photo.key != photo.key:
+                await asyncio.to_thread(invalidate_future_images, old_photo)
+            await save_init_list_async(
                 user_id=req.name,
                 height=req.height,
                 gender=req.gender,
                 years=req.age,
-                individual_photo_url=photo_bytes
+                individual_photo_url=photo
             )
             # 関数が無い場合は何もしないで成功扱い
             return InitResponse(ok=True, stored_count=1)
@@ -167,68 +534,32 @@ def init_main() -> FastAPI:
             logger.exception("failed to save init list: %s", e)
             raise HTTPException(status_code=500, detail=f"failed to save init list: {e}") from e
 
+    # ========= ログの一括投入（バックフィル） =========
+    @app.post("/meal-logs/bulk", tags=["ingest"])
+    async def bulk_meal_logs(request: Request, chunk_size: int = ingest.BULK_CHUNK_SIZE) -> BodyStreamingResponse:
+        """
+        NDJSON（application/x-ndjson）または CSV（text/csv, 1行目ヘッダ）でログを一括投入。
+        ボディを読みながら chunk_size 行ずつ投入し、進捗を NDJSON で逐次返す（最後の行が done / error）。
+        """
+        fmt = ingest.detect_format(request.headers.get("content-type"))
+        if fmt is None:
+            raise HTTPException(status_code=415, detail="Content-Type は application/x-ndjson か text/csv にしてください。")
+        if not 1 <= chunk_size <= 10000:
+            raise HTTPException(status_code=400, detail="chunk_size は 1〜10000 で指定してください。")
+
+        async def progress():
+            async for event in ingest.ingest_stream(request.stream(), fmt, chunk_size=chunk_size):
+                yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+        return BodyStreamingResponse(progress(), media_type="application/x-ndjson")
 
     # ========= 役割 (2) 画像URL→過去取得→回答生成→保存→返却 =========
     @app.post("/generate-answer", response_model=AnswerResponse, tags=["generate"])
-    async def generate_from_images(req: AnswerRequest) -> AnswerResponse:
+    async def generate_from_images(req: AnswerRequest, request: Request, response: Response) -> AnswerResponse:
         try:
-            #データ保存
-            save_past_info(
-                user_id=req.name,
-                weight_kg=req.weight,
-                habits=req.exercise_time,
-                sleep_hour=req.sleep_time,
-                meal_image_url=req.picture
-            )
-
-            # (a) 過去情報（必要なら取得）
-            init: Dict[str, Any] = {}
-            past: Dict[str, Any] = {}
-
-            init, past = fetch_info(user_id=req.name)
-
-            # (b) 画像URL→バイト列（必須の食事画像 / 顔はあれば）
-            meal_bytes = await url_to_bytes(req.picture, require_image=True)
-
-            # 仮設定：face_bytesに食事と同じ画像を入れている
-            face_bytes = init.get("individual_photo_url")
-
-            # init/past から画像URLは削除（generate には渡さない想定）
-            init.pop("individual_photo_url", None)
-            for v in past.values():
-                if isinstance(v, dict):
-                    v.pop("meal_image_url", None)
-
-            # init に直近の値を注入（すべて文字列）
-            if req.weight is not None:
-                init["weight_kg"] = req.weight
-            if req.exercise_time is not None:
-                init["exercise_time"] = req.exercise_time
-            if req.sleep_time is not None:
-                init["sleep_hour"] = req.sleep_time
-
-            # (c) 回答生成（必須）
-            raw_result = generate_answer(meal_bytes, face_bytes, past, init)
-
-            # dict 以外でも壊れないように整形
-            if isinstance(raw_result, dict):
-                result = dict(raw_result)  # コピー
-            else:
-                result = {"answer": raw_result}
-
-            result['user_id'] = req.name
-            # (d) 生成結果を保存（存在すれば）
-            save_generated_answer(result)
-
-            # (e) 返却（score_percent は str、answer は必須）
-            return AnswerResponse(
-                ok=True,
-                answer=result.get("answer"),
-                score_percent=result.get("score_percent"),   # ← str を想定（数値でもPydanticがstr変換）
-                improvement=result.get("improvement") or result.get("improvement "),
-                future_image_url=result.get("future_image_url"),
-                current_image_url= await bytes_to_url(face_bytes, "meal.png"),
-            )
+            answer, pipeline = await answer_pipeline(req, base_url(request))
+            response.headers["Server-Timing"] = pipeline.server_timing()
+            return answer
 
         except HTTPException:
             raise
@@ -238,6 +569,103 @@ def init_main() -> FastAPI:
             logger.exception("generate_from_images failed: %s", e)
             raise HTTPException(status_code=500, detail=f"failed to generate answer: {e}") from e
 
+    # ========= 役割 (2') ストリーミング版（SSE） =========
+    # 評価（answer/score_percent/improvement）は Claude が返った時点で、未来像は Nova Canvas の完了時に送る。
+    # イベント: current_image → token*（stream_tokens=true のとき） → answer → future_image → done（失敗時は error）
+    @app.post("/generate-answer/stream", tags=["generate"])
+    async def generate_from_images_stream(req: AnswerRequest, request: Request, stream_tokens: bool = False):
+        pipeline = input_stages(req)
+        try:
+            stages = await pipeline.run()
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception("generate_from_images_stream failed: %s", e)
+            raise HTTPException(status_code=500, detail=f"failed to generate answer: {e}") from e
+        init, past = stages["profile"], stages["history"]
+        face_photo = prepare_context(req, init, past)
+        base = base_url(request)
+
+        def sse(event: str, data: Any) -> str:
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events():
+            try:
+                yield sse("current_image", {"current_image_url": await blob_image_url(face_photo, base)})
+                async with aclosing(generate_answer_events(
+                    stages["meal_image"], face_photo, past, init, stream_tokens=stream_tokens,
+                    previous=stages["future_images"],
+                )) as gen:
+                    async for name, data in gen:
+                        if name == "result":
+                            await save_result(req, normalize_result(req, data))
+                            continue
+                        if name == "future_image":
+                            data = {"future_image_url": public_image_url(data["future_image_url"], base)}
+                        yield sse(name, data)
+                yield sse("done", {"ok": True})
+            except Exception as e:
+                logger.exception("generate_from_images_stream failed: %s", e)
+                yield sse("error", {"ok": False, "detail": f"failed to generate answer: {e}"})
+
+        headers = {"Server-Timing": pipeline.server_timing(), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+    # ========= 役割 (2'') ジョブモード（即時に job_id を返し、結果はポーリング/コールバック） =========
+    @app.post("/jobs/generate-answer", response_model=JobResponse, status_code=202, tags=["jobs"])
+    async def submit_generate_job(
+        req: AnswerRequest,
+        request: Request,
+        priority: int = 0,
+        callback_url: Optional[str] = None,
+    ) -> JobResponse:
+        if callback_url:
+            try:
+                await check_callback_url(callback_url)
+            except CallbackRejected as e:
+                raise HTTPException(status_code=400, detail=str(e)) from e
+        payload = {"request": req.model_dump(), "base_url": base_url(request)}
+        try:
+            job = await request.app.state.jobs.submit(
+                req.name, payload, priority=priority, callback_url=callback_url
+            )
+        except QueueFull:
+            raise HTTPException(status_code=429, detail="混み合っています。時間をおいて再度お試しください。",
+                                headers={"Retry-After": "5"})
+        return JobResponse(**public_view(job))
+
+    @app.get("/jobs/{job_id}", response_model=JobResponse, tags=["jobs"])
+    async def get_job(job_id: str, request: Request) -> JobResponse:
+        job = await request.app.state.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="job not found")
+        return JobResponse(**public_view(job))
+
+    # ========= 画像配信（/generate-answer の URL の参照先） =========
+    @app.get("/images/{key}", tags=["images"])
+    async def get_image(key: str, request: Request) -> Response:
+        if not is_key(key):
+            raise HTTPException(status_code=404, detail="image not found")
+        etag = f'"{key}"'
+        if_none_match = request.headers.get("if-none-match", "")
+        if any(tag.strip() in (etag, "*") for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": _IMMUTABLE})
+
+        store = get_blob_store()
+        if isinstance(store, S3BlobStore):
+            # S3 から直接取得させる（リダイレクト自体は署名の有効期限内だけキャッシュ可）
+            url = store.presigned_url(key, IMAGE_URL_TTL)
+            return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={IMAGE_URL_TTL // 2}"})
+
+        path = store.path(key)
+        try:
+            with open(path, "rb") as f:
+                head = f.read(16)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="image not found")
+        # FileResponse が Range / Last-Modified / Content-Length を処理する
+        return FileResponse(path, media_type=sniff_media_type(head), headers={"ETag": etag, "Cache-Control": _IMMUTABLE})
+
     return app
 
 
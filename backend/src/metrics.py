@@ -0,0 +1,285 @@
+"""
+計測（Prometheus 形式のメトリクス + 任意で OpenTelemetry の span）
+
+概要
+- counter / gauge / histogram: ラベルつきの指標を作る（同名で呼べば同じものを返す）
+- collect(name, help, type, fn): スクレイプ時に fn() の値を読む指標（キャッシュや limiter の snapshot 用）
+- measure(stage, **attrs): with 句の所要時間を diet_stage_seconds{stage=...} に記録し、
+  OTel が有効なら同じ名前の span も作る（attrs は span の属性にだけ付ける）
+- render(): /metrics で返すテキスト（Prometheus text format 0.0.4）
+
+OpenTelemetry（任意）
+- OTEL_EXPORTER_OTLP_ENDPOINT を設定し、opentelemetry-sdk と opentelemetry-exporter-otlp-proto-http が
+  入っているときだけ span を送る（例: http://127.0.0.1:4318）。入っていなければ警告を出して無効
+- サービス名は OTEL_SERVICE_NAME（既定 diet-backend）
+
+注意
+- ラベルの値はユーザIDなど種類が増え続けるものにしない（メモリと Prometheus 側の負荷が増える）
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+OTEL_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "diet-backend")
+
+logger = logging.getLogger("uvicorn.error")
+
+# 秒。Nova Canvas（数秒〜数十秒）まで入るように上を広めに取る
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _label_str(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Labels:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: ラベルは {self.labels} を指定してください（{tuple(labels)}）")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_label_str(self.labels, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: Any) -> Iterator[None]:
+        """with 句の間だけ +1（実行中の数）"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, List[float]] = {}  # バケットごとの件数 + [sum, count]
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        out = []
+        for key, row in items:
+            cumulative = 0.0
+            for upper, n in zip(self.buckets + (math.inf,), row[:-2] + [row[-1] - sum(row[:-2])]):
+                cumulative += n
+                le = 'le="' + _num(upper) + '"'
+                out.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {_num(cumulative)}")
+            out.append(f"{self.name}_sum{_label_str(self.labels, key)} {_num(row[-2])}")
+            out.append(f"{self.name}_count{_label_str(self.labels, key)} {_num(row[-1])}")
+        return out
+
+
+class _Collected(_Metric):
+    def __init__(self, name: str, help: str, type: str, fn: Callable[[], Iterable[Tuple[Dict[str, Any], float]]]) -> None:
+        super().__init__(name, help)
+        self.type = type
+        self.fn = fn
+
+    def lines(self) -> List[str]:
+        out = []
+        try:
+            samples = list(self.fn())
+        except Exception as e:
+            logger.warning("metrics collector %s failed: %s", self.name, e)
+            return out
+        for labels, value in samples:
+            if value is None:
+                continue
+            out.append(f"{self.name}{_label_str(tuple(labels), tuple(labels.values()))} {_num(value)}")
+        return out
+
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric: _Metric) -> Any:
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def collect(name: str, help: str, type: str, fn: Callable[[], Iterable[Tuple[Dict[str, Any], float]]]) -> None:
+    _register(_Collected(name, help, type, fn))
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines: List[str] = []
+    for metric in metrics:
+        samples = metric.lines()
+        if samples:
+            lines += metric.header() + samples
+    return "\n".join(lines) + "\n"
+
+
+# =============================
+# 共通の指標
+# =============================
+STAGE_SECONDS = histogram("diet_stage_seconds", "処理ステージごとの所要時間（秒）", ["stage", "outcome"])
+INFLIGHT = gauge("diet_inflight", "実行中の処理数", ["stage"])
+HTTP_SECONDS = histogram("diet_http_request_seconds", "HTTP リクエストの所要時間（レスポンスヘッダまで）",
+                         ["route", "method", "status"])
+BEDROCK_TOKENS = counter("diet_bedrock_tokens_total", "Bedrock の usage に載るトークン数", ["model", "kind"])
+BEDROCK_BYTES = counter("diet_bedrock_bytes_total", "Bedrock との送受信バイト数（本文）", ["model", "direction"])
+DB_STATEMENTS = counter("diet_db_statements_total", "発行した SQL 文数")
+
+
+# =============================
+# OpenTelemetry（任意）
+# =============================
+_tracer: Any = None
+_tracer_ready = False
+_tracer_lock = threading.Lock()
+
+
+def _get_tracer() -> Any:
+    global _tracer, _tracer_ready
+    if _tracer_ready:
+        return _tracer
+    with _tracer_lock:
+        if _tracer_ready:
+            return _tracer
+        if OTEL_ENDPOINT:
+            try:
+                from opentelemetry import trace
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+                provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+                # エンドポイントは OTEL_EXPORTER_OTLP_ENDPOINT から exporter 自身が読む
+                provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                trace.set_tracer_provider(provider)
+                _tracer = trace.get_tracer("diet-backend")
+            except ImportError as e:
+                logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry is not installed: %s", e)
+        _tracer_ready = True
+    return _tracer
+
+
+def shutdown() -> None:
+    """未送信の span を送り切る（lifespan の終了時）"""
+    if _tracer is not None:
+        from opentelemetry import trace
+
+        provider = trace.get_tracer_provider()
+        if hasattr(provider, "shutdown"):
+            provider.shutdown()
+
+
+@contextmanager
+def measure(stage: str, **attrs: Any) -> Iterator[None]:
+    tracer = _get_tracer()
+    outcome = "ok"
+    t0 = time.perf_counter()
+    INFLIGHT.inc(stage=stage)
+    try:
+        if tracer is None:
+            yield
+        else:
+            with tracer.start_as_current_span(stage, attributes={k: v for k, v in attrs.items() if v is not None}):
+                yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        INFLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(time.perf_counter() - t0, stage=stage, outcome=outcome)
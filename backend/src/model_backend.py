@@ -0,0 +1,252 @@
+"""
+モデル呼び出しの差し替え口（Bedrock / 記録の再生 / 合成スタブ）
+
+概要
+- どの実装も boto3 bedrock-runtime クライアントのうち generater.py が使う部分だけを持つ
+    invoke_model(modelId, body, contentType, accept) -> {"body": read() できるもの}
+    invoke_model_with_response_stream(...)            -> {"body": イベントの iterable}
+- MODEL_BACKEND で選ぶ
+    bedrock: 実際の Bedrock（既定）。MODEL_RECORD_DIR を指定すると応答をフィクスチャとして保存
+    replay : MODEL_FIXTURES_DIR に保存した応答を返す（同じリクエストが無ければモデルごとに順番に使い回す）
+    stub   : ネットワーク無しで決まった形の応答を返す（遅延・揺らぎ・スロットリング率を設定可能）
+- 負荷試験・自前オーバーヘッドの計測を AWS 無しで行うためのもの
+
+フィクスチャ
+- <dir>/<モデルID>/<リクエスト本文の sha256>.json
+  {"kind": "invoke" | "stream", "latency_ms": float, "body": 応答本文（stream はチャンクの配列）}
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import itertools
+import json
+import os
+import pathlib
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Protocol
+
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "bedrock")  # bedrock | replay | stub
+MODEL_FIXTURES_DIR = os.getenv("MODEL_FIXTURES_DIR", str(pathlib.Path(__file__).resolve().parent.parent / "fixtures" / "models"))
+MODEL_RECORD_DIR = os.getenv("MODEL_RECORD_DIR")
+MODEL_REPLAY_SPEED = float(os.getenv("MODEL_REPLAY_SPEED", "1.0"))  # 0 なら待たない, 2 なら半分の時間
+
+STUB_CLAUDE_MS = float(os.getenv("STUB_CLAUDE_MS", "2500"))
+STUB_NOVA_MS = float(os.getenv("STUB_NOVA_MS", "6000"))
+STUB_JITTER = float(os.getenv("STUB_JITTER", "0.2"))            # 遅延の ±割合
+STUB_THROTTLE_RATE = float(os.getenv("STUB_THROTTLE_RATE", "0"))  # ThrottlingException を返す割合
+STUB_SEED = int(os.getenv("STUB_SEED", "0"))
+
+
+class ModelBackend(Protocol):
+    def invoke_model(self, *, modelId: str, body: str, contentType: str = ..., accept: str = ...) -> Dict[str, Any]: ...
+    def invoke_model_with_response_stream(self, *, modelId: str, body: str,
+                                          contentType: str = ..., accept: str = ...) -> Dict[str, Any]: ...
+
+
+def _body_digest(body: Any) -> str:
+    data = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+    return hashlib.sha256(data).hexdigest()
+
+
+def _stream_events(chunks: List[str], delay: float = 0.0) -> Iterator[Dict[str, Any]]:
+    for chunk in chunks:
+        if delay:
+            time.sleep(delay)
+        yield {"chunk": {"bytes": chunk.encode("utf-8")}}
+
+
+def _text_deltas(text: str, size: int = 12) -> List[str]:
+    return [
+        json.dumps({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text[i:i + size]}})
+        for i in range(0, len(text), size)
+    ]
+
+
+# ========= Bedrock =========
+def bedrock_backend() -> ModelBackend:
+    import boto3
+    from botocore.config import Config
+
+    # 再試行は limiter（リトライ予算つき）で行うので SDK 側の自動リトライは切る
+    config = Config(read_timeout=60, retries={"total_max_attempts": 1})
+    return boto3.client("bedrock-runtime", region_name=os.getenv("BEDROCK_REGION", "us-east-1"), config=config)
+
+
+class RecordingBackend:
+    """実際の応答をフィクスチャとして保存しながら中継する（replay 用の素材集め）"""
+
+    def __init__(self, inner: ModelBackend, root: str) -> None:
+        self.inner = inner
+        self.root = pathlib.Path(root)
+
+    def _save(self, model_id: str, body: Any, record: Dict[str, Any]) -> None:
+        path = self.root / model_id.replace(":", "_") / f"{_body_digest(body)}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(record, ensure_ascii=False), encoding="utf-8")
+
+    def invoke_model(self, *, modelId: str, body: str, **kwargs: Any) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        resp = self.inner.invoke_model(modelId=modelId, body=body, **kwargs)
+        data = resp["body"].read()
+        self._save(modelId, body, {"kind": "invoke", "latency_ms": (time.perf_counter() - t0) * 1000,
+                                   "body": json.loads(data)})
+        return {**resp, "body": io.BytesIO(data)}
+
+    def invoke_model_with_response_stream(self, *, modelId: str, body: str, **kwargs: Any) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        resp = self.inner.invoke_model_with_response_stream(modelId=modelId, body=body, **kwargs)
+
+        def events() -> Iterator[Dict[str, Any]]:
+            chunks = []
+            for event in resp["body"]:
+                if event.get("chunk"):
+                    chunks.append(event["chunk"]["bytes"].decode("utf-8"))
+                yield event
+            self._save(modelId, body, {"kind": "stream", "latency_ms": (time.perf_counter() - t0) * 1000,
+                                       "body": chunks})
+
+        return {**resp, "body": events()}
+
+
+# ========= 再生 =========
+class ReplayBackend:
+    """
+    保存済みの応答を返す。リクエスト本文が完全一致するものが無ければ、
+    同じモデルの記録を順番に使い回す（画像が毎回違う負荷試験でも使えるように）
+    """
+
+    def __init__(self, root: str, speed: float = MODEL_REPLAY_SPEED) -> None:
+        self.root = pathlib.Path(root)
+        self.speed = speed
+        self._cycles: Dict[str, Iterator[pathlib.Path]] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, model_id: str, body: Any) -> Dict[str, Any]:
+        folder = self.root / model_id.replace(":", "_")
+        exact = folder / f"{_body_digest(body)}.json"
+        if exact.exists():
+            path = exact
+        else:
+            with self._lock:
+                cycle = self._cycles.get(model_id)
+                if cycle is None:
+                    files = sorted(folder.glob("*.json"))
+                    if not files:
+                        raise FileNotFoundError(f"フィクスチャがありません: {folder}")
+                    cycle = self._cycles[model_id] = itertools.cycle(files)
+                path = next(cycle)
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _wait(self, record: Dict[str, Any]) -> None:
+        if self.speed > 0:
+            time.sleep(record.get("latency_ms", 0) / 1000 / self.speed)
+
+    def invoke_model(self, *, modelId: str, body: str, **_: Any) -> Dict[str, Any]:
+        record = self._record(modelId, body)
+        self._wait(record)
+        if record["kind"] == "stream":
+            # ストリームで記録したものを通常呼び出しで使う場合はテキストをつなげる
+            text = "".join(json.loads(c).get("delta", {}).get("text", "") for c in record["body"])
+            return {"body": io.BytesIO(json.dumps({"content": [{"type": "text", "text": text}]}).encode())}
+        return {"body": io.BytesIO(json.dumps(record["body"]).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, *, modelId: str, body: str, **_: Any) -> Dict[str, Any]:
+        record = self._record(modelId, body)
+        if record["kind"] == "stream":
+            chunks = record["body"]
+        else:
+            chunks = _text_deltas(record["body"].get("content", [{}])[0].get("text", ""))
+        # 待ち時間はチャンクに均等に割り振る（最初のトークンまでの時間も再現される）
+        delay = record.get("latency_ms", 0) / 1000 / self.speed / max(1, len(chunks)) if self.speed > 0 else 0.0
+        return {"body": _stream_events(chunks, delay)}
+
+
+# ========= 合成スタブ =========
+def _stub_png(seed: int) -> bytes:
+    """入力ごとに色の違う 512x512 の PNG（Pillow が無ければ 1x1）"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return base64.b64decode(
+            "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+        )
+    rnd = random.Random(seed)
+    buf = io.BytesIO()
+    Image.new("RGB", (512, 512), tuple(rnd.randrange(256) for _ in range(3))).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class StubBackend:
+    """
+    決まった形の応答を、設定した遅延で返す。
+    - Claude: リクエスト本文のハッシュから決まるスコアの JSON（同じ入力なら同じ結果）
+    - Nova Canvas: 単色の PNG
+    """
+
+    def __init__(self, claude_ms: float = STUB_CLAUDE_MS, nova_ms: float = STUB_NOVA_MS,
+                 jitter: float = STUB_JITTER, throttle_rate: float = STUB_THROTTLE_RATE, seed: int = STUB_SEED) -> None:
+        self.claude_ms = claude_ms
+        self.nova_ms = nova_ms
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._png_cache: Dict[int, bytes] = {}
+
+    def _delay(self, base_ms: float) -> float:
+        with self._lock:
+            r = self._rnd.uniform(-self.jitter, self.jitter)
+            throttled = self._rnd.random() < self.throttle_rate
+        if throttled:
+            from botocore.exceptions import ClientError
+
+            time.sleep(0.01)
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "stub throttling"}}, "InvokeModel")
+        return max(0.0, base_ms * (1 + r) / 1000)
+
+    @staticmethod
+    def _claude_text(body: Any) -> str:
+        h = int(_body_digest(body)[:8], 16)
+        score = h % 101
+        return json.dumps({
+            "answer": "（スタブ応答）主食・主菜・副菜のバランスを確認しましょう。",
+            "score_percent": score,
+            "improvement": "野菜を一品追加し、揚げ物を控えめにしましょう。",
+        }, ensure_ascii=False)
+
+    def invoke_model(self, *, modelId: str, body: str, **_: Any) -> Dict[str, Any]:
+        if "nova" in modelId:
+            time.sleep(self._delay(self.nova_ms))
+            seed = int(_body_digest(body)[:8], 16)
+            png = self._png_cache.get(seed % 64)
+            if png is None:
+                png = self._png_cache[seed % 64] = _stub_png(seed % 64)
+            out = {"images": [base64.b64encode(png).decode("ascii")]}
+        else:
+            time.sleep(self._delay(self.claude_ms))
+            out = {"content": [{"type": "text", "text": self._claude_text(body)}],
+                   "usage": {"input_tokens": len(body) // 4, "output_tokens": 80}}
+        return {"body": io.BytesIO(json.dumps(out).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, *, modelId: str, body: str, **_: Any) -> Dict[str, Any]:
+        total = self._delay(self.claude_ms)
+        chunks = _text_deltas(self._claude_text(body))
+        return {"body": _stream_events(chunks, total / max(1, len(chunks)))}
+
+
+# ========= 選択 =========
+def make_model_backend(kind: Optional[str] = None) -> ModelBackend:
+    kind = kind or MODEL_BACKEND
+    if kind == "stub":
+        return StubBackend()
+    if kind == "replay":
+        return ReplayBackend(MODEL_FIXTURES_DIR)
+    if kind != "bedrock":
+        raise ValueError(f"MODEL_BACKEND が不正です: {kind}（bedrock | replay | stub）")
+    backend = bedrock_backend()
+    return RecordingBackend(backend, MODEL_RECORD_DIR) if MODEL_RECORD_DIR else backend
@@ -0,0 +1,200 @@
+"""
+プロフィール（user_profile の1行）の読み込みキャッシュ
+
+概要
+- ProfileCache.get_or_load(user_id, loader): メモリ → 共有層 → loader（DB）の順に探す
+- メモリ層: LRU（PROFILE_CACHE_MAX 件）+ TTL（PROFILE_CACHE_TTL 秒）
+- 共有層（任意）: SharedCache を満たすもの。PROFILE_CACHE_SHARED=redis で Redis を使う
+  未指定で SHARED_CACHE_SOCKET があれば（serve.py の複数ワーカー時）shared_cache のソケットを使う。
+  このときメモリ層は PROFILE_CACHE_MEMORY_TTL 秒だけ（他ワーカーの /init を早く反映するため）
+- 同じユーザの同時ミスは1回の loader 呼び出しにまとめる（他スレッドはその結果を待つ）
+- invalidate(user_id): save_init_list から呼ぶ。読み込み中の古い結果で上書きしないよう世代も進める
+  （世代は読み込み中のユーザの分だけ持つ。読み込みが終われば消す）
+- get_or_load / invalidate は共有層のソケットを待つので、DB スレッド（database._run）から呼ぶ
+
+注意
+- 共有層を使っても他ワーカーのメモリ層は TTL まで古い値が残りうる（PROFILE_CACHE_TTL で調整）
+- 行が無いユーザも「無い」ことをキャッシュする（/init で無効化される）
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Protocol
+
+import shared_cache
+from image_cache import LRUCache
+
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_MAX = int(os.getenv("PROFILE_CACHE_MAX", "10000"))
+PROFILE_CACHE_SHARED = os.getenv("PROFILE_CACHE_SHARED", "")  # "" | redis | local
+PROFILE_CACHE_MEMORY_TTL = float(os.getenv("PROFILE_CACHE_MEMORY_TTL", "2"))  # 共有層が local のときのメモリ層
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+
+logger = logging.getLogger("uvicorn.error")
+
+Row = Optional[Dict[str, Any]]
+
+
+class SharedCache(Protocol):
+    def get(self, key: str) -> Optional[bytes]: ...
+    def set(self, key: str, value: bytes, ttl: float) -> None: ...
+    def delete(self, key: str) -> None: ...
+
+
+class RedisSharedCache:
+    def __init__(self, url: str) -> None:
+        import redis  # 任意依存（PROFILE_CACHE_SHARED=redis のときだけ必要）
+
+        self._r = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._r.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._r.set(key, value, ex=max(1, int(ttl)))
+
+    def delete(self, key: str) -> None:
+        self._r.delete(key)
+
+
+def _dumps(row: Row) -> bytes:
+    if row is None:
+        return b"null"
+    photo = row.get("individual_photo_url")
+    return json.dumps({
+        **row,
+        # 参照（b"blob:..."）も旧データの画像バイト列もそのまま戻せるよう base64 で持つ
+        "individual_photo_url": base64.b64encode(photo).decode("ascii") if photo is not None else None,
+    }).encode("utf-8")
+
+
+def _loads(data: bytes) -> Row:
+    row = json.loads(data)
+    if row is None:
+        return None
+    photo = row.get("individual_photo_url")
+    row["individual_photo_url"] = base64.b64decode(photo) if photo is not None else None
+    return row
+
+
+class ProfileCache:
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, max_entries: int = PROFILE_CACHE_MAX,
+                 shared: Optional[SharedCache] = None, namespace: str = "diet:profile",
+                 memory_ttl: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self.memory_ttl = ttl if memory_ttl is None else min(ttl, memory_ttl)
+        self.shared = shared
+        self.ns = namespace
+        self._memory = LRUCache(max_entries, sizeof=lambda _: 1)
+        self._inflight: Dict[str, Future] = {}
+        self._versions: Dict[str, int] = {}  # 読み込み中のユーザのうち、その間に invalidate されたものだけ
+        self._lock = threading.Lock()
+        self.stats = {"hits_memory": 0, "hits_shared": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+
+    def _bump(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _memory_get(self, user_id: str):
+        hit = self._memory.get(user_id)
+        if hit is None:
+            return False, None
+        expires, row = hit
+        if expires < time.monotonic():
+            self._memory.delete(user_id)
+            return False, None
+        return True, row
+
+    def _shared_get(self, user_id: str):
+        if self.shared is None:
+            return False, None
+        try:
+            data = self.shared.get(f"{self.ns}:{user_id}")
+        except Exception as e:
+            logger.warning("profile cache get failed (shared): %s", e)
+            return False, None
+        return (True, _loads(data)) if data is not None else (False, None)
+
+    def get_or_load(self, user_id: str, loader: Callable[[], Row]) -> Row:
+        found, row = self._memory_get(user_id)
+        if found:
+            self._bump("hits_memory")
+            return row
+
+        with self._lock:
+            fut = self._inflight.get(user_id)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[user_id] = Future()
+                version = self._versions.get(user_id, 0)
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            return fut.result()
+
+        try:
+            found, row = self._shared_get(user_id)
+            if found:
+                self._bump("hits_shared")
+            else:
+                self._bump("misses")
+                row = loader()
+            with self._lock:
+                # 読み込み中に invalidate されていたら古い値なので載せない
+                fresh = self._versions.get(user_id, 0) == version
+                if fresh:
+                    self._memory.set(user_id, (time.monotonic() + self.memory_ttl, row))
+            if fresh and not found and self.shared is not None:
+                try:
+                    self.shared.set(f"{self.ns}:{user_id}", _dumps(row), self.ttl)
+                except Exception as e:
+                    logger.warning("profile cache set failed (shared): %s", e)
+            fut.set_result(row)
+            return row
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(user_id) is fut:
+                    del self._inflight[user_id]
+                    self._versions.pop(user_id, None)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            # 読み込み中でなければ世代は不要（次の読み込みは invalidate 後の DB を読む）
+            if user_id in self._inflight:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self.stats["invalidations"] += 1
+        self._memory.delete(user_id)
+        if self.shared is not None:
+            try:
+                self.shared.delete(f"{self.ns}:{user_id}")
+            except Exception as e:
+                logger.warning("profile cache delete failed (shared): %s", e)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        hits = stats["hits_memory"] + stats["hits_shared"] + stats["coalesced"]
+        total = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / total, 4) if total else 0.0
+        stats["entries"] = len(self._memory)
+        return stats
+
+
+def make_profile_cache() -> ProfileCache:
+    if PROFILE_CACHE_SHARED == "redis":
+        return ProfileCache(shared=RedisSharedCache(REDIS_URL))
+    if PROFILE_CACHE_SHARED in ("", "local"):
+        local = shared_cache.client("")
+        if local is not None:
+            return ProfileCache(shared=local, memory_ttl=PROFILE_CACHE_MEMORY_TTL)
+    return ProfileCache()
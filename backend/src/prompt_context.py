@@ -0,0 +1,91 @@
+"""
+Claude に渡すコンテキスト（プロフィール + 過去情報）の圧縮表現
+
+概要
+- encode_context(init, past) -> str
+  - プロフィール: 値のある項目だけ "key=value" で1行
+  - 履歴: 1日1行の CSV 風の表（全行が空の列は出さない, 未記録は "-"）
+  - 平均・傾き: 値のある項目だけ
+- past は日次ロールアップ（{"days": ...}）と従来の "N_day_ago" 形式のどちらも受け付ける
+
+注意
+- 出力の形式説明は generater.py のシステムプロンプト側に書く（毎回同じ＝プロンプトキャッシュの対象）
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, List
+
+FIELDS = ("weight_kg", "habits", "sleep_hour")
+
+
+def _fmt(v: Any) -> str:
+    if v is None:
+        return "-"
+    if isinstance(v, float):
+        return f"{v:g}"
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return str(v)
+
+
+def _pairs(d: Dict[str, Any]) -> str:
+    return " ".join(f"{k}={_fmt(v)}" for k, v in d.items() if v not in (None, "", [], {}))
+
+
+def _days(past: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if "days" in past:
+        return list(past["days"])
+    # 従来形式: user_id や画像URLは落とし、記録の無い行は飛ばす
+    days = []
+    for v in past.values():
+        if not isinstance(v, dict) or all(v.get(f) is None for f in FIELDS):
+            continue
+        created = v.get("created_at")
+        days.append({"date": _fmt(created)[:10] if created else "-", **{f: v.get(f) for f in FIELDS}})
+    return days
+
+
+def encode_history(days: List[Dict[str, Any]]) -> str:
+    cols = [f for f in FIELDS if any(d.get(f) is not None for d in days)]
+    if not cols:
+        return "なし"
+    lines = ["date," + ",".join(cols)]
+    for d in days:
+        day = str(d.get("date") or "-")
+        lines.append(",".join([day[5:] if len(day) == 10 else day] + [_fmt(d.get(f)) for f in cols]))
+    return "\n".join(lines)
+
+
+# プロフィールに注入された今回の値 → 履歴の列
+_TODAY_KEYS = {"weight_kg": "weight_kg", "exercise_time": "habits", "sleep_hour": "sleep_hour"}
+
+
+def encode_context(init: Any, past: Dict[str, Any]) -> str:
+    past = past or {}
+    days = _days(past)
+    lines = []
+    if isinstance(init, dict):
+        # 履歴の先頭（今日）と同じ値はプロフィール側から落とす
+        latest = days[0] if days else {}
+        init = {k: v for k, v in init.items()
+                if not (k in _TODAY_KEYS and v is not None and _fmt(v) == _fmt(latest.get(_TODAY_KEYS[k])))}
+        profile = _pairs(init)
+    else:
+        profile = _fmt(init)
+    lines.append(f"profile: {profile or 'なし'}")
+    lines.append("history:")
+    lines.append(encode_history(days))
+
+    avg7, avg30 = _pairs(past.get("avg7") or {}), _pairs(past.get("avg30") or {})
+    if avg7:
+        lines.append(f"avg7: {avg7}")
+    if avg30 and avg30 != avg7:  # 記録が7日以内なら同じ値になる
+        lines.append(f"avg30: {avg30}")
+    trend = {k: v for k, v in (past.get("weight_slope_kg_per_day") or {}).items() if v is not None}
+    if len(set(trend.values())) == 1 and len(trend) > 1:
+        trend = {"/".join(trend): next(iter(trend.values()))}
+    if trend:
+        lines.append(f"weight_trend_kg_per_day: {_pairs(trend)}")
+    return "\n".join(lines)
@@ -0,0 +1,102 @@
+"""
+ユーザごとの日次ロールアップ（user_daily_summary の中身を作る純粋関数）
+
+概要
+- days: 1日1件（その日の最新記録）を新しい順に最大 ROLLUP_DAYS 日分
+- merge_entry: ログ1件を days に反映（同じ日なら上書き）して古い日を落とす
+- summarize: 7/30日平均（体重・運動・睡眠）と体重の傾き（kg/日, 最小二乗）を計算
+- compact: Claude に渡す過去情報（直近7日 + 平均 + 傾き）
+
+注意
+- 日付は DB の NOW() 基準（meal_log.created_at と揃える）
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+ROLLUP_DAYS = 30
+FIELDS = ("weight_kg", "habits", "sleep_hour")
+
+
+def _num(v: Any) -> Optional[float]:
+    try:
+        f = float(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+    return int(f) if f is not None and f.is_integer() else f
+
+
+def _day(v: Any) -> date:
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    return date.fromisoformat(str(v)[:10])
+
+
+def entry(created_at: Any, weight_kg: Any, habits: Any, sleep_hour: Any) -> Dict[str, Any]:
+    return {
+        "date": _day(created_at).isoformat(),
+        "weight_kg": _num(weight_kg),
+        "habits": _num(habits),
+        "sleep_hour": _num(sleep_hour),
+    }
+
+
+def _trim(days: Iterable[Dict[str, Any]], today: date) -> List[Dict[str, Any]]:
+    oldest = today - timedelta(days=ROLLUP_DAYS - 1)
+    kept = [d for d in days if _day(d["date"]) >= oldest]
+    return sorted(kept, key=lambda d: d["date"], reverse=True)[:ROLLUP_DAYS]
+
+
+def merge_entry(days: List[Dict[str, Any]], new: Dict[str, Any], today: date) -> List[Dict[str, Any]]:
+    """同じ日の記録は新しいもので置き換える（1日1件）"""
+    return _trim([d for d in days if d["date"] != new["date"]] + [new], today)
+
+
+def rebuild(rows: Iterable[Dict[str, Any]], today: date) -> List[Dict[str, Any]]:
+    """meal_log の行（created_at 昇順）から days を作り直す（ロールアップ行が無いときの初回用）"""
+    latest: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        e = entry(row["created_at"], row.get("weight_kg"), row.get("habits"), row.get("sleep_hour"))
+        latest[e["date"]] = e
+    return _trim(latest.values(), today)
+
+
+def _slope(points: List[tuple]) -> Optional[float]:
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mx = sum(x for x, _ in points) / n
+    my = sum(y for _, y in points) / n
+    var = sum((x - mx) ** 2 for x, _ in points)
+    if var == 0:
+        return None
+    return round(sum((x - mx) * (y - my) for x, y in points) / var, 3)
+
+
+def summarize(days: List[Dict[str, Any]], today: date) -> Dict[str, Optional[float]]:
+    """テーブルの集計列（weight_avg7, ..., weight_slope30）を返す"""
+    out: Dict[str, Optional[float]] = {}
+    for window in (7, 30):
+        oldest = today - timedelta(days=window - 1)
+        recent = [d for d in days if _day(d["date"]) >= oldest]
+        for field in FIELDS:
+            values = [d[field] for d in recent if d.get(field) is not None]
+            out[f"{field.split('_')[0]}_avg{window}"] = round(sum(values) / len(values), 2) if values else None
+        out[f"weight_slope{window}"] = _slope(
+            [(_day(d["date"]).toordinal(), d["weight_kg"]) for d in recent if d.get("weight_kg") is not None]
+        )
+    return out
+
+
+def compact(days: List[Dict[str, Any]], stats: Dict[str, Any], recent_days: int = 7) -> Dict[str, Any]:
+    """Claude に渡す形（直近 recent_days 日分の記録 + 平均 + 傾き）"""
+    return {
+        "days": days[:recent_days],
+        "avg7": {f: stats.get(f"{f.split('_')[0]}_avg7") for f in FIELDS},
+        "avg30": {f: stats.get(f"{f.split('_')[0]}_avg30") for f in FIELDS},
+        "weight_slope_kg_per_day": {"7d": stats.get("weight_slope7"), "30d": stats.get("weight_slope30")},
+    }
@@ -0,0 +1,252 @@
+"""
+S3 へのアップロード（内容アドレスのキー + バックグラウンド + マルチパート）
+
+概要
+- S3Uploader.put(data) -> s3://<bucket>/<prefix><ab>/<sha256><suffix>
+  - キーは内容の sha256。同じ画像は同じキーなので重複保存せず、何度呼んでも結果は同じ（別ユーザで上書きしない）
+  - このプロセスで確認済みのキーは何もしない。アップロード中のキーは同じ Future を待つ
+  - 未確認なら head_object で有無を確かめ、無いときだけ書く
+- 実行は上限つきのスレッド（S3_UPLOAD_WORKERS）。受け付けは S3_UPLOAD_MAX_PENDING 件まで
+  （溢れたら呼び出し元のスレッドでそのまま書く = 背圧）
+- S3_MULTIPART_THRESHOLD 以上は s3transfer のマルチパート（S3_MULTIPART_CHUNKSIZE ごと、S3_MULTIPART_CONCURRENCY 並列）
+- 接続は botocore のプール（make_client の max_pool_connections）を全スレッドで共有
+- 署名付きURLが発行できる（認証情報がある）なら URI をすぐ返し、完了は待たない。
+  発行できないとき、または S3_UPLOAD_WAIT=1 なら完了まで待つ
+- S3_ENDPOINT_URL: S3 互換のローカル環境（MinIO, moto server など）を使うとき
+
+注意
+- 完了前に署名付きURLを取りに来たクライアントは 404 になりうる（通常はレスポンスが届くまでに終わる）
+- 失敗したら S3_UPLOAD_RETRIES 回まで再試行し、それでも失敗したら警告を出す（その URI の画像は取得できない）
+- stored(uri): 保存が確かめられたら完了する Future（失敗なら例外）。保存先を DB に記録するのはこれを待ってから
+- close(timeout): 終了時に受け付け済みの分を書き切る（generater.drain から）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "4"))
+S3_UPLOAD_MAX_PENDING = int(os.getenv("S3_UPLOAD_MAX_PENDING", "64"))
+S3_UPLOAD_RETRIES = int(os.getenv("S3_UPLOAD_RETRIES", "2"))
+S3_UPLOAD_WAIT = os.getenv("S3_UPLOAD_WAIT", "0") == "1"
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))
+
+logger = logging.getLogger("uvicorn.error")
+
+_CONFIRMED_MAX = 4096
+_MISSING = {"404", "NoSuchKey", "NotFound"}
+
+
+def make_client(region: Optional[str] = None) -> Any:
+    """S3 クライアント（アップロードのスレッド × マルチパートの並列数 + 読み出し用の分だけ接続をプールする）"""
+    import boto3
+    from botocore.config import Config
+
+    pool = S3_UPLOAD_WORKERS * S3_MULTIPART_CONCURRENCY + 10
+    return boto3.client(
+        "s3", region_name=region, endpoint_url=S3_ENDPOINT_URL or None,
+        config=Config(max_pool_connections=pool, retries={"mode": "standard"}),
+    )
+
+
+class S3Uploader:
+    def __init__(self, client: Any, bucket: str, prefix: str = "", *,
+                 workers: int = S3_UPLOAD_WORKERS, max_pending: int = S3_UPLOAD_MAX_PENDING,
+                 retries: int = S3_UPLOAD_RETRIES, wait: bool = S3_UPLOAD_WAIT,
+                 multipart_threshold: int = S3_MULTIPART_THRESHOLD,
+                 multipart_chunksize: int = S3_MULTIPART_CHUNKSIZE,
+                 multipart_concurrency: int = S3_MULTIPART_CONCURRENCY) -> None:
+        from boto3.s3.transfer import TransferConfig
+
+        self._s3 = client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+        self.retries = retries
+        self.wait = wait
+        self.multipart_threshold = multipart_threshold
+        self._transfer = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=multipart_concurrency,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3-upload")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._confirmed: "OrderedDict[str, None]" = OrderedDict()
+        self._closed = False
+        self._presign: Optional[bool] = None
+        self.stats = {"submitted": 0, "deduped": 0, "exists": 0, "uploaded": 0, "multipart": 0,
+                      "inline": 0, "failures": 0, "bytes": 0}
+
+    def key(self, data: bytes, suffix: str = "") -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{self.prefix}{digest[:2]}/{digest}{suffix}"
+
+    def uri(self, key: str) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+    def can_presign(self) -> bool:
+        """認証情報があれば署名付きURLはローカルで作れる（無ければ NoCredentialsError）"""
+        if self._presign is None:
+            try:
+                self._s3.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": self.prefix}, ExpiresIn=60)
+                self._presign = True
+            except Exception as e:
+                logger.warning("s3 presign unavailable, uploads will be awaited: %s", e)
+                self._presign = False
+        return self._presign
+
+    # ========= 受け付け =========
+    def submit(self, data: bytes, suffix: str = "", content_type: str = "application/octet-stream") -> Tuple[str, Future]:
+        """(URI, 完了で URI を返す Future)。同じ内容の呼び出しは1回のアップロードにまとまる"""
+        key = self.key(data, suffix)
+        with self._lock:
+            self.stats["submitted"] += 1
+            if key in self._confirmed:
+                self._confirmed.move_to_end(key)
+                self.stats["deduped"] += 1
+                done: Future = Future()
+                done.set_result(self.uri(key))
+                return self.uri(key), done
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.stats["deduped"] += 1
+                return self.uri(key), fut
+            fut = self._inflight[key] = Future()
+            background = not self._closed and self._slots.acquire(blocking=False)
+            if not background:
+                self.stats["inline"] += 1
+        if background:
+            self._executor.submit(self._run, key, data, content_type, fut, True)
+        else:
+            self._run(key, data, content_type, fut, False)
+        return self.uri(key), fut
+
+    def put(self, data: bytes, suffix: str = "", content_type: str = "application/octet-stream") -> str:
+        """URI を返す。署名付きURLが作れるなら完了を待たない"""
+        uri, fut = self.submit(data, suffix, content_type)
+        if self.wait or not self.can_presign():
+            fut.result()
+        return uri
+
+    def stored(self, uri: str) -> Future:
+        """
+        uri の保存が終わったら URI で完了する Future（アップロードが失敗したら例外）。
+        このプロセスで受け付けていないもの（別ワーカーが書いたものなど）は head_object で確かめる
+        """
+        key = uri[len(self.uri("")):]
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            confirmed = key in self._confirmed
+            closed = self._closed
+        if confirmed:
+            fut = Future()
+            fut.set_result(uri)
+            return fut
+        if not closed:
+            try:
+                return self._executor.submit(self._check, key)
+            except RuntimeError:
+                pass  # close と入れ違い
+        fut = Future()
+        try:
+            fut.set_result(self._check(key))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def _check(self, key: str) -> str:
+        if not self._exists(key):
+            raise FileNotFoundError(f"not stored: {self.uri(key)}")
+        with self._lock:
+            self._confirmed[key] = None
+            if len(self._confirmed) > _CONFIRMED_MAX:
+                self._confirmed.popitem(last=False)
+        return self.uri(key)
+
+    # ========= アップロード =========
+    def _run(self, key: str, data: bytes, content_type: str, fut: Future, slot: bool) -> None:
+        try:
+            self._upload(key, data, content_type)
+        except Exception as e:
+            with self._lock:
+                self.stats["failures"] += 1
+                self._inflight.pop(key, None)
+            logger.error("s3 upload failed: %s: %s", self.uri(key), e)
+            fut.set_exception(e)
+        else:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._confirmed[key] = None
+                if len(self._confirmed) > _CONFIRMED_MAX:
+                    self._confirmed.popitem(last=False)
+            fut.set_result(self.uri(key))
+        finally:
+            if slot:
+                self._slots.release()
+
+    def _exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in _MISSING:
+                return False
+            raise
+
+    def _upload(self, key: str, data: bytes, content_type: str) -> None:
+        multipart = len(data) >= self.multipart_threshold
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.measure("s3_upload", bytes=len(data), multipart=multipart):
+                    if self._exists(key):
+                        with self._lock:
+                            self.stats["exists"] += 1
+                        return
+                    if multipart:
+                        # s3transfer が CreateMultipartUpload → UploadPart（並列）→ Complete。失敗時は Abort する
+                        self._s3.upload_fileobj(io.BytesIO(data), self.bucket, key,
+                                                ExtraArgs={"ContentType": content_type}, Config=self._transfer)
+                    else:
+                        self._s3.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+                with self._lock:
+                    self.stats["uploaded"] += 1
+                    self.stats["multipart"] += int(multipart)
+                    self.stats["bytes"] += len(data)
+                return
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.2 * 2 ** attempt)
+
+    # ========= 終了 =========
+    def close(self, timeout: float) -> bool:
+        """受け付け済みの分を timeout 秒まで書き切る（以降の submit は呼び出し元で書く）。終われば True"""
+        with self._lock:
+            self._closed = True
+        waiter = threading.Thread(target=self._executor.shutdown, kwargs={"wait": True}, daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        return not waiter.is_alive()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "pending": len(self._inflight)}
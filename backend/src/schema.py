@@ -0,0 +1,130 @@
+"""
+スキーマ管理（起動時に一度だけ実行するマイグレーション）
+
+概要
+- MIGRATIONS: (version, [DDL...]) の昇順リスト。追加は末尾に足すだけ
+- bootstrap_schema: schema_version テーブルを見て未適用分だけ実行し、版数を記録
+- 複数ワーカー同時起動に備えて MySQL の GET_LOCK で直列化
+
+注意
+- 既存テーブルの修正は行わない方針（新しい版は CREATE TABLE IF NOT EXISTS 中心）
+"""
+
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+_LOCK_NAME = "diet_schema_bootstrap"
+
+MIGRATIONS: List[Tuple[int, List[str]]] = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS user_profile (
+            user_id VARCHAR(64) PRIMARY KEY,
+            height INT NULL,
+            gender VARCHAR(16) NULL,
+            years INT NULL,
+            individual_photo_url MEDIUMBLOB NULL,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS meal_log (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id VARCHAR(64) NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            meal_image_url VARCHAR(1024) NULL,
+            weight_kg INT NULL,
+            habits INT NULL,
+            sleep_hour INT NULL,
+            KEY idx_user_date (user_id, created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS generated_answers (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id VARCHAR(64) NOT NULL,
+            answer TEXT NULL,
+            score_percent INT NULL,
+            improvement TEXT NULL,
+            future_image_url VARCHAR(1024) NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_user_created (user_id, created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """,
+    ]),
+    (2, [
+        # 日次ロールアップ（1ユーザ1行）。days_json は1日1件・新しい順・最大30日
+        # 集計列は書き込み時点の値（SQL から直接見る用）
+        """
+        CREATE TABLE IF NOT EXISTS user_daily_summary (
+            user_id VARCHAR(64) PRIMARY KEY,
+            days_json TEXT NOT NULL,
+            weight_avg7 DOUBLE NULL,
+            habits_avg7 DOUBLE NULL,
+            sleep_avg7 DOUBLE NULL,
+            weight_slope7 DOUBLE NULL,
+            weight_avg30 DOUBLE NULL,
+            habits_avg30 DOUBLE NULL,
+            sleep_avg30 DOUBLE NULL,
+            weight_slope30 DOUBLE NULL,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """,
+    ]),
+    (3, [
+        # ユーザごとの前回の未来像（段階ごとに1行）。image_key = 顔画像の sha256 + 生成パラメータ
+        # 今の顔画像・設定で計算したキーと一致すれば作り直さずに future_image_url を使い回す
+        """
+        CREATE TABLE IF NOT EXISTS user_future_image (
+            user_id VARCHAR(64) NOT NULL,
+            variant VARCHAR(32) NOT NULL,
+            image_key VARCHAR(160) NOT NULL,
+            future_image_url VARCHAR(1024) NOT NULL,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, variant)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: Any) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            """
+        )
+        cur.execute("SELECT MAX(version) AS v FROM schema_version")
+        row = cur.fetchone() or {}
+    return int(row.get("v") or 0)
+
+
+def bootstrap_schema(conn: Any, *, lock_timeout: int = 30) -> int:
+    """
+    未適用のマイグレーションを順に実行し、適用後の版数を返す。
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT GET_LOCK(%s, %s) AS got", (_LOCK_NAME, lock_timeout))
+        if not (cur.fetchone() or {}).get("got"):
+            raise RuntimeError("schema bootstrap のロック取得に失敗しました。")
+    try:
+        version = current_version(conn)
+        for v, statements in MIGRATIONS:
+            if v <= version:
+                continue
+            with conn.cursor() as cur:
+                for ddl in statements:
+                    cur.execute(ddl)
+                cur.execute("INSERT INTO schema_version (version) VALUES (%s)", (v,))
+            version = v
+        return version
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
@@ -0,0 +1,109 @@
+"""
+本番用の起動（複数ワーカー + uvloop/httptools + 終了時の待ち合わせ）
+
+使い方（backend/src から）
+    python serve.py                          # WEB_WORKERS（既定: CPU 数）ワーカーで 0.0.0.0:8000
+    python serve.py --workers 4 --port 8080
+    python serve.py --workers 1 --no-shared-cache
+
+- ワーカーは uvicorn のマルチプロセス（各ワーカーが main:main を import する）
+- uvloop / httptools が入っていれば使う（無ければ asyncio / h11）
+- 2ワーカー以上なら shared_cache のサーバを先に別プロセスで立て、SHARED_CACHE_SOCKET をワーカーに渡す
+  プロフィール・未来像・生成結果をワーカー間で共有する（ワーカーごとのメモリ上の未来像キャッシュは
+  NOVA_CACHE_MAX_BYTES を指定しなければ 32MB に絞る）
+- 画像処理のプロセスプールはワーカーごとにできるので、IMAGE_WORKERS を指定しなければ CPU 数 / ワーカー数にする
+- SIGTERM / SIGINT: 新規接続を止め、処理中のリクエストを --graceful-timeout 秒まで待つ。
+  その後各ワーカーの lifespan が実行中のジョブと Bedrock 呼び出しを SHUTDOWN_DRAIN_SEC 秒まで待つ
+  （コンテナの停止猶予は GRACEFUL_TIMEOUT + SHUTDOWN_DRAIN_SEC より長くする）
+
+注意
+- /metrics の値はワーカーごと（スクレイプのたびに別のワーカーに当たりうる）
+- JOB_QUEUE=memory のジョブはワーカーごとに持つ。GET /jobs/{id} を確実に引くには JOB_QUEUE=redis
+- 開発時の自動リロードは従来どおり `uvicorn main:main --reload`
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import tempfile
+import time
+
+import startup
+
+startup.load_env()
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))  # 0 なら CPU 数
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+WEB_ACCESS_LOG = os.getenv("WEB_ACCESS_LOG", "1") == "1"
+WEB_LOG_LEVEL = os.getenv("WEB_LOG_LEVEL", "info")
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _start_shared_cache() -> multiprocessing.Process:
+    import shared_cache
+
+    path = os.getenv("SHARED_CACHE_SOCKET") or os.path.join(tempfile.gettempdir(), f"diet-cache-{os.getpid()}.sock")
+    proc = multiprocessing.get_context("spawn").Process(
+        target=shared_cache.run_server, args=(path,), name="shared-cache", daemon=True,
+    )
+    proc.start()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(path):
+        if not proc.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"shared cache did not start: {path}")
+        time.sleep(0.02)
+    # ワーカーは spawn で起動するので、ここで入れた環境変数を引き継ぐ
+    os.environ["SHARED_CACHE_SOCKET"] = path
+    os.environ.setdefault("NOVA_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+    return proc
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="本番用の起動（複数ワーカー）")
+    ap.add_argument("--host", default=WEB_HOST)
+    ap.add_argument("--port", type=int, default=WEB_PORT)
+    ap.add_argument("--workers", type=int, default=WEB_WORKERS or os.cpu_count() or 1)
+    ap.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT)
+    ap.add_argument("--shared-cache", action=argparse.BooleanOptionalAction, default=None,
+                    help="ワーカー間の共有キャッシュ（既定: 2ワーカー以上なら使う）")
+    ap.add_argument("--app", default="main:main", help="ASGI アプリ（module:attr）")
+    ap.add_argument("--factory", action="store_true", help="--app をアプリを返す関数として呼ぶ")
+    args = ap.parse_args()
+
+    import uvicorn
+
+    if args.workers > 1:
+        os.environ.setdefault("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    use_shared = args.shared_cache if args.shared_cache is not None else args.workers > 1
+    cache_proc = _start_shared_cache() if use_shared else None
+    try:
+        uvicorn.run(
+            args.app,
+            factory=args.factory,
+            app_dir=os.path.dirname(os.path.abspath(__file__)),
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            loop="uvloop" if _installed("uvloop") else "asyncio",
+            http="httptools" if _installed("httptools") else "h11",
+            timeout_graceful_shutdown=args.graceful_timeout,
+            access_log=WEB_ACCESS_LOG,
+            log_level=WEB_LOG_LEVEL,
+            proxy_headers=True,
+        )
+    finally:
+        if cache_proc is not None:
+            cache_proc.terminate()
+            cache_proc.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+同じホストのワーカープロセス間で共有するキャッシュ（Unix ソケットのキー・値ストア）
+
+概要
+- serve.py が複数ワーカーで起動するとき、ワーカーより先に run_server() を別プロセスで立てて
+  SHARED_CACHE_SOCKET をワーカーの環境に入れる。各ワーカーはこれを共有層として使う
+    プロフィール   : profile_cache の共有層（PROFILE_CACHE_SHARED が未指定なら自動でこれ）
+    未来像         : generater の TieredCache の memory と disk の間の層
+    生成結果       : SingleFlight の保持結果（再送が別ワーカーに届いても Bedrock を呼び直さない）
+- サーバ: LRU（SHARED_CACHE_MAX_BYTES）+ TTL。1スレッドの asyncio なので排他は不要
+- SharedCacheClient: get / set(key, value, ttl=0) / delete / delete_prefix
+  profile_cache.SharedCache と image_cache.CacheBackend の両方を満たす
+  - 接続はスレッドごとに1本を使い回す。サーバに届かなければ警告を出してミス扱い（キャッシュ無しで動く）
+
+プロトコル（1要求1応答、数値はビッグエンディアン）
+- 要求: op(1) + キー長(2) + ttl 秒(8, double。0 なら期限なし) + 値の長さ(4) + キー + 値
+  op: G=get, S=set, D=delete, P=delete_prefix
+- 応答: 有無(1) + 値の長さ(4) + 値（P は削除件数を10進の文字列で返す）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+from typing import Optional, Tuple
+
+from image_cache import LRUCache
+
+SHARED_CACHE_SOCKET = os.getenv("SHARED_CACHE_SOCKET")
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+SHARED_CACHE_TIMEOUT = float(os.getenv("SHARED_CACHE_TIMEOUT", "0.5"))
+
+logger = logging.getLogger("uvicorn.error")
+
+_REQ = struct.Struct(">BHdI")
+_RESP = struct.Struct(">BI")
+_WARN_INTERVAL = 30.0
+
+
+# ========= サーバ =========
+class _Store:
+    def __init__(self, max_bytes: int) -> None:
+        # 値は (期限 monotonic or 0, bytes)。サイズはキーも含めて数える
+        self._lru = LRUCache(max_bytes, sizeof=lambda v: len(v[1]) + 64)
+
+    def get(self, key: str) -> Optional[bytes]:
+        hit = self._lru.get(key)
+        if hit is None:
+            return None
+        expires, value = hit
+        if expires and expires < time.monotonic():
+            self._lru.delete(key)
+            return None
+        return value
+
+    def handle(self, op: int, key: str, ttl: float, value: bytes) -> Tuple[bool, bytes]:
+        if op == ord("G"):
+            found = self.get(key)
+            return found is not None, found or b""
+        if op == ord("S"):
+            self._lru.set(key, (time.monotonic() + ttl if ttl > 0 else 0.0, value))
+            return True, b""
+        if op == ord("D"):
+            return self._lru.delete(key), b""
+        if op == ord("P"):
+            return True, str(self._lru.delete_prefix(key)).encode()
+        raise ValueError(f"unknown op: {op}")
+
+
+async def _serve(path: str, max_bytes: int) -> None:
+    store = _Store(max_bytes)
+
+    async def client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                op, key_len, ttl, value_len = _REQ.unpack(await reader.readexactly(_REQ.size))
+                body = await reader.readexactly(key_len + value_len)
+                found, out = store.handle(op, body[:key_len].decode("utf-8"), ttl, body[key_len:])
+                writer.write(_RESP.pack(int(found), len(out)) + out)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # 切断、または終了時の取り消し
+        except Exception as e:
+            logger.warning("shared cache server: %s", e)
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)  # 前回の異常終了で残ったソケットファイル
+    parent = os.getppid()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    server = await asyncio.start_unix_server(client, path=path)
+    async with server:
+        # serve.py からの SIGTERM で終わる。親が kill -9 などで先に消えた場合も自分で終わる
+        while not stop.is_set() and os.getppid() == parent:
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+
+def run_server(path: str, max_bytes: int = SHARED_CACHE_MAX_BYTES) -> None:
+    """別プロセスのエントリ（serve.py から multiprocessing で起動する）"""
+    # Ctrl-C はワーカーが終了を待っている間も応答し続けるため無視する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(_serve(path, max_bytes))
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+# ========= クライアント =========
+class SharedCacheClient:
+    def __init__(self, path: str, namespace: str = "", timeout: float = SHARED_CACHE_TIMEOUT) -> None:
+        self.path = path
+        self.ns = namespace
+        self.timeout = timeout
+        self._local = threading.local()
+        self._warned_at = 0.0
+
+    def _conn(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _drop(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    @staticmethod
+    def _recv(sock: socket.socket, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("shared cache closed the connection")
+            buf += chunk
+        return bytes(buf)
+
+    def _call(self, op: str, key: str, value: bytes = b"", ttl: float = 0.0) -> Tuple[bool, bytes]:
+        raw_key = (self.ns + key).encode("utf-8")
+        request = _REQ.pack(ord(op), len(raw_key), ttl, len(value)) + raw_key + value
+        # 切れた接続（サーバ再起動など）は1回だけ張り直す
+        for attempt in (1, 2):
+            try:
+                sock = self._conn()
+                sock.sendall(request)
+                found, length = _RESP.unpack(self._recv(sock, _RESP.size))
+                return bool(found), self._recv(sock, length) if length else b""
+            except OSError as e:
+                self._drop()
+                if attempt == 2:
+                    now = time.monotonic()
+                    if now - self._warned_at > _WARN_INTERVAL:
+                        self._warned_at = now
+                        logger.warning("shared cache unavailable (%s): %s", self.path, e)
+        return False, b""
+
+    def get(self, key: str) -> Optional[bytes]:
+        found, value = self._call("G", key)
+        return value if found else None
+
+    def set(self, key: str, value: bytes, ttl: float = 0.0) -> None:
+        self._call("S", key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self._call("D", key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        found, value = self._call("P", prefix)
+        return int(value) if found and value else 0
+
+
+def client(namespace: str) -> Optional[SharedCacheClient]:
+    """SHARED_CACHE_SOCKET が設定されていれば（serve.py の複数ワーカー時）クライアントを返す"""
+    return SharedCacheClient(SHARED_CACHE_SOCKET, namespace) if SHARED_CACHE_SOCKET else None
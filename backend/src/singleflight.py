@@ -0,0 +1,96 @@
+"""
+同一リクエストのまとめ実行（single-flight）と短時間の結果キャッシュ
+
+概要
+- SingleFlight.do(key, func): 同じ key の実行中があればその結果を待つ（func は1回だけ実行）
+- 成功結果は ttl 秒だけ保持し、再送・リトライにはそれを返す（ttl=0 なら保持しない）
+- shared（任意）: 保持結果をワーカー間でも共有する層（shared_cache。結果は JSON で保存）。
+  まとめ実行そのものはワーカー内だけ（同時の二重送信が別ワーカーに届くと2回実行される）
+  共有層の読み書きはソケットを待つので、イベントループではなくスレッドで行う
+- stats: calls / executions / coalesced（実行中に相乗り）/ cache_hits（保持結果を返した。shared_hits を含む）
+
+注意
+- 実行は独立したタスクで行う。最初の呼び出し元が切断・キャンセルされても、相乗りしている側は待ち続けられる
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from image_cache import LRUCache
+
+
+class SingleFlight:
+    def __init__(self, ttl: float, max_entries: int = 1024,
+                 cacheable: Optional[Callable[[Any], bool]] = None, shared: Any = None) -> None:
+        self.ttl = ttl
+        self.cacheable = cacheable or (lambda _: True)
+        self.shared = shared
+        # 件数で上限を掛ける（1件 = 1）
+        self._results = LRUCache(max_entries, sizeof=lambda _: 1)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0, "cache_hits": 0, "shared_hits": 0}
+
+    def _cached(self, key: str) -> Tuple[bool, Any]:
+        hit = self._results.get(key)
+        if hit is None:
+            return False, None
+        expires, value = hit
+        if expires < time.monotonic():
+            self._results.delete(key)
+            return False, None
+        return True, value
+
+    async def _shared_get(self, key: str) -> Tuple[bool, Any]:
+        # 通常はサブミリ秒だが、共有キャッシュが詰まるとタイムアウトまで待つのでスレッドで
+        data = await asyncio.to_thread(self.shared.get, key)
+        if data is None:
+            return False, None
+        value = json.loads(data)
+        self._results.set(key, (time.monotonic() + self.ttl, value))
+        return True, value
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats["calls"] += 1
+        if self.ttl > 0:
+            found, value = self._cached(key)
+            if found:
+                self.stats["cache_hits"] += 1
+                return value
+            if self.shared is not None and key not in self._inflight:
+                found, value = await self._shared_get(key)
+                if found:
+                    self.stats["cache_hits"] += 1
+                    self.stats["shared_hits"] += 1
+                    return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["executions"] += 1
+            task = asyncio.create_task(func(), name=f"singleflight:{key[:12]}")
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if self.ttl <= 0 or task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if self.cacheable(result):
+            self._results.set(key, (time.monotonic() + self.ttl, result))
+            if self.shared is not None:
+                # 完了コールバック（イベントループ上）なので書き込みはスレッドに任せて待たない
+                data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                asyncio.get_running_loop().run_in_executor(None, self.shared.set, key, data, self.ttl)
+
+    def snapshot(self) -> Dict[str, Any]:
+        calls = self.stats["calls"]
+        saved = self.stats["coalesced"] + self.stats["cache_hits"]
+        return {**self.stats, "inflight": len(self._inflight), "saved_ratio": round(saved / calls, 4) if calls else 0.0}
@@ -0,0 +1,105 @@
+"""
+起動処理（.env の読み込み・重い初期化の後回し・readiness）
+
+概要
+- load_env(): .env を一度だけ読む。各モジュールは import 時に os.getenv するので main.py の最初で呼ぶ
+- Startup: lifespan で start() すると、登録した初期化（スキーマ移行・クライアント生成など）を
+  バックグラウンドで実行する。ポートを開くのはこれを待たない（DB 不達でも起動が止まらない）
+  - 失敗した初期化は STARTUP_RETRY_SEC ごとにやり直す
+- ready(): 初期化がすべて済み、かつ登録したチェック（DB ping など）が通れば True。/ready で返す
+  /health はプロセスの生存確認だけ（依存先の状態は見ない）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STARTUP_RETRY_SEC = float(os.getenv("STARTUP_RETRY_SEC", "5"))
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "2"))
+
+_env_loaded = False
+
+
+def load_env() -> None:
+    global _env_loaded
+    if _env_loaded:
+        return
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        pass  # python-dotenv が無ければ環境変数だけで動かす
+    else:
+        load_dotenv()
+    _env_loaded = True
+
+
+class Startup:
+    def __init__(self, retry_sec: float = STARTUP_RETRY_SEC, check_timeout: float = READY_CHECK_TIMEOUT) -> None:
+        self.retry_sec = retry_sec
+        self.check_timeout = check_timeout
+        self._steps: List[Tuple[str, Callable[[], Any]]] = []
+        self._checks: List[Tuple[str, Callable[[], Any]]] = []
+        self.status: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._log = logging.getLogger("uvicorn.error")
+
+    def add(self, name: str, func: Callable[[], Any]) -> None:
+        """起動時に一度だけ成功させたい初期化（同期関数。スレッドで実行する）"""
+        self._steps.append((name, func))
+        self.status[name] = {"state": "pending"}
+
+    def add_check(self, name: str, func: Callable[[], Any]) -> None:
+        """/ready のたびに実行する確認（async 関数。例外かタイムアウトで not ready）"""
+        self._checks.append((name, func))
+
+    async def _run_step(self, name: str, func: Callable[[], Any]) -> None:
+        attempt = 0
+        while True:
+            attempt += 1
+            t0 = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(func)
+            except Exception as e:
+                self.status[name] = {"state": "failed", "error": str(e), "attempts": attempt}
+                self._log.warning("startup step %s failed (attempt %d): %s", name, attempt, e)
+                await asyncio.sleep(self.retry_sec)
+                continue
+            self.status[name] = {
+                "state": "done",
+                "ms": round((time.perf_counter() - t0) * 1000, 1),
+                "attempts": attempt,
+                **({"result": result} if isinstance(result, (int, float, str)) else {}),
+            }
+            self._log.info("startup step %s done in %.0f ms", name, self.status[name]["ms"])
+            return
+
+    def start(self) -> None:
+        async def run_all() -> None:
+            await asyncio.gather(*(self._run_step(name, func) for name, func in self._steps))
+
+        self._task = asyncio.create_task(run_all(), name="startup")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    @property
+    def started(self) -> bool:
+        return all(s["state"] == "done" for s in self.status.values())
+
+    async def ready(self) -> Tuple[bool, Dict[str, Any]]:
+        checks: Dict[str, Any] = {}
+        if self.started:
+            for name, func in self._checks:
+                try:
+                    await asyncio.wait_for(func(), self.check_timeout)
+                    checks[name] = "ok"
+                except Exception as e:
+                    checks[name] = f"failed: {str(e) or type(e).__name__}"
+        ok = self.started and all(v == "ok" for v in checks.values())
+        return ok, {"ready": ok, "startup": self.status, "checks": checks}
@@ -0,0 +1,258 @@
+"""
+書き込みの後回し（write-behind）: 応答に関係しない INSERT を溜めて複数行でまとめて書く
+
+概要
+- WriteBehind.add(record): レコード（JSON にできる dict）を追記ログに書いてからキューに積む。DB は待たない
+  （close 後、またはキューが max_pending 件で一杯のときは False を返すので、呼び出し側がその場で書く）
+- 書き込みスレッドが batch_size 件たまるか flush_sec 秒たったら flush(records) を1回呼ぶ
+  （flush は複数行 INSERT + 1トランザクションで書く関数。database.py 側で用意する）
+- 一時的な失敗（transient(e) が True: 接続断・ロック待ちなど）のバッチは retry_sec ごとに書き直す
+  （順序は保つ。その間に溜まる分は max_pending 件まで。溢れた分は呼び出し側がその場で書く）
+- それ以外の失敗（型・長さ違いなどデータの問題）はバッチを二分して書き直し、1件でも書けないレコードは
+  <spill_dir>/<name>-dead.log に {"error": ..., "r": record} で移す（1件の不正な行で後続を止めない）
+- close(timeout): 残りを書き切ってから止める（lifespan の終了時）
+
+追記ログ（クラッシュ対策）
+- <spill_dir>/<name>-<pid>.log に1行1件 {"seq": n, "r": record}、書けたら {"ack": n} を追記
+- ack 済みで溜まっているものが無く、ファイルが spill_rotate_bytes を超えたら空にする
+- 起動時（start）に同じ name のログのうち持ち主のいないもの（flock が取れるもの）を読み、
+  ack されていないレコードを自分のキューに積み直してから消す（複数ワーカーでも二重に拾わない）
+- 既定ではレコードごとの fsync はしない（プロセスが落ちても残る。OS ごと落ちた場合の保証が要るなら WB_FSYNC=1）
+
+注意
+- 少なくとも1回の書き込み（DB に書けた直後、ack を書く前に落ちると起動時にもう一度書く）
+- 書き込まれるまでの間（最大 flush_sec 秒）は、同じレコードを DB から読んでも見えない
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+WB_BATCH_SIZE = int(os.getenv("WB_BATCH_SIZE", "200"))
+WB_FLUSH_SEC = float(os.getenv("WB_FLUSH_SEC", "0.5"))
+WB_RETRY_SEC = float(os.getenv("WB_RETRY_SEC", "2"))
+WB_SPILL_DIR = os.getenv("WB_SPILL_DIR", str(pathlib.Path(__file__).resolve().parent.parent / "write_behind"))
+WB_MAX_PENDING = int(os.getenv("WB_MAX_PENDING", "10000"))
+WB_SPILL_ROTATE_BYTES = int(os.getenv("WB_SPILL_ROTATE_BYTES", str(4 * 1024 * 1024)))
+WB_FSYNC = os.getenv("WB_FSYNC", "0") == "1"
+
+logger = logging.getLogger("uvicorn.error")
+
+Record = Dict[str, Any]
+
+
+def _transient(e: BaseException) -> bool:
+    return isinstance(e, (OSError, TimeoutError))
+
+
+class WriteBehind:
+    def __init__(self, name: str, flush: Callable[[List[Record]], Any], *,
+                 batch_size: int = WB_BATCH_SIZE, flush_sec: float = WB_FLUSH_SEC, retry_sec: float = WB_RETRY_SEC,
+                 max_pending: int = WB_MAX_PENDING, transient: Callable[[BaseException], bool] = _transient,
+                 spill_dir: Optional[str] = WB_SPILL_DIR, spill_rotate_bytes: int = WB_SPILL_ROTATE_BYTES,
+                 fsync: bool = WB_FSYNC) -> None:
+        self.name = name
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self.retry_sec = retry_sec
+        self.max_pending = max_pending
+        self.transient = transient
+        self.spill_dir = pathlib.Path(spill_dir) if spill_dir else None
+        self.spill_rotate_bytes = spill_rotate_bytes
+        self.fsync = fsync
+
+        self._queue: Deque[Tuple[int, Record]] = deque()
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._acked = 0
+        self._log: Optional[Any] = None
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self.stats = {"added": 0, "written": 0, "batches": 0, "failures": 0, "recovered": 0, "overflow": 0,
+                      "splits": 0, "dead_lettered": 0, "last_batch_ms": 0.0}
+
+    # ========= 追記ログ =========
+    def _open_log(self) -> None:
+        if self.spill_dir is None:
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._log = open(self.spill_dir / f"{self.name}-{os.getpid()}.log", "ab")
+        # 生きている間はロックを持つ（他プロセスの起動時の回収から外すため）
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        if self._log is None:
+            return
+        self._log.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+    def _dead_letter(self, record: Record, error: BaseException) -> None:
+        """書けないレコードを <name>-dead.log に移す（ワーカー共通のファイルなので flock して1行ずつ追記）"""
+        logger.error("write-behind %s: dead-lettered a record: %r", self.name, error)
+        if self.spill_dir is None:
+            logger.error("write-behind %s: dropped %s", self.name, json.dumps(record, ensure_ascii=False, default=str))
+            return
+        line = json.dumps({"t": time.time(), "error": repr(error), "r": record}, ensure_ascii=False, default=str)
+        with open(self.spill_dir / f"{self.name}-dead.log", "ab") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.write(line.encode("utf-8") + b"\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _recover(self) -> List[Record]:
+        """持ち主のいない（ロックの取れる）ログから ack されていないレコードを集めて、そのログを消す"""
+        if self.spill_dir is None:
+            return []
+        records: List[Record] = []
+        for path in sorted(self.spill_dir.glob(f"{self.name}-[0-9]*.log")):
+            with open(path, "rb") as f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # 動いている別ワーカーのログ
+                if not path.exists() or path.stat().st_ino != os.fstat(f.fileno()).st_ino:
+                    continue  # ロック待ちの間に別のプロセスが回収して消した
+                pending: Dict[int, Record] = {}
+                acked = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 書きかけの最終行
+                    if "ack" in entry:
+                        acked = max(acked, entry["ack"])
+                    else:
+                        pending[entry["seq"]] = entry["r"]
+                records += [r for seq, r in sorted(pending.items()) if seq > acked]
+                path.unlink()
+        return records
+
+    # ========= 受け付け =========
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            recovered = self._recover()
+            self._open_log()
+            self._thread = threading.Thread(target=self._loop, name=f"write-behind-{self.name}", daemon=True)
+        for record in recovered:
+            self.add(record, force=True)
+        self.stats["recovered"] += len(recovered)
+        if recovered:
+            logger.warning("write-behind %s: recovered %d unwritten record(s) from spill log", self.name, len(recovered))
+        self._thread.start()
+
+    def add(self, record: Record, force: bool = False) -> bool:
+        """積めたら True。close 後とキューが一杯のときは False（呼び出し側で直接書く）。force は起動時の回収用"""
+        with self._cond:
+            if self._closing:
+                return False
+            if len(self._queue) >= self.max_pending and not force:
+                self.stats["overflow"] += 1
+                return False
+            self._seq += 1
+            self._append({"seq": self._seq, "r": record})
+            self._queue.append((self._seq, record))
+            self.stats["added"] += 1
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify()
+            return True
+
+    # ========= 書き込みスレッド =========
+    def _take(self) -> List[Tuple[int, Record]]:
+        """batch_size 件たまるか、最初の1件から flush_sec 秒たつまで待って取り出す（取り出すだけで消さない）"""
+        with self._cond:
+            while not self._queue and not self._closing:
+                self._cond.wait()
+            deadline = time.monotonic() + self.flush_sec
+            while len(self._queue) < self.batch_size and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+
+    def _write(self, batch: List[Tuple[int, Record]]) -> bool:
+        """
+        batch を先頭から書く。データの問題で書けなければ二分して書き直し、1件で書けないものは dead-letter へ。
+        一時的な失敗なら False（それまでに片付いた先頭の分はキューから外してある）
+        """
+        t0 = time.perf_counter()
+        parts = [batch]
+        while parts:
+            part = parts.pop(0)
+            try:
+                self.flush([r for _, r in part])
+            except Exception as e:
+                self.stats["failures"] += 1
+                if self.transient(e):
+                    logger.warning("write-behind %s: flush of %d record(s) failed, will retry: %s", self.name, len(part), e)
+                    return False
+                if len(part) > 1:
+                    mid = len(part) // 2
+                    parts[:0] = [part[:mid], part[mid:]]
+                    self.stats["splits"] += 1
+                    continue
+                self._dead_letter(part[0][1], e)
+                self.stats["dead_lettered"] += 1
+            else:
+                self.stats["written"] += len(part)
+                self.stats["batches"] += 1
+            self._done(part)
+        self.stats["last_batch_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return True
+
+    def _done(self, part: List[Tuple[int, Record]]) -> None:
+        """片付いた（書けた / dead-letter に移した）先頭の part をキューから外して ack を書く"""
+        with self._cond:
+            for _ in part:
+                self._queue.popleft()
+            self._acked = part[-1][0]
+            self._append({"ack": self._acked})
+            if not self._queue and self._log is not None and os.fstat(self._log.fileno()).st_size > self.spill_rotate_bytes:
+                self._log.truncate(0)
+            self._cond.notify_all()
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take()
+            if not batch:
+                return  # closing かつ空
+            if not self._write(batch):
+                with self._cond:
+                    if self._closing:
+                        return  # 書けなかった分は追記ログに残り、次の起動で回収される
+                    self._cond.wait(self.retry_sec)
+
+    def close(self, timeout: float) -> bool:
+        """残りを書き切って止める。timeout 秒以内に終われば True（残りは追記ログから次回回収）"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._thread is not None and self._thread.is_alive():
+            return False  # 書き込み中のまま終了する（ログは残るので次の起動で回収）
+        with self._cond:
+            if self._log is not None:
+                self._log.close()
+                if not self._queue:
+                    os.unlink(self._log.name)  # 全部書けたのでログは不要
+                self._log = None
+            return not self._queue
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {**self.stats, "pending": len(self._queue)}